@@ -0,0 +1,272 @@
+"""Search for the most users a running swarm sustains within an SLO.
+
+A probe sets a user count, waits for locust to spawn them and for the
+server to settle, then holds it while sampling locust's live stats, and
+passes if every SLO criterion does. The search probes geometrically growing
+user counts until one fails (or the maximum passes), then bisects between
+the last count that passed and the first that failed until they are within
+the wanted resolution, so the number of probes, and so the run time, is
+bounded by the logarithms of the range and of the resolution.
+
+While holding, abort criteria are checked at every sample, so a probe that
+has the server falling over ends straight away instead of holding it down
+for the whole probe; the users are then stopped for a cooldown to let it
+recover before the next, smaller, probe.
+
+Criteria are callables taking a Window and returning None if it's fine, or
+a reason it isn't, so other exit criteria can be plugged in beside
+p95_within() and error_rate_within().
+"""
+import csv
+import datetime
+import math
+import statistics
+import time
+from collections import namedtuple
+
+# One sample of the Aggregated locust stats; requests and failures are
+# cumulative, p95 is locust's rolling (roughly 10 second) 95th percentile
+Sample = namedtuple("Sample", "time users requests failures p95 rps")
+# Stats over part of a probe; p95 in milliseconds, seconds of wall time
+Window = namedtuple("Window", "users seconds requests failures p95 rps")
+ProbeResult = namedtuple("ProbeResult", "window passed aborted reason")
+
+# Locust caches its stats for a few seconds, so only call a window with no
+# requests completed a stall once it's longer than this
+STALL_SECONDS = 10.0
+
+PROBE_FIELDS = [
+    "timestamp", "users", "seconds", "requests", "failures", "error_rate",
+    "p95", "rps", "passed", "aborted", "reason",
+]
+
+
+def sample_from_report(report, now=None):
+    """Make a Sample from a locust /stats/requests report.
+    """
+    total = {}
+    for entry in report.get("stats", []):
+        if entry.get("name") == "Aggregated":
+            total = entry
+    percentiles = report.get("current_response_time_percentiles") or {}
+    p95 = percentiles.get("response_time_percentile_0.95")
+    if p95 is None:
+        # Older locust 2.x reports it at the top level
+        p95 = report.get("current_response_time_percentile_95")
+    return Sample(
+        time=time.monotonic() if now is None else now,
+        users=report.get("user_count"),
+        requests=total.get("num_requests", 0),
+        failures=total.get("num_failures", 0),
+        p95=p95,
+        rps=report.get("current_rps", total.get("current_rps")),
+    )
+
+
+def summarize(samples, latest=False):
+    """Summarize the samples taken over part of a probe.
+
+    :arg latest:
+        Use the last sample's p95 rather than the median of them all, to see
+        how things are right now
+    """
+    first, last = samples[0], samples[-1]
+    p95s = [sample.p95 for sample in samples if sample.p95 is not None]
+    if latest:
+        p95 = last.p95
+    else:
+        p95 = statistics.median(p95s) if p95s else None
+    rps = [sample.rps for sample in samples if sample.rps is not None]
+    return Window(
+        users=last.users,
+        seconds=last.time - first.time,
+        requests=last.requests - first.requests,
+        failures=last.failures - first.failures,
+        p95=p95,
+        rps=statistics.mean(rps) if rps else None,
+    )
+
+
+def error_rate(window):
+    if not window.requests:
+        return None
+    return window.failures / window.requests
+
+
+def p95_within(milliseconds):
+    """Make a criterion failing windows whose p95 is over a limit.
+    """
+    def criterion(window):
+        if window.p95 is not None and window.p95 > milliseconds:
+            return "p95 {0:.0f}ms over {1:.0f}ms".format(
+                window.p95, milliseconds,
+            )
+        return None
+    return criterion
+
+
+def error_rate_within(ratio):
+    """Make a criterion failing windows with too many failed requests.
+
+    A window without a single completed request fails too: a server that
+    has stopped answering has no errors to count.
+    """
+    def criterion(window):
+        rate = error_rate(window)
+        if rate is None:
+            if window.seconds >= STALL_SECONDS:
+                return "no requests completed in {0:.0f}s".format(
+                    window.seconds,
+                )
+            return None
+        if rate > ratio:
+            return "error rate {0:.2%} over {1:.2%}".format(rate, ratio)
+        return None
+    return criterion
+
+
+def first_failure(criteria, window):
+    for criterion in criteria:
+        reason = criterion(window)
+        if reason is not None:
+            return reason
+    return None
+
+
+class CapacitySearch:
+    """Find the largest user count passing the SLO criteria.
+    """
+
+    def __init__(self, set_users, sample, slo, abort=(), min_users=10,
+                 max_users=1000, growth=2.0, resolution=10, spawn_rate=100,
+                 settle=30.0, hold=60.0, cooldown=60.0, interval=1.0,
+                 probes_file=None):
+        """
+        :arg set_users:
+            Called with a user count to change the swarm to
+        :arg sample:
+            Called to get a Sample of the live stats, or None if it can't
+        :arg slo:
+            Criteria the held window of a probe must pass
+        :arg abort:
+            Criteria checked at every sample while holding, with the latest
+            p95, which end the probe as failed
+        :arg settle:
+            Seconds to wait after spawning before measuring, which should
+            be longer than locust's 10 second p95 window
+        :arg probes_file:
+            Optional CSV path to log every probe's result to
+        """
+        self.set_users = set_users
+        self.sample = sample
+        self.slo = list(slo)
+        self.abort = list(abort)
+        self.min_users = max(1, min_users)
+        self.max_users = max(self.min_users, max_users)
+        self.growth = max(growth, 1.1)
+        self.resolution = max(1, resolution)
+        self.spawn_rate = spawn_rate
+        self.settle = settle
+        self.hold = hold
+        self.cooldown = cooldown
+        self.interval = interval
+        self.probes_file = probes_file
+        self.users = 0
+        self.results = []
+
+    def run(self):
+        """Run the search.
+
+        :returns:
+            (largest user count that passed or 0, smallest that failed or
+            None if even max_users passed)
+        """
+        good, bad = 0, None
+        users = self.min_users
+        # Grow until something fails
+        while True:
+            if self.probe(users).passed:
+                good = users
+                if users >= self.max_users:
+                    break
+                users = min(self.max_users, math.ceil(users * self.growth))
+            else:
+                bad = users
+                break
+        # Then bisect
+        while bad is not None and bad - good > self.resolution:
+            users = (good + bad) // 2
+            if self.probe(users).passed:
+                good = users
+            else:
+                bad = users
+        return good, bad
+
+    def probe(self, users):
+        started = time.time()
+        print("Probing", users, "users")
+        ramp = abs(users - self.users) / self.spawn_rate
+        self.set_users(users)
+        self.users = users
+        time.sleep(ramp + self.settle)
+        samples = []
+        reason = None
+        aborted = False
+        deadline = time.monotonic() + self.hold
+        next_sample = time.monotonic()
+        # Sample on a fixed monotonic schedule, like StatsLogger
+        while True:
+            sample = self.sample()
+            if sample is not None:
+                samples.append(sample)
+            if len(samples) > 1:
+                reason = first_failure(
+                    self.abort, summarize(samples, latest=True),
+                )
+                if reason is not None:
+                    aborted = True
+                    break
+            if time.monotonic() >= deadline:
+                break
+            next_sample += self.interval
+            time.sleep(max(0, min(next_sample, deadline) - time.monotonic()))
+        if len(samples) < 2:
+            window = Window(users, 0, 0, 0, None, None)
+            reason = reason or "no stats"
+        else:
+            window = summarize(samples)
+            if reason is None:
+                reason = first_failure(self.slo, window)
+        result = ProbeResult(window, reason is None, aborted, reason)
+        self.results.append(result)
+        self.log(started, users, result)
+        if aborted:
+            # Give the server a chance to recover before the next probe
+            print("Aborted:", reason, "- cooling down for", self.cooldown, "s")
+            self.set_users(0)
+            self.users = 0
+            time.sleep(self.cooldown)
+        return result
+
+    def log(self, started, users, result):
+        window = result.window
+        rate = error_rate(window)
+        print(
+            users, "users:", "passed" if result.passed else "failed",
+            "p95", window.p95, "ms, error rate",
+            "-" if rate is None else "{0:.2%}".format(rate),
+            "rps", None if window.rps is None else round(window.rps, 1),
+            "" if result.reason is None else result.reason,
+        )
+        if not self.probes_file:
+            return
+        with open(self.probes_file, "a", newline="") as stream:
+            writer = csv.writer(stream)
+            if stream.tell() == 0:
+                writer.writerow(PROBE_FIELDS)
+            writer.writerow([
+                datetime.datetime.fromtimestamp(started).isoformat(), users,
+                round(window.seconds, 3), window.requests, window.failures,
+                rate, window.p95, window.rps, result.passed, result.aborted,
+                result.reason or "",
+            ])
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Read and write compact binary bbox corpus files.
+
+A corpus file is a small fixed header followed by fixed-width records of
+little-endian float64 values, one record per bbox (e.g. the four
+west/south/east/north values written by mercantile_gen).
+
+Readers memory-map the file read-only, so every locust process on a host
+shares the same page cache copy of the data instead of each one holding
+its own list of Python strings.
+"""
+import argparse
+import csv
+import mmap
+import struct
+import sys
+from array import array
+from itertools import count
+from pathlib import Path
+
+# File signature, then format version and number of float64 columns per row
+MAGIC = b"BBOXF64\n"
+VERSION = 1
+HEADER = struct.Struct("<8sII")
+
+# Suffix used for corpus files, as opposed to e.g. ".csv"
+SUFFIX = ".bbox"
+
+# How many values to buffer before each write when converting
+WRITE_BATCH = 65536
+
+
+class CorpusError(Exception):
+    """Raised when a corpus file is missing, truncated or not a corpus.
+    """
+
+
+class BBoxCorpus:
+    """Read-only, memory-mapped view of a corpus file.
+
+    Supports len() and indexing; each row comes back as a tuple of floats.
+    """
+
+    def __init__(self, path):
+        """
+        :arg path:
+            Path to a corpus file, e.g. "data/wms_256_tiles.bbox"
+        """
+        if sys.byteorder != "little":
+            raise CorpusError("corpus files can only be mapped on "
+                              "little-endian hosts")
+        self.path = Path(path)
+        with open(self.path, "rb") as stream:
+            header = stream.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise CorpusError(f"{self.path}: truncated header")
+            magic, version, columns = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise CorpusError(f"{self.path}: not a bbox corpus file")
+            if version != VERSION:
+                raise CorpusError(
+                    f"{self.path}: unsupported corpus version {version}"
+                )
+            if not columns:
+                raise CorpusError(f"{self.path}: corpus has no columns")
+            # mmap keeps its own reference to the file, so it's fine to
+            # close our handle once this returns
+            self._mmap = mmap.mmap(
+                stream.fileno(), 0, access=mmap.ACCESS_READ,
+            )
+        data_size = len(self._mmap) - HEADER.size
+        if data_size % (8 * columns):
+            raise CorpusError(f"{self.path}: truncated record")
+        self.columns = columns
+        self._values = memoryview(self._mmap)[HEADER.size:].cast("d")
+        self._length = len(self._values) // columns
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("corpus index out of range")
+        start = index * self.columns
+        return tuple(self._values[start:start + self.columns])
+
+    def __iter__(self):
+        for index in range(0, self._length):
+            yield self[index]
+
+    def cycle(self, start=0):
+        """Yield rows forever, wrapping around at the end of the corpus.
+
+        Behaves like itertools.cycle over the rows without copying them.
+        """
+        if not self._length:
+            return
+        for index in count(start):
+            yield self[index % self._length]
+
+
+def write_corpus(path, rows, columns):
+    """Write an iterable of rows out as a corpus file.
+
+    :arg path:
+        Where to write the corpus file
+    :arg rows:
+        Iterable of sequences of numbers (or numeric strings),
+        each having exactly `columns` items
+    :arg columns:
+        Number of values per row
+    :returns:
+        Number of rows written
+    """
+    written = 0
+    buffer = array("d")
+    with open(path, "wb") as stream:
+        stream.write(HEADER.pack(MAGIC, VERSION, columns))
+        for row in rows:
+            if len(row) != columns:
+                raise CorpusError(
+                    f"row {written} has {len(row)} values, "
+                    f"expected {columns}"
+                )
+            buffer.extend(float(value) for value in row)
+            written += 1
+            if len(buffer) >= WRITE_BATCH:
+                buffer.tofile(stream)
+                del buffer[:]
+        buffer.tofile(stream)
+    return written
+
+
+def convert_csv(csv_path, corpus_path):
+    """Convert a bbox CSV file (e.g. old mercantile_gen output) to a corpus.
+    """
+    with open(csv_path, newline="") as stream:
+        reader = csv.reader(stream)
+        first = next(reader, None)
+        if first is None:
+            raise CorpusError(f"{csv_path}: no rows to convert")
+        rows = _chain_first(first, reader)
+        return write_corpus(corpus_path, rows, len(first))
+
+
+def _chain_first(first, rest):
+    yield first
+    yield from rest
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Convert a bbox CSV file to a binary bbox corpus",
+    )
+    parser.add_argument(
+        dest="csv_path",
+    )
+    parser.add_argument(
+        dest="corpus_path",
+        nargs="?",
+        help="defaults to the CSV path with a .bbox suffix",
+    )
+    return parser
+
+
+def main():
+    parser = argument_parser()
+    options = parser.parse_args()
+    csv_path = Path(options.csv_path)
+    corpus_path = options.corpus_path or csv_path.with_suffix(SUFFIX)
+    written = convert_csv(csv_path, corpus_path)
+    print(f"wrote {written} rows to {corpus_path}")
+
+
+if __name__ == "__main__":
+    main()
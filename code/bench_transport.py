@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Measure how many requests per second each transport can drive per core.
+
+Runs greenlets hammering one URL through each transport in turn, the way
+the behaviors use them (catch_response, streamed and validated bodies), and
+reports requests per second of wall time and per second of this process's
+CPU time. Without --url, a trivial keep-alive server is started in another
+process so the numbers reflect client overhead, not GeoServer, e.g.::
+
+    ./code/bench_transport.py --duration 10 --concurrency 32
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import multiprocessing  # noqa: E402
+import time  # noqa: E402
+import gevent  # noqa: E402
+from gevent.server import StreamServer  # noqa: E402
+from locust.event import Events  # noqa: E402
+from locust.clients import HttpSession  # noqa: E402
+import transport  # noqa: E402
+import validation  # noqa: E402
+
+TRANSPORTS = {
+    "requests": HttpSession,
+    "raw": transport.RawHTTPClient,
+}
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the HTTP transports available to behaviors",
+    )
+    parser.add_argument(
+        "--url",
+        help="base URL to benchmark against; default starts a local server",
+    )
+    parser.add_argument(
+        "--path",
+        default="/geoserver/wms?service=wms&request=GetMap",
+    )
+    parser.add_argument(
+        "--transports",
+        nargs="+",
+        choices=sorted(TRANSPORTS),
+        default=sorted(TRANSPORTS),
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=10.0,
+        help="seconds to run each transport for",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="greenlets (simulated users), each with its own client",
+    )
+    parser.add_argument(
+        "--body-size",
+        type=int,
+        default=16 * 1024,
+        help="bytes of fake PNG the local server sends",
+    )
+    parser.add_argument(
+        "--chunked",
+        action="store_true",
+        help="make the local server use chunked transfer encoding",
+    )
+    return parser
+
+
+def serve(port, body_size, chunked):
+    """Answer every request on a keep-alive connection with a fixed PNG.
+    """
+    body = b"\x89PNG\r\n\x1a\n" + bytes(max(0, body_size - 8))
+    if chunked:
+        payload = (
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: image/png\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+            + b"%x\r\n" % len(body) + body + b"\r\n0\r\n\r\n"
+        )
+    else:
+        payload = (
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: image/png\r\n"
+            b"Content-Length: %d\r\n\r\n" % len(body)
+        ) + body
+
+    def handle(sock, address):
+        reader = sock.makefile("rb")
+        while True:
+            line = reader.readline()
+            if not line:
+                break
+            if line in (b"\r\n", b"\n"):
+                sock.sendall(payload)
+
+    StreamServer(("127.0.0.1", port), handle).serve_forever()
+
+
+def start_server(body_size, chunked):
+    probe = StreamServer(("127.0.0.1", 0), lambda *args: None)
+    probe.init_socket()
+    port = probe.server_port
+    probe.close()
+    process = multiprocessing.Process(
+        target=serve, args=(port, body_size, chunked), daemon=True,
+    )
+    process.start()
+    time.sleep(0.5)
+    return process, "http://127.0.0.1:{0}".format(port)
+
+
+def bench(client_class, url, path, duration, concurrency):
+    """Run one transport flat out.
+
+    :returns:
+        (successes, failures, wall seconds, CPU seconds)
+    """
+    counts = {"success": 0, "failure": 0}
+
+    def on_request(exception=None, **kwargs):
+        counts["failure" if exception else "success"] += 1
+
+    events = Events()
+    events.request.add_listener(on_request)
+    deadline = time.monotonic() + duration
+
+    def user():
+        client = client_class(url, events.request, None)
+        while time.monotonic() < deadline:
+            with client.get(
+                path, name="bench", catch_response=True, stream=True,
+            ) as response:
+                problem = validation.consume(response).problem("png")
+                if problem:
+                    response.failure(problem)
+                else:
+                    response.success()
+
+    wall = time.monotonic()
+    cpu = time.process_time()
+    gevent.joinall([gevent.spawn(user) for _ in range(concurrency)])
+    wall = time.monotonic() - wall
+    cpu = time.process_time() - cpu
+    return counts["success"], counts["failure"], wall, cpu
+
+
+def main():
+    parser = argument_parser()
+    options = parser.parse_args()
+    server = None
+    url = options.url
+    if url is None:
+        server, url = start_server(options.body_size, options.chunked)
+    try:
+        print("{0:<10} {1:>9} {2:>9} {3:>12} {4:>12}".format(
+            "transport", "requests", "failures", "req/s", "req/CPU s",
+        ))
+        for name in options.transports:
+            successes, failures, wall, cpu = bench(
+                TRANSPORTS[name], url, options.path, options.duration,
+                options.concurrency,
+            )
+            total = successes + failures
+            print("{0:<10} {1:>9} {2:>9} {3:>12.0f} {4:>12.0f}".format(
+                name, total, failures, total / wall, total / max(cpu, 1e-9),
+            ))
+    finally:
+        if server is not None:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Discover WMS layers, styles and formats from GetCapabilities.
+
+GeoServer's capabilities documents run to megabytes for a big catalog, so
+they are fetched once per process, not per user, and parsed as they stream
+in with lxml's iterparse, clearing each Layer element once it's been read.
+Only the summary (layer names, styles, bounding boxes and GetMap formats)
+is kept, and it's cached on disk as JSON keyed by host along with the
+response's ETag: later runs send If-None-Match, and reuse the cache
+without downloading or parsing anything when the server answers 304 Not
+Modified, or without even asking while it's younger than max_age.
+"""
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+from pathlib import Path
+from urllib.parse import quote
+import gevent.lock
+import requests
+from lxml import etree
+from settings import env_str, env_float
+
+LOG = logging.getLogger("capabilities")
+
+CACHE_DIR = env_str("WMS_CAPABILITIES_CACHE", "data/capabilities")
+MAX_AGE = env_float("WMS_CAPABILITIES_MAX_AGE", 3600.0)
+
+# Geographic bounds are west, south, east, north in degrees
+Layer = namedtuple("Layer", "name title styles bounds queryable")
+Capabilities = namedtuple("Capabilities", "layers formats etag")
+
+
+def _local(tag):
+    """Strip the namespace, if any, from an element's tag.
+    """
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _child_text(element, name):
+    for child in element:
+        if _local(child.tag) == name:
+            return (child.text or "").strip()
+    return None
+
+
+def _layer_bounds(element):
+    """Get a Layer element's own geographic bounds, if it gives any.
+
+    WMS 1.3.0 uses EX_GeographicBoundingBox, 1.1.1 LatLonBoundingBox.
+    """
+    for child in element:
+        tag = _local(child.tag)
+        if tag == "EX_GeographicBoundingBox":
+            values = [
+                _child_text(child, name) for name in (
+                    "westBoundLongitude", "southBoundLatitude",
+                    "eastBoundLongitude", "northBoundLatitude",
+                )
+            ]
+            if None not in values:
+                return tuple(float(value) for value in values)
+        elif tag == "LatLonBoundingBox":
+            return tuple(
+                float(child.get(name)) for name in
+                ("minx", "miny", "maxx", "maxy")
+            )
+    return None
+
+
+def parse(stream):
+    """Parse a WMS capabilities document from a file-like object.
+
+    Layers without a bounding box of their own inherit their parent's, as
+    the WMS spec says; layers without a name can't be requested, so only
+    contribute bounds.
+
+    :returns:
+        Capabilities, with etag None
+    """
+    layers = []
+    formats = []
+    # One list per open Layer element, of its finished descendants
+    open_layers = []
+    for event, element in etree.iterparse(
+        stream, events=("start", "end"), huge_tree=True,
+    ):
+        tag = _local(element.tag)
+        if event == "start":
+            if tag == "Layer":
+                open_layers.append([])
+            continue
+        if tag == "Format" and _local(element.getparent().tag) == "GetMap":
+            formats.append((element.text or "").strip())
+        elif tag == "Layer":
+            descendants = open_layers.pop()
+            bounds = _layer_bounds(element)
+            if bounds is not None:
+                descendants = [
+                    layer if layer.bounds is not None
+                    else layer._replace(bounds=bounds)
+                    for layer in descendants
+                ]
+            name = _child_text(element, "Name")
+            if name:
+                styles = [
+                    _child_text(child, "Name") for child in element
+                    if _local(child.tag) == "Style"
+                ]
+                descendants.append(Layer(
+                    name=name,
+                    title=_child_text(element, "Title"),
+                    styles=[style for style in styles if style],
+                    bounds=bounds,
+                    queryable=element.get("queryable") == "1",
+                ))
+            if open_layers:
+                open_layers[-1].extend(descendants)
+            else:
+                layers.extend(descendants)
+            # Done with it; keep memory flat however big the document is.
+            # Its parent's own Name, Style etc. come before it, so they
+            # are kept for when the parent ends.
+            element.clear()
+    return Capabilities(layers=layers, formats=formats, etag=None)
+
+
+def cache_path(host, cache_dir=CACHE_DIR):
+    return Path(cache_dir, quote(host, safe="") + ".json")
+
+
+def _load_cache(path):
+    try:
+        with open(path) as stream:
+            data = json.load(stream)
+    except (OSError, ValueError):
+        return None, None
+    capabilities = Capabilities(
+        layers=[
+            Layer(**dict(layer, bounds=tuple(layer["bounds"])
+                         if layer["bounds"] else None))
+            for layer in data["layers"]
+        ],
+        formats=data["formats"],
+        etag=data["etag"],
+    )
+    return capabilities, data["fetched"]
+
+
+def _save_cache(path, capabilities):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(".tmp{0}".format(os.getpid()))
+    with open(temporary, "w") as stream:
+        json.dump({
+            "fetched": time.time(),
+            "etag": capabilities.etag,
+            "formats": capabilities.formats,
+            "layers": [layer._asdict() for layer in capabilities.layers],
+        }, stream)
+    # Other processes on the host may be reading it
+    os.replace(temporary, path)
+
+
+def fetch(host, uri="/geoserver/ows", cache_dir=CACHE_DIR, max_age=MAX_AGE,
+          session=requests):
+    """Get a server's WMS capabilities, from the disk cache if still fresh.
+
+    A cache older than max_age is revalidated with its ETag. If the server
+    can't be reached, a stale cache is used rather than failing.
+
+    :arg host:
+        e.g. "https://geoserver.example.com"
+    """
+    path = cache_path(host, cache_dir)
+    cached, fetched = _load_cache(path)
+    if cached is not None and time.time() - fetched < max_age:
+        return cached
+    headers = {}
+    if cached is not None and cached.etag:
+        headers["If-None-Match"] = cached.etag
+    try:
+        response = session.get(
+            host.rstrip("/") + uri,
+            params={"service": "WMS", "version": "1.3.0",
+                    "request": "GetCapabilities"},
+            headers=headers,
+            stream=True,
+            timeout=60,
+        )
+        with response:
+            if response.status_code == 304 and cached is not None:
+                LOG.info("capabilities for %s not modified", host)
+                capabilities = cached
+            else:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                capabilities = parse(response.raw)._replace(
+                    etag=response.headers.get("ETag"),
+                )
+                LOG.info("parsed %d layers from %s capabilities",
+                         len(capabilities.layers), host)
+    except (requests.RequestException, etree.XMLSyntaxError) as error:
+        if cached is None:
+            raise
+        LOG.warning("using stale capabilities for %s: %s", host, error)
+        return cached
+    _save_cache(path, capabilities)
+    return capabilities
+
+
+class Discovery:
+    """Fetch capabilities once per process, however many users ask.
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :arg kwargs:
+            Passed on to fetch()
+        """
+        self.kwargs = kwargs
+        self._lock = gevent.lock.Semaphore()
+        self._results = {}
+
+    def get(self, host):
+        """Get a host's capabilities; other greenlets wait for the first.
+
+        :returns:
+            Capabilities, or None if they couldn't be fetched and weren't
+            cached. The failure is logged once, not for every user.
+        """
+        with self._lock:
+            if host not in self._results:
+                try:
+                    self._results[host] = fetch(host, **self.kwargs)
+                except (requests.RequestException,
+                        etree.XMLSyntaxError) as error:
+                    LOG.error("could not discover %s: %s", host, error)
+                    self._results[host] = None
+            return self._results[host]
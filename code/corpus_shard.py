@@ -0,0 +1,231 @@
+"""Deal out corpus rows so that locust processes don't repeat each other.
+
+A corpus iterator created at import time makes every process walk the same
+rows in the same order, so the first minutes of a distributed test hit the
+same tiles everywhere and warm GeoServer's caches unrealistically. Instead:
+
+- rows are visited in a seeded affine permutation of the corpus,
+  i -> (a * i + c) mod n, which needs no memory however big the corpus is
+- the permuted order is split into contiguous blocks, one per worker
+  unless CORPUS_SHARDS says otherwise, and each process cycles through its
+  own block, so processes never overlap; users in a process share its
+  cursor, so they never overlap either. The blocks are worked out again
+  whenever a test starts, in case the number of workers has changed
+- with CORPUS_HOT_RATIO set, that fraction of requests is instead drawn
+  from a small hot set shared by every process, which stays cached, and
+  requests are named with a " [hot]" or " [cold]" suffix so the warm and
+  cold paths' throughput and latency can be told apart
+"""
+import math
+import random
+from locust import events
+from locust.runners import MasterRunner, WorkerRunner
+from settings import env_int, env_float
+
+HOT = "hot"
+COLD = "cold"
+
+# Custom message in which the master tells workers how many there are
+WORKERS_MESSAGE = "corpus_shard_workers"
+
+# The locust Environment, once it has been initialized
+_environment = None
+# Workers in the test, as the master last said; 1 for standalone locusts
+_worker_count = 1
+# Every CorpusSampler made, to re-shard when a test starts
+_samplers = []
+
+
+def on_init(environment, **kwargs):
+    global _environment
+    _environment = environment
+    if isinstance(environment.runner, WorkerRunner):
+        environment.runner.register_message(WORKERS_MESSAGE, on_workers)
+
+
+def on_test_start(environment, **kwargs):
+    # The master fires this before sending out any spawn jobs, and workers
+    # handle messages in order, so they know before their first task
+    if isinstance(environment.runner, MasterRunner):
+        environment.runner.send_message(
+            WORKERS_MESSAGE, {"count": environment.runner.worker_count},
+        )
+    _reset_samplers()
+
+
+def on_workers(msg, **kwargs):
+    global _worker_count
+    _worker_count = max(1, msg.data["count"])
+    _reset_samplers()
+
+
+def _reset_samplers():
+    # A test restarted with another number of workers needs new shards
+    for sampler in _samplers:
+        sampler.reset()
+
+
+events.init.add_listener(on_init)
+events.test_start.add_listener(on_test_start)
+
+
+def worker_index():
+    """Get this process's worker index, as handed out by the master.
+
+    Only known once the worker has connected, so ask at the first task, not
+    at import time. Standalone locusts are index 0.
+    """
+    runner = _environment.runner if _environment is not None else None
+    return max(0, getattr(runner, "worker_index", 0))
+
+
+def worker_count():
+    """Get the number of workers in the test, as the master said at its start.
+    """
+    return _worker_count
+
+
+def affine_permutation(length, seed):
+    """Get (multiplier, offset) for a seeded permutation of range(length).
+
+    :arg seed:
+        None for the identity permutation, i.e. the corpus's own order
+    """
+    if seed is None or length < 2:
+        return 1, 0
+    rng = random.Random(seed)
+    while True:
+        multiplier = rng.randrange(1, length)
+        if math.gcd(multiplier, length) == 1:
+            return multiplier, rng.randrange(0, length)
+
+
+class CorpusSampler:
+    """Hand out corpus row indexes from one shard, plus a shared hot set.
+    """
+
+    def __init__(self, length, shard=None, shards=None, seed=None,
+                 hot_ratio=0.0, hot_rows=1000):
+        """
+        :arg length:
+            Rows in the corpus
+        :arg shard:
+            This process's shard, from 0; None to use its worker index
+            (modulo shards) once the first row is asked for
+        :arg shards:
+            How many disjoint shards the corpus is split into; None for the
+            number of workers, once the first row is asked for
+        :arg seed:
+            Seed for the permutation, the same in every process
+        :arg hot_ratio:
+            Fraction of rows to draw from the hot set
+        :arg hot_rows:
+            Size of the hot set, taken from the start of the permutation
+        """
+        self.length = length
+        # As asked for; the ones in use are worked out by _start()
+        self._shards = max(1, shards) if shards is not None else None
+        self._shard = shard
+        self.shards = None
+        self.shard = None
+        self.multiplier, self.offset = affine_permutation(length, seed)
+        self.hot_ratio = hot_ratio
+        self.hot_rows = min(hot_rows, length) if hot_ratio > 0 else 0
+        self._credit = 0.0
+        self._hot = None
+        self._cold = None
+        _samplers.append(self)
+
+    def reset(self):
+        """Work the shard out again at the next row, e.g. for a new test.
+        """
+        self._hot = None
+        self._cold = None
+
+    def _start(self):
+        """Work out this shard's ranges of the permuted order.
+        """
+        if not self.length:
+            raise ValueError("can't sample rows from an empty corpus")
+        self.shards = self._shards or worker_count()
+        if self._shard is None:
+            self.shard = worker_index() % self.shards
+        else:
+            self.shard = self._shard % self.shards
+        cold_rows = self.length - self.hot_rows
+        start = self.hot_rows + cold_rows * self.shard // self.shards
+        end = self.hot_rows + cold_rows * (self.shard + 1) // self.shards
+        if start == end:
+            # More shards than rows; share what there is
+            start, end = self.hot_rows, self.length
+        if start == end:
+            start, end = 0, self.length
+        self._cold = _Cursor(start, end, start)
+        self._hot = _Cursor(
+            0, self.hot_rows, self.hot_rows * self.shard // self.shards,
+        )
+
+    def permute(self, position):
+        """Get the corpus row at a position in the permuted order.
+        """
+        return (self.multiplier * position + self.offset) % self.length
+
+    def next(self):
+        """Get the next row to request.
+
+        :returns:
+            (index, temperature), temperature being HOT or COLD if a hot
+            ratio is set, or None otherwise
+        """
+        if self._cold is None:
+            self._start()
+        if not self.hot_rows:
+            return self.permute(self._cold.next()), None
+        # Deterministic sampling, as in request_log
+        self._credit += self.hot_ratio
+        if self._credit >= 1.0:
+            self._credit -= 1.0
+            return self.permute(self._hot.next()), HOT
+        return self.permute(self._cold.next()), COLD
+
+
+class _Cursor:
+    """Cycle through positions start <= position < end.
+    """
+
+    def __init__(self, start, end, position):
+        self.start = start
+        self.end = end
+        self.position = position
+
+    def next(self):
+        if self.position >= self.end:
+            self.position = self.start
+        position = self.position
+        self.position += 1
+        return position
+
+
+def suffix(temperature):
+    """Get the request name suffix for a row's temperature, e.g. " [hot]".
+    """
+    if temperature is None:
+        return ""
+    return " [{0}]".format(temperature)
+
+
+def from_settings(length):
+    """Make a CorpusSampler for a corpus, configured from the environment.
+    """
+    shard = env_int("CORPUS_SHARD", -1)
+    shards = env_int("CORPUS_SHARDS", 0)
+    # Negative for the corpus's own order
+    seed = env_int("CORPUS_SEED", 1)
+    return CorpusSampler(
+        length,
+        shard=shard if shard >= 0 else None,
+        shards=shards if shards > 0 else None,
+        seed=seed if seed >= 0 else None,
+        hot_ratio=env_float("CORPUS_HOT_RATIO", 0.0),
+        hot_rows=env_int("CORPUS_HOT_ROWS", 1000),
+    )
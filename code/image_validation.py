@@ -0,0 +1,320 @@
+"""Classify GetMap images as good, blank or error, off the request path.
+
+GeoServer happily returns blank tiles, or error messages rendered into
+images, with a perfectly good Content-Type. Fully decoding every image to
+find those would cost far more CPU than making the request, so this only
+looks at structure:
+
+PNG
+    Walks the chunks (checking CRCs and IEND), inflates IDAT and checks the
+    filtered scanlines: a tile is blank if every row is one repeated pixel
+    and every row after the first is the same as the one before, which for
+    GeoServer's filters can be seen without unfiltering anything.
+JPEG
+    Walks the markers (checking for SOF and EOI). Telling a blank JPEG from
+    a sparse one, or from a white tile with an error message on it, takes
+    decoding it, so well-formed JPEGs are classed as unverified rather than
+    guessed at.
+
+Bodies which aren't images at all, are truncated or corrupt, or don't
+have the requested size are errors. Error messages rendered into an image
+look like any other picture to this, so leave GeoServer sending XML
+exceptions (the default) to have them counted as errors.
+
+Classification runs in a small pool of real threads (zlib releases the
+GIL), fed without ever blocking a request greenlet: when the pool is
+backed up, images are skipped and counted. Results land in the latency
+recorder as `image.<class>` counters, and latencies per class as e.g.
+`WMS_png_BBOX [blank]`; totals are also logged when locust quits.
+"""
+import logging
+import struct
+import zlib
+from gevent.threadpool import ThreadPool
+from locust import events
+import latency_recorder
+from latency_recorder import RECORDER
+from settings import env_int, env_float
+
+LOG = logging.getLogger("image_validation")
+
+GOOD = "good"
+BLANK = "blank"
+ERROR = "error"
+# Well-formed, but not checked for being blank
+UNVERIFIED = "unverified"
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_CHUNK = struct.Struct(">I4s")
+PNG_IHDR = struct.Struct(">IIBBBBB")
+# Samples per pixel for each PNG colour type
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+PNG_FILTER_NONE = 0
+PNG_FILTER_SUB = 1
+PNG_FILTER_UP = 2
+
+JPEG_SOF = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb,
+            0xcd, 0xce, 0xcf}
+JPEG_SOS = 0xda
+JPEG_EOI = b"\xff\xd9"
+
+
+class ImageError(Exception):
+    """Raised for images which are malformed.
+    """
+
+
+def classify(body, size=None):
+    """Classify an image body as GOOD, BLANK, UNVERIFIED or ERROR.
+
+    :arg size:
+        (width, height) the image was requested at, if known
+    :returns:
+        (class, reason), reason explaining BLANK and ERROR results
+    """
+    try:
+        blank = None
+        if body.startswith(PNG_SIGNATURE):
+            (width, height), blank = inspect_png(body)
+        elif body.startswith(b"\xff\xd8\xff"):
+            width, height = inspect_jpeg(body)
+        else:
+            return ERROR, "not a PNG or JPEG: {0!r}".format(bytes(body[:20]))
+    except (ImageError, zlib.error, struct.error) as error:
+        return ERROR, str(error)
+    if size is not None and (width, height) != tuple(size):
+        return ERROR, "size {0}x{1}, expected {2}x{3}".format(
+            width, height, *size
+        )
+    if blank is None:
+        return UNVERIFIED, None
+    if blank:
+        return BLANK, "uniform {0}x{1}".format(width, height)
+    return GOOD, None
+
+
+def inspect_png(body):
+    """Check a PNG's structure and whether it's one uniform colour.
+
+    :returns:
+        ((width, height), blank)
+    """
+    view = memoryview(body)
+    position = len(PNG_SIGNATURE)
+    header = None
+    idat = []
+    while True:
+        if position + PNG_CHUNK.size > len(view):
+            raise ImageError("truncated PNG (no IEND)")
+        length, kind = PNG_CHUNK.unpack_from(view, position)
+        data_start = position + PNG_CHUNK.size
+        data_end = data_start + length
+        if data_end + 4 > len(view):
+            raise ImageError("truncated PNG chunk {0!r}".format(kind))
+        crc, = struct.unpack_from(">I", view, data_end)
+        if zlib.crc32(view[position + 4:data_end]) != crc:
+            raise ImageError("bad CRC in PNG chunk {0!r}".format(kind))
+        if kind == b"IHDR":
+            header = PNG_IHDR.unpack_from(view, data_start)
+        elif kind == b"IDAT":
+            idat.append(view[data_start:data_end])
+        elif kind == b"IEND":
+            break
+        position = data_end + 4
+    if header is None or not idat:
+        raise ImageError("PNG without IHDR or IDAT")
+
+    width, height, bit_depth, colour_type, _, _, interlace = header
+    if colour_type not in PNG_CHANNELS:
+        raise ImageError("bad PNG colour type {0}".format(colour_type))
+    bits = PNG_CHANNELS[colour_type] * bit_depth
+    row_bytes = (width * bits + 7) // 8
+    pixels = zlib.decompress(b"".join(idat))
+    if interlace:
+        # Adam7 rows come in seven passes; don't bother
+        return (width, height), False
+    if len(pixels) != height * (row_bytes + 1):
+        raise ImageError("PNG data is {0} bytes, expected {1}".format(
+            len(pixels), height * (row_bytes + 1),
+        ))
+    return (width, height), _png_uniform(pixels, height, row_bytes, bits)
+
+
+def _png_uniform(pixels, height, row_bytes, bits):
+    """Tell whether filtered PNG scanlines decode to one repeated pixel.
+
+    Only None, Sub and Up filtered rows can be judged without unfiltering;
+    any other filter is taken to mean the image isn't blank. With pixels
+    under a byte, rows are compared byte by byte and that byte must hold
+    one pixel over and over.
+
+    :arg bits:
+        Bits per pixel
+    """
+    pixel_bytes = max(1, bits // 8)
+    stride = row_bytes + 1
+    zeros = bytes(row_bytes)
+    pixel = None
+    for row in range(0, height):
+        start = row * stride
+        kind = pixels[start]
+        line = pixels[start + 1:start + stride]
+        if kind == PNG_FILTER_UP and row:
+            # Zero differences from the row above: the same row again
+            if line != zeros:
+                return False
+            continue
+        if kind == PNG_FILTER_SUB or (kind == PNG_FILTER_UP and not row):
+            first = line[:pixel_bytes]
+            # Sub: only the first pixel is non-zero if all the rest match it
+            if kind == PNG_FILTER_SUB and \
+                    line[pixel_bytes:] != zeros[pixel_bytes:]:
+                return False
+            if kind == PNG_FILTER_UP and \
+                    line != first * (row_bytes // pixel_bytes):
+                return False
+        elif kind == PNG_FILTER_NONE:
+            first = line[:pixel_bytes]
+            if line != first * (row_bytes // pixel_bytes):
+                return False
+        else:
+            return False
+        if pixel is None:
+            pixel = first
+        elif first != pixel:
+            return False
+    if bits < 8 and pixel is not None:
+        return _repeats_pixel(pixel[0], bits)
+    return True
+
+
+def _repeats_pixel(byte, bits):
+    """Tell whether a byte packs the same `bits` wide pixel throughout.
+    """
+    value = byte & ((1 << bits) - 1)
+    pattern = 0
+    for _ in range(8 // bits):
+        pattern = pattern << bits | value
+    return byte == pattern
+
+
+def inspect_jpeg(body):
+    """Check a JPEG's structure.
+
+    :returns:
+        (width, height)
+    """
+    view = memoryview(body)
+    position = 2
+    size = None
+    while True:
+        if position + 4 > len(view) or view[position] != 0xff:
+            raise ImageError("truncated or corrupt JPEG marker segment")
+        marker = view[position + 1]
+        if marker == 0xff:
+            # Fill byte
+            position += 1
+            continue
+        length, = struct.unpack_from(">H", view, position + 2)
+        if marker in JPEG_SOF:
+            height, width = struct.unpack_from(">HH", view, position + 5)
+            size = (width, height)
+        position += 2 + length
+        if marker == JPEG_SOS:
+            break
+    if size is None:
+        raise ImageError("JPEG without SOF")
+    if bytes(view[-2:]) != JPEG_EOI:
+        raise ImageError("truncated JPEG (no EOI)")
+    return size
+
+
+class ImageValidator:
+    """Sample images into a bounded thread pool for classification.
+    """
+
+    def __init__(self, sample_rate=1.0, threads=2, max_pending=100):
+        """
+        :arg sample_rate:
+            Fraction of images to classify
+        :arg threads:
+            Worker threads; classification holds the GIL part of the time,
+            so more threads than cores doesn't help
+        :arg max_pending:
+            Skip images rather than queue more than this many
+        """
+        self.sample_rate = sample_rate
+        self.max_pending = max_pending
+        self.pool = ThreadPool(threads)
+        self.pending = 0
+        self._credit = 0.0
+        # Totals per class, and of skipped images, for log_summary
+        self.totals = {}
+
+    def wanted(self):
+        """Decide whether to keep the next image's body for classifying.
+        """
+        # Deterministic sampling, as in request_log
+        self._credit += self.sample_rate
+        if self._credit < 1.0:
+            return False
+        self._credit -= 1.0
+        if self.pending >= self.max_pending:
+            self._count("skipped")
+            return False
+        return True
+
+    def _count(self, image_class):
+        self.totals[image_class] = self.totals.get(image_class, 0) + 1
+        RECORDER.count("image." + image_class)
+
+    def submit(self, name, body, milliseconds, size=None):
+        """Classify an image in the background; never blocks.
+
+        :arg name:
+            Request name, e.g. "WMS_png_BBOX"
+        :arg milliseconds:
+            The request's latency, recorded under the image's class
+        """
+        self.pending += 1
+        result = self.pool.spawn(classify, body, size)
+
+        # Called back in the hub, so RECORDER is only touched by greenlets
+        def done(result):
+            self.pending -= 1
+            if not result.successful():
+                self._count(ERROR)
+                return
+            image_class, _ = result.value
+            self._count(image_class)
+            RECORDER.record(
+                "{0} [{1}]".format(name, image_class), milliseconds,
+            )
+        result.rawlink(done)
+
+    def log_summary(self, **kwargs):
+        LOG.info("image validation: " + " ".join(
+            "{0}={1}".format(image_class, number)
+            for image_class, number in sorted(self.totals.items())
+        ))
+
+
+def from_settings():
+    """Get an ImageValidator if IMAGE_VALIDATION_SAMPLE is set, or None.
+    """
+    sample_rate = env_float("IMAGE_VALIDATION_SAMPLE", 0.0)
+    if not sample_rate:
+        return None
+    validator = ImageValidator(
+        sample_rate=sample_rate,
+        threads=env_int("IMAGE_VALIDATION_THREADS", 2),
+        max_pending=env_int("IMAGE_VALIDATION_MAX_PENDING", 100),
+    )
+    # Class counts and latencies go through the recorder
+    latency_recorder.install_from_settings()
+    if not latency_recorder.is_installed():
+        LOG.warning(
+            "set LATENCY_HISTOGRAM_PATH to export image validation results"
+        )
+    events.quitting.add_listener(validator.log_summary)
+    return validator
@@ -0,0 +1,182 @@
+"""Constant-memory latency histogram with HDR-style log-linear buckets.
+
+Values are whole microseconds. Values below 2**precision each get their own
+bucket; above that, every power of two is split into 2**(precision - 1)
+equal buckets, so any recorded value is reported to within a relative error
+of 2**-(precision - 1) no matter how big it is.
+"""
+from array import array
+
+# One hour, in microseconds; anything slower is recorded as this
+DEFAULT_MAX_VALUE = 3600 * 1000 * 1000
+
+
+class LatencyHistogram:
+    """Count latencies in fixed log-linear buckets.
+
+    Recording is O(1) and only touches a preallocated array, so this can be
+    called for every request. Histograms with the same precision and
+    maximum can be merged, e.g. to combine reports from many workers.
+    """
+
+    def __init__(self, precision=7, max_value=DEFAULT_MAX_VALUE):
+        """
+        :arg precision:
+            Bits of precision: 7 gives buckets no wider than 1/64 (~1.6%)
+            of their value
+        :arg max_value:
+            Largest trackable value, in microseconds
+        """
+        self.precision = precision
+        self.max_value = max_value
+        self._linear = 1 << precision
+        self._half = self._linear >> 1
+        self._counts = array("Q", bytes(8 * (self.index(max_value) + 1)))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def index(self, value):
+        """Get the bucket index for a value in microseconds.
+        """
+        if value < self._linear:
+            return value
+        shift = value.bit_length() - self.precision
+        return (
+            self._linear
+            + (shift - 1) * self._half
+            + (value >> shift) - self._half
+        )
+
+    def bucket_range(self, index):
+        """Get the (lowest, highest) values which map to a bucket index.
+        """
+        if index < self._linear:
+            return index, index
+        shift, offset = divmod(index - self._linear, self._half)
+        shift += 1
+        low = (offset + self._half) << shift
+        return low, low + (1 << shift) - 1
+
+    def record(self, value):
+        """Record one latency in microseconds.
+        """
+        value = int(value)
+        if value < 0:
+            value = 0
+        elif value > self.max_value:
+            value = self.max_value
+        self._counts[self.index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def record_ms(self, milliseconds):
+        """Record one latency in (possibly fractional) milliseconds.
+        """
+        self.record(milliseconds * 1000)
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percent):
+        """Get the value at or below which `percent` of recorded values fall.
+
+        Like HdrHistogram, reports the highest value in the bucket that
+        contains the percentile (never more than the largest value seen).
+        """
+        if not self.count:
+            return None
+        return self.value_at_rank(max(1, -(-self.count * percent // 100)))
+
+    def value_at_rank(self, rank):
+        """Get the rank'th smallest recorded value, counting from 1.
+        """
+        if not 1 <= rank <= self.count:
+            raise IndexError("rank out of range")
+        seen = 0
+        for index, number in enumerate(self._counts):
+            if not number:
+                continue
+            seen += number
+            if seen >= rank:
+                return min(self.bucket_range(index)[1], self.max)
+        return self.max
+
+    def merge(self, other):
+        """Add counts from another histogram with the same layout.
+        """
+        if (other.precision, other.max_value) != \
+                (self.precision, self.max_value):
+            raise ValueError("can only merge histograms with the same layout")
+        counts = self._counts
+        for index, number in enumerate(other._counts):
+            if number:
+                counts[index] += number
+        self._merge_totals(other.count, other.total, other.min, other.max)
+
+    def reset(self):
+        counts = self._counts
+        for index in range(0, len(counts)):
+            counts[index] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def summary(self, percents=(50, 90, 95, 99, 99.9)):
+        """Get a dict of count, min, mean, max and percentiles, in ms.
+        """
+        def ms(value):
+            return None if value is None else value / 1000
+        summary = {
+            "count": self.count,
+            "min": ms(self.min),
+            "mean": ms(self.mean),
+            "max": ms(self.max),
+        }
+        for percent in percents:
+            summary[f"p{percent:g}"] = ms(self.percentile(percent))
+        return summary
+
+    def to_dict(self):
+        """Get a compact, JSON-friendly representation for sending/storing.
+        """
+        return {
+            "precision": self.precision,
+            "max_value": self.max_value,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            # Sparse [index, count] pairs, since most buckets are empty
+            "counts": [
+                [index, number]
+                for index, number in enumerate(self._counts) if number
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data["precision"], data["max_value"])
+        for index, number in data["counts"]:
+            histogram._counts[index] += number
+        histogram._merge_totals(
+            data["count"], data["total"], data["min"], data["max"],
+        )
+        return histogram
+
+    def _merge_totals(self, count, total, minimum, maximum):
+        self.count += count
+        self.total += total
+        if minimum is not None and (self.min is None or minimum < self.min):
+            self.min = minimum
+        if maximum is not None and (self.max is None or maximum > self.max):
+            self.max = maximum
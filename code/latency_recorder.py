@@ -0,0 +1,197 @@
+"""Record per-request latencies into histograms and export them by interval.
+
+Hooks locust's request success/failure events so every request made by our
+behaviors lands in a per-name LatencyHistogram. Workers ship their
+histograms to the master with each regular worker report; the master (or a
+standalone locust) merges them and appends one JSON line per interval to a
+file, with percentiles and the raw bucket counts for later re-merging.
+"""
+import json
+import time
+import gevent
+from locust import events
+from locust.runners import WorkerRunner
+from latency_histogram import LatencyHistogram
+from settings import env_str, env_float
+
+# Key under which worker reports carry histogram data
+REPORT_KEY = "latency_histograms"
+
+
+class LatencyRecorder:
+    """Per-name histograms for the current interval.
+    """
+
+    def __init__(self, precision=7):
+        self.precision = precision
+        self.histograms = {}
+        self.failures = {}
+        # Arbitrary named counts which are summed across workers
+        self.counters = {}
+        # Arbitrary named levels where only the highest one matters
+        self.peaks = {}
+        self.interval_start = time.time()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = LatencyHistogram(self.precision)
+            self.histograms[name] = histogram
+        return histogram
+
+    def record(self, name, milliseconds):
+        self.histogram(name).record_ms(milliseconds)
+
+    def record_failure(self, name, milliseconds):
+        self.record(name, milliseconds)
+        self.failures[name] = self.failures.get(name, 0) + 1
+
+    def count(self, name, number=1):
+        self.counters[name] = self.counters.get(name, 0) + number
+
+    def peak(self, name, value):
+        if value > self.peaks.get(name, value - 1):
+            self.peaks[name] = value
+
+    def drain(self):
+        """Get this interval's data as a JSON-friendly dict, and reset.
+        """
+        data = {
+            "histograms": {
+                name: histogram.to_dict()
+                for name, histogram in self.histograms.items()
+                if histogram.count
+            },
+            "failures": dict(self.failures),
+            "counters": dict(self.counters),
+            "peaks": dict(self.peaks),
+        }
+        for histogram in self.histograms.values():
+            histogram.reset()
+        self.failures.clear()
+        self.counters.clear()
+        self.peaks.clear()
+        return data
+
+    def merge(self, data):
+        """Merge in data produced by another recorder's drain().
+        """
+        for name, histogram in data.get("histograms", {}).items():
+            self.histogram(name).merge(LatencyHistogram.from_dict(histogram))
+        for name, number in data.get("failures", {}).items():
+            self.failures[name] = self.failures.get(name, 0) + number
+        for name, number in data.get("counters", {}).items():
+            self.count(name, number)
+        for name, value in data.get("peaks", {}).items():
+            self.peak(name, value)
+
+    def export(self, stream):
+        """Write one JSON line for the interval that just ended, and reset.
+        """
+        now = time.time()
+        data = self.drain()
+        line = {
+            "start": self.interval_start,
+            "end": now,
+            "summary": {
+                name: dict(
+                    LatencyHistogram.from_dict(histogram).summary(),
+                    failures=data["failures"].get(name, 0),
+                )
+                for name, histogram in data["histograms"].items()
+            },
+            "counters": data["counters"],
+            "peaks": data["peaks"],
+            "histograms": data["histograms"],
+        }
+        self.interval_start = now
+        stream.write(json.dumps(line) + "\n")
+        stream.flush()
+
+
+RECORDER = LatencyRecorder()
+
+# The locust Environment, once it has been initialized
+_environment = None
+# (path, interval) install() was asked to export to, if any
+_export = None
+
+
+def on_init(environment, **kwargs):
+    global _environment
+    _environment = environment
+    # Only now is it known whether this process is a worker, which hands
+    # its data to the master instead of writing a file of its own
+    if _export is not None and not is_worker():
+        gevent.spawn(export_forever, *_export)
+
+
+def on_request(request_type, name, response_time, response_length,
+               exception=None, **kwargs):
+    if exception is None:
+        RECORDER.record(name, response_time)
+    else:
+        RECORDER.record_failure(name, response_time)
+
+
+def on_report_to_master(client_id, data):
+    data[REPORT_KEY] = RECORDER.drain()
+
+
+def on_worker_report(client_id, data):
+    RECORDER.merge(data.get(REPORT_KEY, {}))
+
+
+def is_worker():
+    runner = _environment.runner if _environment is not None else None
+    return isinstance(runner, WorkerRunner)
+
+
+def export_forever(path, interval):
+    """Export an interval of histograms every `interval` seconds.
+
+    Only run on the master, or in local runs.
+    """
+    with open(path, "a") as stream:
+        deadline = time.monotonic() + interval
+        while True:
+            gevent.sleep(max(0, deadline - time.monotonic()))
+            deadline += interval
+            RECORDER.export(stream)
+
+
+_installed = False
+
+
+def install(path=None, interval=10.0):
+    """Hook the recorder into locust's events, once per process.
+
+    :arg path:
+        File to append interval exports to; if None, histograms are still
+        collected (and sent to the master) but not written out here.
+    :arg interval:
+        Seconds between exports
+    """
+    global _installed, _export
+    if _installed:
+        return
+    _installed = True
+    events.init.add_listener(on_init)
+    events.request.add_listener(on_request)
+    events.report_to_master.add_listener(on_report_to_master)
+    events.worker_report.add_listener(on_worker_report)
+    if path is not None:
+        _export = (path, interval)
+
+
+def is_installed():
+    return _installed
+
+
+def install_from_settings():
+    """Install the recorder if LATENCY_HISTOGRAM_PATH is set.
+    """
+    path = env_str("LATENCY_HISTOGRAM_PATH")
+    if path is None:
+        return
+    install(path, env_float("LATENCY_HISTOGRAM_INTERVAL", 10.0))
@@ -1,18 +1,232 @@
 #!/usr/bin/env python3
-import csv
+"""Generate a bbox corpus of web mercator (XYZ) tile bounds.
+
+Tile bounds are computed for whole blocks of tiles at once with NumPy and
+written straight into a binary bbox corpus (see bbox_corpus), one
+west,south,east,north row per tile, in the same order as mercantile.tiles().
+Work can be spread over several processes, split by zoom level or by
+chunks of rows; each process writes its own slice of the output file.
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import mercantile
+import numpy
+
+from bbox_corpus import HEADER, MAGIC, VERSION
+
+# Chesapeake Bay area, which the default corpus has always covered
+DEFAULT_BBOX = (-77.59899950, 38.53900095, -76.05800395, 39.63099797)
+
+# Values per row: west, south, east, north
+COLUMNS = 4
+# ...followed by x, y, z with --tile-index, for tile_tester
+TILE_INDEX_COLUMNS = 7
+
+# Nudge used by mercantile.tiles() so that edges don't pull in extra tiles
+LL_EPSILON = 1e-11
+
+# Web mercator can't represent the poles
+MAX_LAT = 85.051129
+
+
+def tile_ranges(west, south, east, north, zoom):
+    """Get the inclusive tile column and row ranges covering a bbox.
+
+    :returns:
+        A list of (min_x, max_x, min_y, max_y) tuples; more than one
+        if the bbox crosses the antimeridian.
+    """
+    if west > east:
+        boxes = [(-180.0, south, east, north), (west, south, 180.0, north)]
+    else:
+        boxes = [(west, south, east, north)]
+    ranges = []
+    for w, s, e, n in boxes:
+        w, e = max(-180.0, w), min(180.0, e)
+        s, n = max(-MAX_LAT, s), min(MAX_LAT, n)
+        upper_left = mercantile.tile(w, n, zoom)
+        lower_right = mercantile.tile(e - LL_EPSILON, s + LL_EPSILON, zoom)
+        ranges.append(
+            (upper_left.x, lower_right.x, upper_left.y, lower_right.y)
+        )
+    return ranges
+
+
+def tile_bounds(zoom, min_x, max_x, min_y, max_y, tile_index=False):
+    """Compute bounds for a block of tiles as an array of shape (N, 4).
+
+    Rows are ordered by x then y, like mercantile.tiles().
+
+    :arg tile_index:
+        Add each tile's x, y and z, giving an array of shape (N, 7)
+    """
+    size = 2.0 ** zoom
+    xs = numpy.arange(min_x, max_x + 2, dtype=numpy.float64)
+    ys = numpy.arange(min_y, max_y + 2, dtype=numpy.float64)
+    # Tile edges are shared between neighbors, so compute each edge once
+    lon_edges = xs / size * 360.0 - 180.0
+    lat_edges = numpy.degrees(
+        numpy.arctan(numpy.sinh(numpy.pi * (1 - 2 * ys / size)))
+    )
+    columns, rows = len(xs) - 1, len(ys) - 1
+    width = TILE_INDEX_COLUMNS if tile_index else COLUMNS
+    bounds = numpy.empty((columns, rows, width), dtype="<f8")
+    bounds[:, :, 0] = lon_edges[:-1, None]
+    bounds[:, :, 1] = lat_edges[None, 1:]
+    bounds[:, :, 2] = lon_edges[1:, None]
+    bounds[:, :, 3] = lat_edges[None, :-1]
+    if tile_index:
+        bounds[:, :, 4] = xs[:-1, None]
+        bounds[:, :, 5] = ys[None, :-1]
+        bounds[:, :, 6] = zoom
+    return bounds.reshape(-1, width)
+
+
+def plan_chunks(bbox, zooms, chunk_rows=None):
+    """Divide the output into independent chunks of work.
+
+    :arg chunk_rows:
+        Approximate maximum rows per chunk; if None, one chunk per zoom
+        level (and antimeridian side).
+    :returns:
+        (total_rows, chunks) where each chunk is a tuple of
+        (row_offset, zoom, min_x, max_x, min_y, max_y)
+    """
+    chunks = []
+    offset = 0
+    # Like mercantile.tiles(), go through every zoom level on one side of
+    # the antimeridian before the other
+    sides = 2 if bbox[0] > bbox[2] else 1
+    for side in range(0, sides):
+        for zoom in zooms:
+            min_x, max_x, min_y, max_y = tile_ranges(*bbox, zoom)[side]
+            height = max_y - min_y + 1
+            if chunk_rows is None:
+                step = max_x - min_x + 1
+            else:
+                step = max(1, chunk_rows // height)
+            for start_x in range(min_x, max_x + 1, step):
+                stop_x = min(max_x, start_x + step - 1)
+                chunks.append(
+                    (offset, zoom, start_x, stop_x, min_y, max_y),
+                )
+                offset += (stop_x - start_x + 1) * height
+    return offset, chunks
+
+
+def write_chunk(path, total_rows, chunk, tile_index=False):
+    """Compute one chunk and write it into its slice of the output file.
+    """
+    offset, zoom, min_x, max_x, min_y, max_y = chunk
+    bounds = tile_bounds(zoom, min_x, max_x, min_y, max_y, tile_index)
+    output = numpy.memmap(
+        path, dtype="<f8", mode="r+", offset=HEADER.size,
+        shape=(total_rows, bounds.shape[1]),
+    )
+    output[offset:offset + len(bounds)] = bounds
+    output.flush()
+    return len(bounds)
+
+
+def write_tile_data(path, bbox=DEFAULT_BBOX, zooms=range(8, 18),
+                    processes=None, chunk_rows=None, tile_index=False):
+    """Write a corpus of tile bounds for the given bbox and zoom levels.
+
+    :arg tile_index:
+        Follow each tile's bounds with its x, y and z
+    :returns:
+        Number of rows written
+    """
+    total_rows, chunks = plan_chunks(bbox, zooms, chunk_rows)
+    columns = TILE_INDEX_COLUMNS if tile_index else COLUMNS
+
+    # Preallocate the whole file so that workers can write in any order
+    with open(path, "wb") as stream:
+        stream.write(HEADER.pack(MAGIC, VERSION, columns))
+        stream.truncate(HEADER.size + total_rows * columns * 8)
+    if not total_rows:
+        return 0
+
+    if processes == 1 or len(chunks) == 1:
+        for chunk in chunks:
+            write_chunk(path, total_rows, chunk, tile_index)
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [
+                executor.submit(
+                    write_chunk, path, total_rows, chunk, tile_index,
+                )
+                for chunk in chunks
+            ]
+            for future in futures:
+                future.result()
+    return total_rows
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Generate a bbox corpus of XYZ tile bounds",
+    )
+    parser.add_argument(
+        "--bbox",
+        type=float,
+        nargs=4,
+        metavar=("WEST", "SOUTH", "EAST", "NORTH"),
+        default=DEFAULT_BBOX,
+    )
+    parser.add_argument(
+        "--min-zoom",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "--max-zoom",
+        type=int,
+        default=17,
+    )
+    parser.add_argument(
+        "--output",
+        default="data/wms_256_tiles.bbox",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--split",
+        choices=["zoom", "rows"],
+        default="rows",
+        help="give each process whole zoom levels, or chunks of rows",
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=1000000,
+        help="approximate rows per chunk with --split=rows",
+    )
+    parser.add_argument(
+        "--tile-index",
+        action="store_true",
+        help="add x, y, z columns after the bounds, for tile_tester",
+    )
+    return parser
 
 
-def write_tile_data():
-    filename = "wms_256_tiles.csv"
-    with open(filename, "w", newline="") as data_file:
-        writer = csv.writer(data_file)
-        for tile in mercantile.tiles(
-                -77.59899950, 38.53900095, -76.05800395, 39.63099797,
-                range(8, 18)
-        ):
-            bounds = mercantile.bounds(tile)
-            writer.writerow(bounds)
+def main():
+    parser = argument_parser()
+    options = parser.parse_args()
+    zooms = range(options.min_zoom, options.max_zoom + 1)
+    chunk_rows = options.chunk_rows if options.split == "rows" else None
+    written = write_tile_data(
+        options.output, tuple(options.bbox), zooms,
+        processes=options.processes, chunk_rows=chunk_rows,
+        tile_index=options.tile_index,
+    )
+    print(f"wrote {written} rows to {options.output}")
 
 
-write_tile_data()
+if __name__ == "__main__":
+    main()
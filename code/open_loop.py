@@ -0,0 +1,116 @@
+"""Open-loop (constant arrival rate) scheduling for locust tasks.
+
+With closed-loop users, each user waits for a response before sending its
+next request, so when the server slows down the offered load drops and the
+latency numbers hide the queueing ("coordinated omission"). In open-loop
+mode, requests are instead due on a fixed schedule of `rate` per second
+shared by all users in the process: whichever user is free takes the next
+due slot. Each worker process keeps its own schedule, so a distributed
+swarm offers `rate` times the number of workers in all. Latency is then
+measured from the slot's intended send time, not from when a user finally
+got around to sending it.
+
+Run enough users that they can keep up, i.e. more than rate times the
+worst latency you expect; the backlog numbers show when they can't.
+"""
+import logging
+import time
+import gevent
+from locust import events
+import latency_recorder
+from latency_recorder import RECORDER
+from settings import env_float
+
+LOG = logging.getLogger("open_loop")
+
+# Suffix for histograms of latency measured from the intended send time
+INTENDED_SUFFIX = " (from intended)"
+
+
+class ArrivalSchedule:
+    """Hand out intended send times at a fixed rate.
+    """
+
+    def __init__(self, rate, max_lag=1.0):
+        """
+        :arg rate:
+            Requests per second to issue from this process
+        :arg max_lag:
+            Seconds a slot may be overdue before it is dropped rather than
+            sent, so a stall doesn't turn into a burst of stale requests
+        """
+        self.rate = rate
+        self.interval = 1.0 / rate
+        self.max_lag = max_lag
+        # Set on first use, so import time doesn't count as backlog
+        self.start = None
+        # Number of the next slot to hand out
+        self.next_slot = 0
+        # Totals since start, for the summary when locust quits
+        self.issued = 0
+        self.dropped = 0
+        self.max_backlog = 0
+
+    def acquire(self):
+        """Wait until the next slot is due, then return its intended time.
+
+        :returns:
+            time.monotonic() timestamp at which the request should have
+            been sent
+        """
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+
+        # Slots due by now which nobody has taken yet
+        due = int((now - self.start) / self.interval) + 1
+        backlog = max(0, due - self.next_slot)
+        if backlog > self.max_backlog:
+            self.max_backlog = backlog
+        RECORDER.peak("open_loop.backlog", backlog)
+
+        # Skip slots which are too stale to be worth sending
+        fresh = int((now - self.max_lag - self.start) / self.interval) + 1
+        if fresh > self.next_slot:
+            dropped = fresh - self.next_slot
+            self.dropped += dropped
+            RECORDER.count("open_loop.dropped", dropped)
+            self.next_slot = fresh
+
+        intended = self.start + self.next_slot * self.interval
+        self.next_slot += 1
+        self.issued += 1
+        RECORDER.count("open_loop.issued")
+        if intended > now:
+            gevent.sleep(intended - now)
+        return intended
+
+    def complete(self, name, intended):
+        """Record latency from a slot's intended time until now.
+        """
+        milliseconds = (time.monotonic() - intended) * 1000
+        RECORDER.record(name + INTENDED_SUFFIX, milliseconds)
+
+    def log_summary(self, **kwargs):
+        LOG.info(
+            f"open loop at {self.rate}/s: issued={self.issued} "
+            f"dropped={self.dropped} max_backlog={self.max_backlog}"
+        )
+
+
+def from_settings():
+    """Make an ArrivalSchedule if OPEN_LOOP_RATE, per process, is set.
+
+    :returns:
+        None for normal closed-loop operation
+    """
+    rate = env_float("OPEN_LOOP_RATE", 0.0)
+    if rate <= 0:
+        return None
+    schedule = ArrivalSchedule(rate, env_float("OPEN_LOOP_MAX_LAG", 1.0))
+    # Intended-time latencies and backlog counts go through the recorder
+    latency_recorder.install_from_settings()
+    if not latency_recorder.is_installed():
+        LOG.warning("set LATENCY_HISTOGRAM_PATH to export open loop latency")
+    events.quitting.add_listener(schedule.log_summary)
+    return schedule
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""Build and read compact, indexed streams of requests to replay.
+
+Input is GeoServer/nginx access logs in the usual NCSA combined format, or
+JSONL with one {"method", "path", "timestamp"} object per line. Neither
+records request bodies, so only GET and HEAD requests are kept; POSTs and
+the like are skipped and counted. Requests are sorted by time and written
+as a replay file:
+
+- a fixed header, then a small JSON block naming methods and request names
+- one fixed-width record per request: offset from the first request in
+  nanoseconds, where its path lives in the path blob, request name and
+  method indexes
+- the blob of UTF-8 paths, each distinct path stored once
+
+Readers memory-map the file, so every locust process on a host shares it.
+"""
+import argparse
+import json
+import mmap
+import re
+import struct
+import sys
+from datetime import datetime
+from urllib.parse import urlsplit
+
+MAGIC = b"REPLAY1\n"
+# magic, record count, length of the JSON metadata block
+HEADER = struct.Struct("<8sQQ")
+# offset_ns, path blob offset, path length, name index, method index
+RECORD = struct.Struct("<qQIHBx")
+
+NCSA_PATTERN = re.compile(
+    r'^\S+ \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<path>\S+)'
+)
+NCSA_TIME_FORMAT = "%d/%b/%Y:%H:%M:%S %z"
+
+REQUEST_PATTERN = re.compile(r"[?&]request=([A-Za-z]+)", re.IGNORECASE)
+
+# Names for RESTful requests, which have no request parameter, by a part of
+# their path; the first match wins, so more specific parts come first.
+# Naming them after the last path segment would give every tile its own
+# stats entry.
+SERVICE_NAMES = [
+    ("/gwc/service/wmts/rest/", "REPLAY_WMTS_REST"),
+    ("/tms/", "REPLAY_TMS"),
+    ("/gwc/service/", "REPLAY_GWC"),
+]
+OTHER_NAME = "REPLAY_other"
+
+# Name and method indexes are packed as H and B in RECORD
+MAX_NAMES = 1 << 16
+MAX_METHODS = 1 << 8
+
+# Methods which can be replayed from a path alone
+REPLAYABLE_METHODS = {"GET", "HEAD"}
+
+
+class ReplayError(Exception):
+    """Raised for replay files or logs which can't be read.
+    """
+
+
+def request_name(path):
+    """Name a request for locust stats, e.g. "REPLAY_GetMap".
+    """
+    match = REQUEST_PATTERN.search(path)
+    if match:
+        return "REPLAY_" + match.group(1)
+    path = urlsplit(path).path
+    for part, name in SERVICE_NAMES:
+        if part in path:
+            return name
+    return OTHER_NAME
+
+
+def parse_timestamp(value):
+    """Parse epoch seconds or an ISO 8601 string into epoch seconds.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+def parse_lines(lines, prefix="", skipped=None):
+    """Yield (timestamp, method, path) from access log or JSONL lines.
+
+    :arg prefix:
+        Only keep requests whose path starts with this, e.g. "/geoserver"
+    :arg skipped:
+        Optional dict to count requests skipped for their method in, by
+        method
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            record = json.loads(line)
+            timestamp = parse_timestamp(record["timestamp"])
+            method = record.get("method", "GET").upper()
+            path = record["path"]
+        else:
+            match = NCSA_PATTERN.match(line)
+            if not match:
+                continue
+            timestamp = datetime.strptime(
+                match.group("time"), NCSA_TIME_FORMAT,
+            ).timestamp()
+            method = match.group("method")
+            path = match.group("path")
+        # Logs sometimes have absolute URLs; we only want path and query
+        if "://" in path:
+            parts = urlsplit(path)
+            path = parts.path + ("?" + parts.query if parts.query else "")
+        if not path.startswith(prefix):
+            continue
+        if method not in REPLAYABLE_METHODS:
+            if skipped is not None:
+                skipped[method] = skipped.get(method, 0) + 1
+            continue
+        yield timestamp, method, path
+
+
+def write_replay(path, requests):
+    """Write (timestamp, method, path) tuples out as a replay file.
+
+    :returns:
+        Number of requests written
+    """
+    requests = sorted(requests, key=lambda request: request[0])
+    if not requests:
+        raise ReplayError("no requests to write")
+    first = requests[0][0]
+
+    methods = {}
+    names = {}
+    blob_offsets = {}
+    blob = bytearray()
+    records = bytearray()
+    for timestamp, method, request_path in requests:
+        method_index = methods.setdefault(method, len(methods))
+        name_index = names.setdefault(
+            request_name(request_path), len(names),
+        )
+        encoded = request_path.encode("utf-8")
+        blob_offset = blob_offsets.get(encoded)
+        if blob_offset is None:
+            blob_offset = blob_offsets[encoded] = len(blob)
+            blob += encoded
+        if len(names) > MAX_NAMES or len(methods) > MAX_METHODS:
+            raise ReplayError(
+                f"more than {MAX_NAMES} request names or {MAX_METHODS} "
+                f"methods, which replay records can't index"
+            )
+        records += RECORD.pack(
+            round((timestamp - first) * 1e9), blob_offset, len(encoded),
+            name_index, method_index,
+        )
+
+    metadata = json.dumps({
+        "methods": list(methods),
+        "names": list(names),
+        "start": first,
+    }).encode("utf-8")
+    # Pad so records start on an 8 byte boundary
+    metadata += b" " * (-(HEADER.size + len(metadata)) % 8)
+    with open(path, "wb") as stream:
+        stream.write(HEADER.pack(MAGIC, len(requests), len(metadata)))
+        stream.write(metadata)
+        stream.write(records)
+        stream.write(blob)
+    return len(requests)
+
+
+class ReplayStream:
+    """Read-only, memory-mapped view of a replay file.
+
+    Indexing gives (offset_seconds, method, path, name) tuples.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as stream:
+            header = stream.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ReplayError(f"{path}: truncated header")
+            magic, count, metadata_length = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ReplayError(f"{path}: not a replay file")
+            metadata = json.loads(stream.read(metadata_length))
+            self._mmap = mmap.mmap(
+                stream.fileno(), 0, access=mmap.ACCESS_READ,
+            )
+        self.methods = metadata["methods"]
+        self.names = metadata["names"]
+        self.start = metadata["start"]
+        self._length = count
+        self._records = HEADER.size + metadata_length
+        self._blob = self._records + count * RECORD.size
+        if len(self._mmap) < self._blob:
+            raise ReplayError(f"{path}: truncated records")
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._length:
+            raise IndexError("replay index out of range")
+        offset_ns, path_offset, path_length, name, method = \
+            RECORD.unpack_from(self._mmap, self._records + index * RECORD.size)
+        start = self._blob + path_offset
+        path = self._mmap[start:start + path_length].decode("utf-8")
+        return (
+            offset_ns / 1e9, self.methods[method], path, self.names[name],
+        )
+
+    @property
+    def duration(self):
+        """Seconds between the first and last requests.
+        """
+        if not self._length:
+            return 0.0
+        return self[self._length - 1][0]
+
+
+def partition(length, index, count):
+    """Get the stream indexes belonging to one of `count` partitions.
+
+    Requests are dealt out round-robin, so every partition covers the whole
+    time range with an even share of the load, and the split is the same
+    every time for the same file and partition count.
+    """
+    if not 0 <= index < count:
+        raise ValueError("partition index must be in range(0, count)")
+    return range(index, length, count)
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Build a replay file from access logs or JSONL",
+    )
+    parser.add_argument(
+        dest="inputs",
+        nargs="+",
+        help="access log or JSONL files, or - for stdin",
+    )
+    parser.add_argument(
+        "--output",
+        required=True,
+    )
+    parser.add_argument(
+        "--prefix",
+        default="/geoserver",
+        help="only keep requests with paths starting with this",
+    )
+    return parser
+
+
+def main():
+    parser = argument_parser()
+    options = parser.parse_args()
+    requests = []
+    skipped = {}
+    for name in options.inputs:
+        if name == "-":
+            requests.extend(parse_lines(sys.stdin, options.prefix, skipped))
+            continue
+        with open(name, errors="replace") as stream:
+            requests.extend(parse_lines(stream, options.prefix, skipped))
+    for method, count in sorted(skipped.items()):
+        print(f"skipped {count} {method} requests, which need bodies")
+    written = write_replay(options.output, requests)
+    replay = ReplayStream(options.output)
+    print(
+        f"wrote {written} requests spanning {replay.duration:.1f}s "
+        f"to {options.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Define a locust swarm replaying recorded production requests.
+
+Build a replay file from access logs with replay.py, then e.g.::
+
+    REPLAY_FILE=data/prod.replay locust -f code/replay_tester.py --worker ...
+
+Each worker replays its own partition of the stream, one per worker by
+default (see corpus_shard.worker_count), keeping the original inter-arrival
+times, divided by REPLAY_SPEEDUP. Users in a process share the partition:
+whichever user is free sends the next request when it comes due.
+"""
+import time
+from pathlib import Path
+import gevent
+from locust import TaskSet, task
+from locust.exception import StopUser
+import corpus_shard
+import latency_recorder
+from latency_recorder import RECORDER
+from open_loop import INTENDED_SUFFIX
+from replay import ReplayStream, partition
+from settings import env_str, env_int, env_float, env_bool
+from transport import GeoServerUser
+
+# Collect latency histograms if LATENCY_HISTOGRAM_PATH is set
+latency_recorder.install_from_settings()
+
+
+class ReplayDispatcher:
+    """Hand out one partition's requests at their (scaled) original times.
+    """
+
+    def __init__(self, stream, partition_index=None, partitions=None,
+                 speedup=1.0, loop=False):
+        """
+        :arg stream:
+            replay.ReplayStream
+        :arg partition_index:
+            Partition of the stream to replay, from 0; None for this
+            process's worker index, once the first request is asked for
+        :arg partitions:
+            How many partitions the stream is dealt into; None for the
+            number of workers, once the first request is asked for
+        :arg speedup:
+            Divide the original inter-arrival times by this
+        :arg loop:
+            Start again from the beginning when the stream runs out
+        """
+        self.stream = stream
+        self.partition_index = partition_index
+        self.partitions = partitions
+        self.indexes = None
+        self.speedup = speedup
+        self.loop = loop
+        # Leave one average gap between loops
+        gap = stream.duration / max(1, len(stream) - 1)
+        self.period = (stream.duration + gap) / speedup
+        self.start = None
+        self.position = 0
+        self.loops = 0
+
+    def acquire(self):
+        """Wait for the next request to come due.
+
+        :returns:
+            (intended, method, path, name), intended being the
+            time.monotonic() timestamp it was due at, or None when the
+            stream is finished.
+        """
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+            # Workers only know their index and count once the test starts
+            partitions = self.partitions or corpus_shard.worker_count()
+            if self.partition_index is None:
+                index = corpus_shard.worker_index() % partitions
+            else:
+                index = self.partition_index
+            self.indexes = partition(len(self.stream), index, partitions)
+        if self.position >= len(self.indexes):
+            if not self.loop or not self.indexes:
+                return None
+            self.position = 0
+            self.loops += 1
+        offset, method, path, name = self.stream[self.indexes[self.position]]
+        self.position += 1
+        intended = self.start + self.loops * self.period \
+            + offset / self.speedup
+        if intended > now:
+            gevent.sleep(intended - now)
+        else:
+            # Not enough free users to keep the original timing
+            RECORDER.peak("replay.lag_ms", (now - intended) * 1000)
+        return intended, method, path, name
+
+
+def dispatcher_from_settings():
+    stream = ReplayStream(
+        Path(env_str("REPLAY_FILE", "data/requests.replay"))
+    )
+    index = env_int("REPLAY_PARTITION", -1)
+    partitions = env_int("REPLAY_PARTITIONS", 0)
+    return ReplayDispatcher(
+        stream,
+        partition_index=index if index >= 0 else None,
+        partitions=partitions if partitions > 0 else None,
+        speedup=env_float("REPLAY_SPEEDUP", 1.0),
+        loop=env_bool("REPLAY_LOOP"),
+    )
+
+
+DISPATCHER = dispatcher_from_settings()
+
+
+class ReplayTester(TaskSet):
+    """Re-issue recorded requests with their original timing.
+    """
+
+    @task(1)
+    def replay_next(self):
+        acquired = DISPATCHER.acquire()
+        if acquired is None:
+            raise StopUser("replay finished")
+        intended, method, path, name = acquired
+        try:
+            self.client.request(method, path, name=name)
+        finally:
+            milliseconds = (time.monotonic() - intended) * 1000
+            RECORDER.record(name + INTENDED_SUFFIX, milliseconds)
+
+
+class ReplayUser(GeoServerUser):
+    """Specify how each simulated user will behave.
+    """
+    # Timing comes from the replay stream, not from waits between tasks,
+    # which GeoServerUser leaves at zero.
+    tasks = [ReplayTester]
@@ -0,0 +1,159 @@
+"""Log sampled requests to a file without slowing down the tasks.
+
+Tasks push a tuple of raw fields onto an in-memory queue; a background
+thread does all the timestamp and JSON formatting and writes batches of
+newline-delimited JSON through one buffered file, rotating it by size.
+
+Locust monkey-patches threading, which would make that thread a greenlet
+doing its formatting and blocking writes on the hub, so it's a real OS
+thread from a gevent ThreadPool, as in image_validation.
+"""
+import atexit
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime
+from gevent.monkey import get_original
+from gevent.threadpool import ThreadPool
+from settings import env_str, env_int, env_float
+
+# time.sleep as it was before monkey-patching, for the writer thread
+_sleep = get_original("time", "sleep")
+
+# Field names for what WMSBehavior pushes, after the timestamp
+GET_MAP_FIELDS = (
+    "name", "url", "content_type", "status", "length", "digest",
+)
+
+
+class RequestLog:
+    """Sampled, size-rotated newline-JSON request log.
+    """
+
+    def __init__(self, path, fields, sample_rate=1.0, max_bytes=0,
+                 backup_count=5, max_queue=100000, flush_interval=1.0):
+        """
+        :arg path:
+            File to write, e.g. "requests.jsonl"
+        :arg fields:
+            Names for the values passed to push(), in order
+        :arg sample_rate:
+            Fraction of pushed requests to log, e.g. 0.01 for 1 in 100
+        :arg max_bytes:
+            Rotate the file once it grows past this size; 0 never rotates
+        :arg backup_count:
+            How many rotated files (path.1, path.2, ...) to keep
+        :arg max_queue:
+            Drop records rather than queueing more than this many
+        :arg flush_interval:
+            Seconds between writes from the background thread
+        """
+        self.path = path
+        self.fields = ("time",) + tuple(fields)
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+
+        # Count of records dropped because the queue was full
+        self.dropped = 0
+
+        # deque append/popleft are atomic, so no lock is needed
+        self._queue = deque()
+        self._credit = 0.0
+        self._stopped = False
+        self._stream = open(path, "ab", buffering=1024 * 1024)
+        self._size = self._stream.tell()
+        self._pool = ThreadPool(1)
+        self._writer = self._pool.spawn(self._run)
+
+    def push(self, *values):
+        """Queue one request's field values, if it is sampled.
+
+        Called on the hot path, so this does no formatting at all.
+        """
+        # Deterministic sampling: log one request each time enough
+        # fractional credit has built up
+        self._credit += self.sample_rate
+        if self._credit < 1.0:
+            return
+        self._credit -= 1.0
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._queue.append((time.time(),) + values)
+
+    def close(self):
+        """Stop the background thread after writing out everything queued.
+        """
+        if self._stopped:
+            return
+        self._stopped = True
+        self._writer.get()
+        self._pool.kill()
+        self._stream.close()
+
+    def _run(self):
+        while not self._stopped:
+            _sleep(self.flush_interval)
+            self._drain()
+        self._drain()
+
+    def _drain(self):
+        queue = self._queue
+        lines = []
+        while queue:
+            record = queue.popleft()
+            fields = dict(zip(self.fields, record))
+            fields["time"] = datetime.fromtimestamp(record[0]).isoformat()
+            lines.append(json.dumps(fields))
+        if not lines:
+            return
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        if self.max_bytes and self._size + len(data) > self.max_bytes:
+            self._rotate()
+        self._stream.write(data)
+        self._size += len(data)
+        self._stream.flush()
+
+    def _rotate(self):
+        """Rename path to path.1, path.1 to path.2, etc. and start afresh.
+        """
+        self._stream.close()
+        if self.backup_count:
+            for number in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{number}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{number + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._stream = open(self.path, "ab", buffering=1024 * 1024)
+        self._size = 0
+
+
+def from_settings(fields, prefix="REQUEST_LOG"):
+    """Make a RequestLog configured from environment variables.
+
+    The path may contain "{pid}", so that several locust processes on one
+    host each write (and rotate) their own file.
+
+    :returns:
+        None unless e.g. REQUEST_LOG_PATH is set, so callers can skip
+        logging entirely with a single `is None` test.
+    """
+    path = env_str(f"{prefix}_PATH")
+    if path is None:
+        return None
+    path = path.format(pid=os.getpid())
+    request_log = RequestLog(
+        path,
+        fields,
+        sample_rate=env_float(f"{prefix}_SAMPLE", 1.0),
+        max_bytes=env_int(f"{prefix}_MAX_BYTES", 100 * 1024 * 1024),
+        backup_count=env_int(f"{prefix}_BACKUPS", 5),
+    )
+    atexit.register(request_log.close)
+    return request_log
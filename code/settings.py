@@ -0,0 +1,70 @@
+"""Read tester configuration from environment variables.
+
+Locust doesn't give locustfiles a way to add their own command line options,
+so knobs for our testers are passed in the environment instead, e.g.::
+
+    WMS_URL_CACHE=lazy ./run_locust.sh "https://example.com"
+"""
+import os
+
+
+def env_str(name, default=None):
+    """Get a string setting, treating an empty value as unset.
+    """
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value
+
+
+def env_int(name, default):
+    value = env_str(name)
+    if value is None:
+        return default
+    return int(value)
+
+
+def env_float(name, default):
+    value = env_str(name)
+    if value is None:
+        return default
+    return float(value)
+
+
+def env_choice(name, choices, default):
+    """Get a string setting which must be one of `choices`.
+    """
+    value = env_str(name, default)
+    if value not in choices:
+        raise ValueError("{0}: unknown value {1!r}, expected one of {2}"
+                         .format(name, value, ", ".join(choices)))
+    return value
+
+
+def env_bool(name, default=False):
+    value = env_str(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def env_weights(name, default):
+    """Get a mapping of names to weights, e.g. "GML2=1,JSON=2".
+
+    Names missing from the setting get weight 0.
+
+    :arg default:
+        dict of name to weight, also giving the allowed names
+    """
+    value = env_str(name)
+    if value is None:
+        return dict(default)
+    weights = dict.fromkeys(default, 0)
+    for item in value.split(","):
+        key, _, weight = item.partition("=")
+        key = key.strip()
+        if key not in weights:
+            raise ValueError("{0}: unknown name {1!r}, expected one of {2}"
+                             .format(name, key, ", ".join(default)))
+        weights[key] = int(weight or 1)
+    return weights
@@ -0,0 +1,83 @@
+"""Define a locust swarm requesting cached tiles the way map clients do.
+
+wms_tester sends corpus tiles as untiled EPSG:4326 GetMap requests, which
+GeoServer renders every time. Production traffic mostly comes through
+GeoWebCache instead, so this asks for the same XYZ tiles as WMTS GetTile
+and WMS-C (tiled=true) GetMap requests in web mercator, which GeoWebCache
+serves from its cache or renders and caches. Requests are named by mode,
+format and cache result, e.g. "WMTS_png [MISS]", so the seeded and cold
+paths show up separately; CORPUS_HOT_RATIO helps seed a hot set.
+
+Generate the corpus with tile indexes to use them directly, e.g.::
+
+    ./code/mercantile_gen.py --tile-index --output data/wms_256_tiles.bbox
+
+otherwise z/x/y are worked out from each row's bounds.
+"""
+from wms_behavior import WMSBehavior, row_tile, expected_content_type
+import corpus_shard
+import open_loop
+from transport import GeoServerUser
+from utils import load_corpus, weighted_tasks
+from settings import env_str, env_weights
+
+# How often to use each way of asking for a tile, e.g. "WMTS=3,WMSC=1"
+MODE_WEIGHTS = env_weights("TILE_MODE_WEIGHTS", {"WMTS": 1, "WMSC": 1})
+LAYER = env_str("TILE_LAYER", "osm:osm")
+# GeoWebCache gridset; its z/x/y must match the XYZ grid, as EPSG:900913's
+# do, and for WMS-C the SRS is the gridset's
+GRIDSET = env_str("TILE_GRIDSET", "EPSG:900913")
+IMAGE_FORMAT = env_str("TILE_FORMAT", "image/png")
+
+# None unless OPEN_LOOP_RATE asks for a constant arrival rate
+ARRIVALS = open_loop.from_settings()
+
+
+class TileTester(WMSBehavior):
+    """Exercise GeoWebCache through WMTS and WMS-C
+    """
+
+    # Load data at import time
+    # wms_256_tiles.bbox can be generated by mercantile_gen
+    corpus = load_corpus("wms_256_tiles.bbox")
+    # This process's shard of the corpus, shared by its users
+    rows = corpus_shard.from_settings(len(corpus))
+
+    def wmts_get_tile(self):
+        """Exercise WMTS GetTile
+        """
+        self.tile_request("WMTS", self.get_tile, "/geoserver/gwc/service/wmts")
+
+    def wmsc_get_map(self):
+        """Exercise tiled WMS GetMap, as WMS-C clients send it
+        """
+        self.tile_request("WMSC", self.get_map_tiled, "/geoserver/wms")
+
+    def tile_request(self, mode, method, uri):
+        if ARRIVALS is not None:
+            intended = ARRIVALS.acquire()
+        index, temperature = self.rows.next()
+        name = "{0}_{1}{2}".format(
+            mode, IMAGE_FORMAT.split("/")[-1],
+            corpus_shard.suffix(temperature),
+        )
+        try:
+            return method(
+                uri, LAYER, row_tile(self.corpus[index]), IMAGE_FORMAT,
+                GRIDSET, name=name,
+                expected=expected_content_type(IMAGE_FORMAT),
+            )
+        finally:
+            if ARRIVALS is not None:
+                ARRIVALS.complete(name, intended)
+
+    tasks = weighted_tasks(MODE_WEIGHTS, {
+        "WMTS": wmts_get_tile,
+        "WMSC": wmsc_get_map,
+    })
+
+
+class TileUser(GeoServerUser):
+    """Specify how each simulated user will behave.
+    """
+    tasks = [TileTester]
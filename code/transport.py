@@ -0,0 +1,452 @@
+"""Pluggable HTTP transports for the WMS and WFS behaviors.
+
+Locust's default client goes through requests, which spends far more CPU
+per request than GeoServer tile fetches are worth: each worker tops out at
+a few hundred requests per second. RawHTTPClient is a drop-in for the parts
+of locust's HttpSession the behaviors use (get/request, name, with-blocks
+for catch_response with success()/failure(), stream=True with
+iter_content), speaking HTTP/1.1 straight over (gevent-patched) sockets:
+
+- idle keep-alive connections are pooled and reused
+- the request line is the only thing built per request; the rest of the
+  header block is rendered once per client
+- responses are parsed with a buffered reader, handling Content-Length,
+  chunked and close-delimited bodies, and bodies are streamed, not kept
+
+It fires the same locust request event as HttpSession, so locust's stats
+and the latency recorder see no difference. Pick it with WMS_TRANSPORT=raw
+for any GeoServerUser; code/bench_transport.py compares the transports'
+throughput.
+"""
+import socket
+import ssl
+import time
+from urllib.parse import urlencode, urlsplit
+from locust import HttpUser, constant
+from locust.exception import CatchResponseError
+from settings import env_str, env_int, env_float
+
+TRANSPORT = env_str("WMS_TRANSPORT", "requests")
+TIMEOUT = env_float("WMS_TRANSPORT_TIMEOUT", 60.0)
+POOL_SIZE = env_int("WMS_TRANSPORT_POOL_SIZE", 10)
+
+USER_AGENT = "geoserver-locust"
+
+# Read buffer size for each connection
+BUFFER_SIZE = 64 * 1024
+
+# No body whatever the headers say
+NO_BODY_STATUSES = {204, 304}
+
+
+class TransportError(OSError):
+    """Raised for connections closed or responses mangled mid-request.
+
+    An OSError, like the socket errors it stands beside, so code handling
+    failed reads of a body handles these too.
+    """
+
+
+class Headers(dict):
+    """Response headers, looked up case-insensitively.
+    """
+
+    def __getitem__(self, name):
+        return dict.__getitem__(self, name.lower())
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name.lower())
+
+    def get(self, name, default=None):
+        return dict.get(self, name.lower(), default)
+
+
+class Connection:
+    """One keep-alive connection and its read buffer.
+    """
+
+    def __init__(self, host, port, use_ssl, timeout):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if use_ssl:
+            context = ssl.create_default_context()
+            self.sock = context.wrap_socket(self.sock, server_hostname=host)
+        self.reader = self.sock.makefile("rb", BUFFER_SIZE)
+        # Whether this connection has carried a request before
+        self.used = False
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class RawResponse:
+    """A response whose body is read from the connection on demand.
+
+    Quacks enough like locust's responses for our behaviors: with
+    catch_response, use it as a context manager and call success() or
+    failure() inside the with-block, and it's reported when the block ends.
+    """
+
+    def __init__(self, client, connection, method, name, url, start_time):
+        self._client = client
+        self._connection = connection
+        self._method = method
+        self._manual_result = None
+        self._reported = False
+        self._remaining = None
+        self._chunked = False
+        self._keep_alive = False
+        self.status_code = 0
+        self.headers = Headers()
+        self.error = None
+        # Same shape as locust's, so validation.consume() can update it
+        self.request_meta = {
+            "request_type": method,
+            "response_time": 0,
+            "name": name,
+            "context": client.user.context() if client.user else {},
+            "response": self,
+            "exception": None,
+            "start_time": start_time,
+            "url": url,
+            "response_length": 0,
+        }
+        self._body_done = connection is None
+
+    def _read_head(self):
+        reader = self._connection.reader
+        # Skip interim responses, e.g. 100 Continue, to get to the real one;
+        # 101 Switching Protocols is the last thing said in HTTP
+        while True:
+            line = reader.readline(65537)
+            if not line:
+                raise TransportError("connection closed before response")
+            parts = line.split(None, 2)
+            if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
+                raise TransportError(
+                    "bad status line {0!r}".format(line[:80])
+                )
+            version = parts[0]
+            self.status_code = int(parts[1])
+            headers = self.headers = Headers()
+            while True:
+                line = reader.readline(65537)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.partition(b":")
+                headers[name.strip().lower().decode("latin-1")] = \
+                    value.strip().decode("latin-1")
+            if not 100 <= self.status_code < 200 or self.status_code == 101:
+                break
+
+        connection_header = headers.get("connection", "").lower()
+        if version == b"HTTP/1.0":
+            self._keep_alive = connection_header == "keep-alive"
+        else:
+            self._keep_alive = connection_header != "close"
+        if self._method == "HEAD" or self.status_code in NO_BODY_STATUSES \
+                or self.status_code < 200:
+            self._remaining = 0
+        elif "chunked" in headers.get("transfer-encoding", "").lower():
+            self._chunked = True
+        elif "content-length" in headers:
+            self._remaining = int(headers["content-length"])
+        else:
+            # Body runs until the server closes the connection
+            self._keep_alive = False
+
+    def iter_content(self, chunk_size=BUFFER_SIZE):
+        """Yield the body in pieces of at most chunk_size bytes.
+        """
+        if self._body_done:
+            return
+        reader = self._connection.reader
+        try:
+            if self._chunked:
+                yield from self._iter_chunked(reader, chunk_size)
+            elif self._remaining is not None:
+                while self._remaining:
+                    chunk = reader.read1(min(chunk_size, self._remaining))
+                    if not chunk:
+                        raise TransportError("connection closed mid-body")
+                    self._remaining -= len(chunk)
+                    self.request_meta["response_length"] += len(chunk)
+                    yield chunk
+            else:
+                while True:
+                    chunk = reader.read1(chunk_size)
+                    if not chunk:
+                        break
+                    self.request_meta["response_length"] += len(chunk)
+                    yield chunk
+        except (OSError, ValueError):
+            self._keep_alive = False
+            self._finish()
+            raise
+        self._finish()
+
+    def _iter_chunked(self, reader, chunk_size):
+        while True:
+            line = reader.readline(1026)
+            if not line:
+                raise TransportError("connection closed mid-chunk")
+            try:
+                size = int(line.split(b";", 1)[0], 16)
+            except ValueError:
+                raise TransportError(
+                    "bad chunk size {0!r}".format(line[:80])
+                ) from None
+            if not size:
+                # Skip any trailers
+                while reader.readline(65537) not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            while size:
+                chunk = reader.read1(min(chunk_size, size))
+                if not chunk:
+                    raise TransportError("connection closed mid-chunk")
+                size -= len(chunk)
+                self.request_meta["response_length"] += len(chunk)
+                yield chunk
+            reader.readline(3)
+
+    def _finish(self):
+        """Note the body is done, and hand back or close the connection.
+        """
+        if self._body_done:
+            return
+        self._body_done = True
+        meta = self.request_meta
+        meta["response_time"] = (time.time() - meta["start_time"]) * 1000
+        self._client._release(self._connection, self._keep_alive)
+        self._connection = None
+
+    @property
+    def content(self):
+        """Read and return the whole body, if it hasn't been streamed.
+        """
+        if not hasattr(self, "_content"):
+            self._content = b"".join(self.iter_content())
+        return self._content
+
+    def close(self):
+        """Drop the rest of the body and the connection, unless finished.
+        """
+        if not self._body_done:
+            self._keep_alive = False
+            self._finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, traceback):
+        # Anything left unread goes, along with its connection
+        self.close()
+        if exc is not None and self._manual_result is None:
+            # The request must still reach the stats, as a failure
+            self._manual_result = value
+        self._report()
+        # A transport failure is the request's failure, as with requests'
+        # client; anything else is a bug to let through
+        return exc is None or issubclass(exc, OSError)
+
+    def success(self):
+        self._manual_result = True
+
+    def failure(self, exception):
+        if not isinstance(exception, Exception):
+            exception = CatchResponseError(exception)
+        self._manual_result = exception
+
+    def _report(self):
+        """Fire locust's request event, once, with the outcome so far.
+        """
+        if self._reported:
+            return
+        self._reported = True
+        if self._manual_result is None:
+            # Nobody said, so judge by the transport and the status
+            if self.error is not None:
+                self._manual_result = self.error
+            elif self.status_code >= 400:
+                self._manual_result = CatchResponseError(
+                    "HTTP {0}".format(self.status_code)
+                )
+            else:
+                self._manual_result = True
+        if self._manual_result is not True:
+            self.request_meta["exception"] = self._manual_result
+        self._client.request_event.fire(**self.request_meta)
+
+
+class RawHTTPClient:
+    """Minimal keep-alive HTTP/1.1 client with locust's reporting.
+    """
+
+    def __init__(self, base_url, request_event, user=None, timeout=TIMEOUT,
+                 pool_size=POOL_SIZE):
+        """
+        :arg base_url:
+            e.g. "https://geoserver.example.com"; request paths are
+            relative to this
+        :arg request_event:
+            Locust's request event, e.g. environment.events.request
+        :arg user:
+            The User this client belongs to, for its context()
+        :arg pool_size:
+            Most idle connections to keep open
+        """
+        parts = urlsplit(base_url)
+        self.base_url = base_url
+        self.request_event = request_event
+        self.user = user
+        self.use_ssl = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.use_ssl else 80)
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._idle = []
+        default_port = 443 if self.use_ssl else 80
+        host_header = self.host if self.port == default_port \
+            else "{0}:{1}".format(self.host, self.port)
+        # Everything after the request line, rendered once
+        self._header_block = (
+            "Host: {0}\r\n"
+            "User-Agent: {1}\r\n"
+            "Accept: */*\r\n"
+            "Accept-Encoding: identity\r\n"
+            "Connection: keep-alive\r\n"
+        ).format(host_header, USER_AGENT).encode("latin-1")
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def request(self, method, url, name=None, catch_response=False,
+                params=None, stream=False, headers=None, data=None):
+        """Send a request, much like locust's HttpSession.request.
+
+        :arg url:
+            Path (and query) relative to base_url
+        :arg catch_response:
+            If true, the caller must use the response in a with-block,
+            and may call success() or failure() on it there; otherwise
+            it's reported as soon as it's read. Either way it's a failure
+            if the transport failed or the status is 400 or more, unless
+            the caller says otherwise.
+        :arg stream:
+            If true, leave the body to be read with iter_content()
+        """
+        if params:
+            url += ("&" if "?" in url else "?") + urlencode(params)
+        path = self.prefix + url
+        name = name or path.split("?", 1)[0]
+        head = bytearray(
+            "{0} {1} HTTP/1.1\r\n".format(method, path).encode("latin-1")
+        )
+        head += self._header_block
+        for key, value in (headers or {}).items():
+            head += "{0}: {1}\r\n".format(key, value).encode("latin-1")
+        if data is not None:
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            head += "Content-Length: {0}\r\n".format(len(data)).encode()
+        head += b"\r\n"
+        if data is not None:
+            head += data
+
+        url = self.base_url.rstrip("/") + url
+        start_time = time.time()
+        try:
+            response = self._send(bytes(head), method, name, url, start_time)
+        except (OSError, ValueError) as error:
+            response = RawResponse(self, None, method, name, url, start_time)
+            response.error = error
+            response.request_meta["response_time"] = \
+                (time.time() - start_time) * 1000
+        else:
+            if not stream or not catch_response:
+                try:
+                    response.content
+                except (OSError, ValueError) as error:
+                    response.error = error
+        if not catch_response:
+            response._report()
+        return response
+
+    def _send(self, head, method, name, url, start_time):
+        """Send a request and read the response's status line and headers.
+        """
+        connection = self._acquire()
+        while True:
+            reused = connection.used
+            connection.used = True
+            response = RawResponse(
+                self, connection, method, name, url, start_time,
+            )
+            try:
+                connection.sock.sendall(head)
+                response._read_head()
+                return response
+            except OSError:
+                connection.close()
+                # The server may have closed an idle connection just as we
+                # picked it up; try again once, on a fresh one, whose
+                # failure is final.
+                if not reused:
+                    raise
+                connection = self._connect()
+            except ValueError:
+                connection.close()
+                raise
+
+    def _acquire(self):
+        if self._idle:
+            return self._idle.pop()
+        return self._connect()
+
+    def _connect(self):
+        return Connection(self.host, self.port, self.use_ssl, self.timeout)
+
+    def _release(self, connection, keep_alive):
+        if keep_alive and len(self._idle) < self.pool_size:
+            self._idle.append(connection)
+        else:
+            connection.close()
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+
+def client_from_settings(user, default):
+    """Get the client a user should use, according to WMS_TRANSPORT.
+
+    :arg user:
+        The User, whose host is e.g. "https://geoserver.example.com"
+    :arg default:
+        Locust's own requests-based client, used for "requests"
+    """
+    if TRANSPORT == "requests":
+        return default
+    if TRANSPORT == "raw":
+        return RawHTTPClient(
+            user.host, user.environment.events.request, user,
+        )
+    raise ValueError("unknown WMS_TRANSPORT {0!r}".format(TRANSPORT))
+
+
+class GeoServerUser(HttpUser):
+    """Base for our simulated users, with the client WMS_TRANSPORT picks.
+
+    Subclasses set tasks. Users go straight on to their next task, as fast
+    as the server answers; open_loop or replay pacing happens inside the
+    tasks instead.
+    """
+    abstract = True
+    wait_time = constant(0)
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        self.client = client_from_settings(self, self.client)
@@ -0,0 +1,73 @@
+"""Cache fully rendered request URLs so hot tasks don't rebuild them.
+"""
+from functools import lru_cache
+from wms_behavior import get_map_url
+
+
+class GetMapURLCache:
+    """Pre-rendered GetMap URLs for each row of a bbox corpus.
+
+    Everything except the bbox is the same for every row with a given
+    layer/format/size/CRS, so that part of the URL is only urlencoded once
+    per format. Complete URLs are then either all built up front (eager),
+    or built on first use and kept in a bounded LRU (lazy).
+    """
+
+    def __init__(self, corpus, uri, layers, width, height, crs,
+                 bbox_format="{0},{1},{2},{3}", maxsize=100000):
+        """
+        :arg corpus:
+            Indexable bbox rows, e.g. from utils.load_corpus
+        :arg bbox_format:
+            Format string which renders a row as a bbox parameter value,
+            e.g. "{1},{0},{3},{2}" to swap axis order
+        :arg maxsize:
+            Maximum number of URLs to keep when built lazily
+        """
+        self.corpus = corpus
+        self.uri = uri
+        self.layers = layers
+        self.width = width
+        self.height = height
+        self.crs = crs
+        self.bbox_format = bbox_format
+        self._prefixes = {}
+        self._tables = {}
+        self._lazy = lru_cache(maxsize=maxsize)(self._build)
+
+    def prefix(self, image_format):
+        """Get the URL for a format, up to and including "bbox=".
+        """
+        prefix = self._prefixes.get(image_format)
+        if prefix is None:
+            prefix = get_map_url(
+                self.uri, self.layers, image_format, self.width,
+                self.height, "", self.crs,
+            )
+            self._prefixes[image_format] = prefix
+        return prefix
+
+    def prepare(self, image_formats):
+        """Build every URL for the given formats up front.
+
+        This takes memory proportional to rows times formats, so it's meant
+        for modest corpora; big ones should rely on the lazy LRU instead.
+        """
+        for image_format in image_formats:
+            prefix = self.prefix(image_format)
+            bbox_format = self.bbox_format
+            self._tables[image_format] = [
+                prefix + bbox_format.format(*row) for row in self.corpus
+            ]
+
+    def get(self, index, image_format):
+        """Get the complete URL for a corpus row index and format.
+        """
+        table = self._tables.get(image_format)
+        if table is not None:
+            return table[index]
+        return self._lazy(index, image_format)
+
+    def _build(self, index, image_format):
+        row = self.corpus[index]
+        return self.prefix(image_format) + self.bbox_format.format(*row)
@@ -1,16 +1,47 @@
 import csv
 from itertools import cycle
 from pathlib import Path
+from bbox_corpus import BBoxCorpus, SUFFIX
+import validation
 
 
-def load_bbox_data(filename):
-    """Load a data file containing example bboxes.
+def load_corpus(filename):
+    """Load a data file containing example bboxes, without cycling it.
+
+    Binary corpus files (see bbox_corpus) are memory-mapped and give rows
+    as tuples of floats; anything else is read as CSV, giving rows as lists
+    of strings. Either way the result supports len() and indexing.
     """
     path = Path("data", filename)
+    if path.suffix == SUFFIX:
+        return BBoxCorpus(path)
     with open(path, newline="") as stream:
         reader = csv.reader(stream)
-        iterator = cycle(list(reader))
-    return iterator
+        return list(reader)
+
+
+def load_bbox_data(filename):
+    """Load a data file containing example bboxes.
+
+    Returns an iterator which yields rows forever, wrapping around at the end.
+    """
+    corpus = load_corpus(filename)
+    if isinstance(corpus, BBoxCorpus):
+        return corpus.cycle()
+    return cycle(corpus)
+
+
+def weighted_tasks(weights, tasks):
+    """Build a locust tasks dict, leaving out tasks with weight 0.
+
+    :arg weights:
+        Mapping of names to weights, e.g. from settings.env_weights()
+    :arg tasks:
+        Mapping of the same names to task functions
+    """
+    return {
+        tasks[key]: weight for key, weight in weights.items() if weight
+    }
 
 
 def check_content(response, expected):
@@ -19,7 +50,13 @@ def check_content(response, expected):
     Invoked inside locust task functions to mark success/failure
     (we can't consistently trust that 200 means everything is okay,
     so we use catch_response=True).
+
+    The body is streamed through validation.consume(), so it must be empty
+    or start like the expected kind of content (e.g. PNG magic bytes for
+    "image/png"), but is never held in memory. Send requests with
+    stream=True to get the benefit.
     """
+    body = validation.consume(response)
     content_type = response.headers.get("Content-Type")
     if not content_type:
         response.failure("No Content-Type in response")
@@ -28,7 +65,9 @@ def check_content(response, expected):
             expected, content_type,
         )
         response.failure(message)
-    elif not response.content:
-        response.failure("Empty response")
     else:
-        response.success()
+        problem = body.problem(validation.expected_kind(expected))
+        if problem:
+            response.failure(problem)
+        else:
+            response.success()
@@ -0,0 +1,166 @@
+"""Validate response bodies as they stream in, without keeping them.
+
+Reading `response.content` holds the whole body in memory just to check it
+isn't empty; for big GML or GeoJSON responses that's a lot of memory and
+copying per request. Instead, requests are sent with stream=True and
+consume() reads the body in chunks, counting bytes, keeping only the first
+few for sniffing magic numbers, optionally hashing, and throwing the rest
+away.
+"""
+import codecs
+import hashlib
+import time
+from requests.exceptions import RequestException
+from settings import env_str, env_int
+
+# e.g. "sha1" to hash every body, so identical responses can be spotted
+HASH = env_str("RESPONSE_HASH")
+CHUNK_SIZE = env_int("RESPONSE_CHUNK_SIZE", 64 * 1024)
+
+# How much of the start of each body to keep for sniffing and logging
+HEAD_BYTES = 512
+
+MAGIC = {
+    "png": (b"\x89PNG\r\n\x1a\n",),
+    "jpeg": (b"\xff\xd8\xff",),
+    "tiff": (b"II*\x00", b"MM\x00*"),
+}
+
+
+def expected_kind(content_type):
+    """Get the kind of body a Content-Type promises, e.g. "png".
+
+    :returns:
+        One of the MAGIC keys, "xml", "json", or None if we can't check
+        that kind of body.
+    """
+    if not content_type:
+        return None
+    content_type = content_type.split(";", 1)[0].strip().lower()
+    for kind in MAGIC:
+        if content_type == "image/" + kind:
+            return kind
+    if content_type == "image/png8":
+        return "png"
+    if "json" in content_type:
+        return "json"
+    if "xml" in content_type or "gml" in content_type:
+        return "xml"
+    return None
+
+
+def sniff(head):
+    """Guess the kind of a body from its first bytes.
+    """
+    for kind, prefixes in MAGIC.items():
+        if head.startswith(prefixes):
+            return kind
+    text = head
+    if text.startswith(codecs.BOM_UTF8):
+        text = text[len(codecs.BOM_UTF8):]
+    text = text.lstrip()
+    if text.startswith(b"<"):
+        return "xml"
+    if text.startswith((b"{", b"[")):
+        return "json"
+    return None
+
+
+class StreamValidator:
+    """Accumulate what we need to know about a body, a chunk at a time.
+    """
+
+    def __init__(self, hash_name=None, keep_body=False, count=None):
+        """
+        :arg hash_name:
+            hashlib algorithm to digest the body with, e.g. "sha1"
+        :arg keep_body:
+            Keep the whole body after all, e.g. for image_validation
+        :arg count:
+            Bytes to count the occurrences of in the body as `matches`,
+            e.g. the start tag of a feature
+        """
+        self.length = 0
+        self.head = b""
+        self.body = bytearray() if keep_body else None
+        self.matches = 0
+        self._count = count
+        # End of the last chunk, in case a match straddles two chunks
+        self._tail = b""
+        # Set if the body couldn't be read to the end
+        self.error = None
+        self._hash = hashlib.new(hash_name) if hash_name else None
+
+    def feed(self, chunk):
+        self.length += len(chunk)
+        if len(self.head) < HEAD_BYTES:
+            self.head += chunk[:HEAD_BYTES - len(self.head)]
+        if self._hash is not None:
+            self._hash.update(chunk)
+        if self.body is not None:
+            self.body += chunk
+        if self._count:
+            data = self._tail + chunk
+            self.matches += data.count(self._count)
+            self._tail = data[max(0, len(data) - len(self._count) + 1):]
+
+    @property
+    def kind(self):
+        return sniff(self.head)
+
+    @property
+    def digest(self):
+        if self._hash is None:
+            return None
+        return self._hash.hexdigest()
+
+    def problem(self, kind=None):
+        """Describe what's wrong with the body, or get None if it's fine.
+
+        :arg kind:
+            What the body should be, e.g. from expected_kind()
+        """
+        if self.error is not None:
+            return "Error reading body: {0!r}".format(self.error)
+        if not self.length:
+            return "Empty response"
+        if kind is not None and self.kind != kind:
+            return "Expected {0} body but got {1}: {2!r}".format(
+                kind, self.kind or "unknown", self.head[:20],
+            )
+        return None
+
+
+def consume(response, hash_name=HASH, chunk_size=CHUNK_SIZE,
+            keep_body=False, count=None):
+    """Read a locust response's body through a StreamValidator.
+
+    Safe to call more than once: later calls get the same validator. Send
+    the request with stream=True, or requests will already have read the
+    whole body into memory.
+
+    Locust times streamed requests only until the headers arrive and takes
+    their size from Content-Length, which GeoServer often leaves out, so
+    the request's recorded time and size are updated to cover the body.
+    That only counts while the request is still to be reported, i.e.
+    inside its catch_response with-block.
+    """
+    validator = getattr(response, "stream_validator", None)
+    if validator is not None:
+        return validator
+    validator = StreamValidator(hash_name, keep_body, count)
+    try:
+        for chunk in response.iter_content(chunk_size):
+            validator.feed(chunk)
+    except (RequestException, OSError, ValueError) as error:
+        validator.error = error
+    finally:
+        # Hand the connection back to the pool
+        response.close()
+    response.stream_validator = validator
+
+    meta = getattr(response, "request_meta", None)
+    if meta is not None:
+        meta["response_time"] = (time.time() - meta["start_time"]) * 1000
+        meta["response_length"] = validator.length
+    return validator
@@ -0,0 +1,196 @@
+"""Define a locust swarm of map viewer sessions.
+
+Each user behaves like someone using a slippy map: it opens a viewport of
+tiles around a corpus tile, fetches all of them at once over a bounded
+number of concurrent requests, as a browser does, then pans to a
+neighbouring tile or zooms in or out and fetches whatever the new viewport
+needs that it hasn't already got. After VIEWER_SESSION_MOVES moves it
+starts a new session somewhere else, with an empty cache.
+
+How long a whole viewport takes to load is what a user actually waits
+for, so besides each tile request this reports a request of type VIEWPORT
+per view, named by how it was reached (e.g. "Viewport pan"), timed from
+the first tile request until the last tile arrives, and failed if any
+tile failed.
+"""
+import random
+import time
+import mercantile
+from gevent.pool import Pool
+from locust import task, between
+from wms_behavior import WMSBehavior, row_tile, expected_content_type
+import corpus_shard
+from transport import GeoServerUser
+from utils import load_corpus
+from settings import env_str, env_int, env_float, env_weights
+
+# Viewport size in tiles is picked per session from these ranges
+MIN_COLUMNS = env_int("VIEWER_MIN_COLUMNS", 4)
+MAX_COLUMNS = env_int("VIEWER_MAX_COLUMNS", 8)
+MIN_ROWS = env_int("VIEWER_MIN_ROWS", 4)
+MAX_ROWS = env_int("VIEWER_MAX_ROWS", 6)
+# Concurrent tile requests per user; browsers allow about 6 per host
+CONCURRENCY = env_int("VIEWER_CONCURRENCY", 6)
+SESSION_MOVES = env_int("VIEWER_SESSION_MOVES", 20)
+MOVE_WEIGHTS = env_weights(
+    "VIEWER_MOVE_WEIGHTS", {"pan": 6, "zoom_in": 2, "zoom_out": 2},
+)
+MIN_ZOOM = env_int("VIEWER_MIN_ZOOM", 2)
+MAX_ZOOM = env_int("VIEWER_MAX_ZOOM", 18)
+# "wmsc" for tiled=true GetMap, "wmts" for GetTile, or "wms" for
+# untiled EPSG:4326 GetMap like wms_tester's
+MODE = env_str("VIEWER_MODE", "wmsc")
+LAYER = env_str("VIEWER_LAYER", "osm:osm")
+IMAGE_FORMAT = env_str("VIEWER_FORMAT", "image/png")
+
+# Request type and name prefix of the viewport-complete metric
+VIEWPORT = "VIEWPORT"
+
+# Rows are west,south,east,north; WMS 1.3.0 EPSG:4326 wants lat/lon
+BBOX_FORMAT = "{1},{0},{3},{2}"
+
+
+def viewport(center, columns, rows):
+    """Get the tiles of a viewport centred on a tile.
+
+    Columns wrap around the antimeridian; rows off the top or bottom of
+    the world are left out.
+    """
+    size = 2 ** center.z
+    left = center.x - columns // 2
+    top = center.y - rows // 2
+    return [
+        mercantile.Tile((left + column) % size, top + row, center.z)
+        for row in range(0, rows) if 0 <= top + row < size
+        for column in range(0, columns)
+    ]
+
+
+def move(tile):
+    """Pick the next view's centre by panning or zooming from a tile.
+
+    :returns:
+        (kind of move, new centre tile)
+    """
+    kind, = random.choices(
+        list(MOVE_WEIGHTS), weights=list(MOVE_WEIGHTS.values()),
+    )
+    if kind == "zoom_in" and tile.z < MAX_ZOOM:
+        return kind, random.choice(mercantile.children(tile))
+    if kind == "zoom_out" and tile.z > MIN_ZOOM:
+        return kind, mercantile.parent(tile)
+    return "pan", random.choice(mercantile.neighbors(tile))
+
+
+class MapViewer(WMSBehavior):
+    """Browse a map a viewport at a time
+    """
+
+    # Load data at import time
+    # wms_256_tiles.bbox can be generated by mercantile_gen
+    corpus = load_corpus("wms_256_tiles.bbox")
+    # Session start points come from this process's shard of the corpus
+    rows = corpus_shard.from_settings(len(corpus))
+
+    def on_start(self):
+        self.pool = Pool(CONCURRENCY)
+        self.start_session()
+
+    def start_session(self):
+        index, _ = self.rows.next()
+        self.center = row_tile(self.corpus[index])
+        self.size = (
+            random.randint(MIN_COLUMNS, MAX_COLUMNS),
+            random.randint(MIN_ROWS, MAX_ROWS),
+        )
+        self.moves = 0
+        # Tiles the "browser" already has, which it won't fetch again
+        self.seen = set()
+        self.next_move = "start"
+
+    @task(1)
+    def view(self):
+        """Load the current viewport, then decide where to go next
+        """
+        if self.moves >= SESSION_MOVES:
+            self.start_session()
+        tiles = [
+            tile for tile in viewport(self.center, *self.size)
+            if tile not in self.seen
+        ]
+        responses = self.load_viewport(self.next_move, tiles)
+        # Failed tiles would be fetched again, as a browser would retry them
+        self.seen.update(
+            tile for tile, response in zip(tiles, responses)
+            if response.request_meta["exception"] is None
+        )
+        self.moves += 1
+        self.next_move, self.center = move(self.center)
+
+    def load_viewport(self, kind, tiles):
+        """Fetch tiles concurrently and report how long they all took.
+
+        :returns:
+            The tiles' responses, in the same order
+        """
+        start_time = time.time()
+        start = time.perf_counter()
+        responses = self.pool.map(self.get_viewer_tile, tiles)
+        milliseconds = (time.perf_counter() - start) * 1000
+        failed = [
+            response for response in responses
+            if response.request_meta["exception"] is not None
+        ]
+        exception = None
+        if failed:
+            exception = failed[0].request_meta["exception"]
+        self.user.environment.events.request.fire(
+            request_type=VIEWPORT,
+            name="Viewport " + kind.replace("_", " "),
+            response_time=milliseconds,
+            response_length=sum(
+                response.request_meta["response_length"] or 0
+                for response in responses
+            ),
+            exception=exception,
+            context={"tiles": len(tiles), "failed": len(failed)},
+            start_time=start_time,
+            url=None,
+        )
+        return responses
+
+    def get_viewer_tile(self, tile):
+        name = "Viewer_{0}_{1}".format(MODE, IMAGE_FORMAT.split("/")[-1])
+        expected = expected_content_type(IMAGE_FORMAT)
+        if MODE == "wmts":
+            return self.get_tile(
+                "/geoserver/gwc/service/wmts", LAYER, tile, IMAGE_FORMAT,
+                name=name, expected=expected,
+            )
+        if MODE == "wmsc":
+            return self.get_map_tiled(
+                "/geoserver/wms", LAYER, tile, IMAGE_FORMAT,
+                name=name, expected=expected,
+            )
+        return self.get_map(
+            uri="/geoserver/wms",
+            layers=LAYER,
+            image_format=IMAGE_FORMAT,
+            width=256,
+            height=256,
+            bbox=BBOX_FORMAT.format(*mercantile.bounds(tile)),
+            crs="EPSG:4326",
+            name=name,
+            expected=expected,
+        )
+
+
+class ViewerUser(GeoServerUser):
+    """Specify how each simulated user will behave.
+    """
+    tasks = [MapViewer]
+
+    # Time spent looking at each view before moving on
+    wait_time = between(
+        env_float("VIEWER_MIN_THINK", 1.0), env_float("VIEWER_MAX_THINK", 5.0),
+    )
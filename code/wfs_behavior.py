@@ -1,7 +1,11 @@
-"""Implement WMS requests without specific test logic.
+"""Implement WFS requests without specific test logic.
 """
 from urllib.parse import urlencode
 from locust import TaskSet
+import latency_recorder
+
+# Collect latency histograms if LATENCY_HISTOGRAM_PATH is set
+latency_recorder.install_from_settings()
 
 
 class WFSBehavior(TaskSet):
@@ -10,21 +14,50 @@ class WFSBehavior(TaskSet):
     WFSTester uses this to implement the specific test logic.
     """
 
-    def get_feature(self, uri, output_format, bbox=None, name=None):
+    def get_feature(self, uri, type_name, output_format, bbox=None,
+                    version="1.1.0", max_features=None, start_index=None,
+                    name=None):
         """Make a GetFeature request to a WFS service.
+
+        The response is reported when the caller's with-block ends.
+
+        :arg uri:
+            e.g. "/geoserver/wfs"
+        :arg type_name:
+            e.g. "ws0030:ft0001"
+        :arg output_format:
+            e.g. "GML2", "GML3" or "application/json"
+        :arg bbox:
+            passed through as-is
+        :arg max_features:
+            Features per page; sent as maxFeatures, or count for WFS 2.0
+        :arg start_index:
+            Features to skip, for paging
+        :arg name:
+            e.g. "WFS_GML2_BBOX"
         """
         parameters = {
             "service": "wfs",
-            "version": "1.1.0",
+            "version": version,
             "request": "GetFeature",
-            "typeName": "ws0030:ft0001",
+            "typeName": type_name,
             "outputFormat": output_format,
         }
-        # Build URL ourselves since requests insists on encoding commas
-        # in querystrings, grumble grumble
-        uri = "{}?{}&bbox={}".format(uri, urlencode(parameters), bbox)
+        if max_features:
+            if version.startswith("2."):
+                parameters["count"] = max_features
+            else:
+                parameters["maxFeatures"] = max_features
+        if start_index:
+            parameters["startIndex"] = start_index
+        url = "{}?{}".format(uri, urlencode(parameters))
+        if bbox is not None:
+            # Build URL ourselves since requests insists on encoding commas
+            # in querystrings, grumble grumble
+            url += "&bbox={}".format(bbox)
         return self.client.get(
-            uri=uri,
+            url,
             name=name,
             catch_response=True,
+            stream=True,
         )
@@ -1,48 +1,126 @@
-from locust import HttpLocust, TaskSet, task
-import csv
-
-
-
-class EcWfsTester(TaskSet):
-
-    with open('../bbox_data/roads-bbox-100k.csv', 'rb') as f:
-            #fieldnames = ['width','height','bottom','left','top','right']
-            reader = csv.reader(f)
-            bbox_iterator = iter(list(reader))
-
-    # @task(1)
-    # def wms_get_capabilities(l):
-    #     l.client.get("/geoserver/ows/service=WMS&request=GetCapabilities")
-    @task(1)
-    def wfs_gml2_bbox(self):
-        response = self._doWFS("GML2","WFS_GML2_BBOX")
-        if "text/xml" not in response.headers['Content-Type']:
-            response.failure("Expected content-type to be text/xml but found"+response.headers['Content-Type'])
-        response.success()
-
-    @task(1)
-    def wfs_gml3_bbox(self):
-        response = self._doWFS("GML3", "WFS_GML3_BBOX")
-        if "text/xml" not in response.headers['Content-Type']:
-            response.failure("Expected content-type to be text/xml but found"+response.headers['Content-Type'])
-        response.success()
-
-    @task(1)
-    def wfs_json_bbox(self):
-        response = self._doWFS("application/json", "WFS_JSON_BBOX")
-        if "text/xml" not in response.headers['Content-Type']:
-            response.failure("Expected content-type to be application/json but found"+response.headers['Content-Type'])
-        response.success()
-
-    def _doWFS(self,fmt,name):
-        url = "/geoserver/wfs?service=wfs&version=1.1.0&request=GetFeature&typeName=ws0030:ft0001&ouputFormat="+fmt
-        line = self.bbox_iterator.next()
-        url += "&bbox="+line[2]+","+line[3]+","+line[4]+","+line[5]
-        return self.client.get(url, name= name,catch_response=True)
-
-
-
-class WebsiteUser(HttpLocust):
-    task_set = EcWfsTester
-    min_wait = 0
-    max_wait = 0
+"""Define a locust swarm for testing WFS on Geoserver EC.
+
+Each task is a GetFeature request for one corpus bbox in one output format,
+so that the server's cost of encoding GML2, GML3, GML 3.2 and GeoJSON can
+be compared. How often each format is requested is set by
+WFS_FORMAT_WEIGHTS, e.g. "GML2=1,GML3=1,JSON=2"; WFS_MAX_FEATURES and
+WFS_PAGES make each task page through its bbox's features, stopping early
+at a page with fewer than WFS_MAX_FEATURES features.
+
+The default corpus is data/roads-bbox-100k.bbox, converted from the old
+../bbox_data/roads-bbox-100k.csv with e.g.::
+
+    ./code/bbox_corpus.py ../bbox_data/roads-bbox-100k.csv \
+        data/roads-bbox-100k.bbox
+
+or set WFS_CORPUS=roads-bbox-100k.csv to read a CSV copy in data as it is.
+"""
+from wfs_behavior import WFSBehavior
+import corpus_shard
+import open_loop
+from transport import GeoServerUser
+from utils import load_corpus, check_content, weighted_tasks
+import validation
+from settings import env_str, env_int, env_weights
+
+# outputFormat to send, and the Content-Type prefix to expect back
+FORMATS = {
+    "GML2": ("GML2", "text/xml"),
+    "GML3": ("text/xml; subtype=gml/3.1.1", "text/xml"),
+    "GML32": ("application/gml+xml; version=3.2", "application/gml+xml"),
+    "JSON": ("application/json", "application/json"),
+}
+
+FORMAT_WEIGHTS = env_weights(
+    "WFS_FORMAT_WEIGHTS", {"GML2": 1, "GML3": 1, "GML32": 0, "JSON": 1},
+)
+TYPE_NAME = env_str("WFS_TYPE_NAME", "ws0030:ft0001")
+VERSION = env_str("WFS_VERSION", "1.1.0")
+CORPUS = env_str("WFS_CORPUS", "roads-bbox-100k.bbox")
+# Features per request, or 0 to let the server send them all
+MAX_FEATURES = env_int("WFS_MAX_FEATURES", 0)
+# Pages of MAX_FEATURES to fetch, one after another, per task
+PAGES = env_int("WFS_PAGES", 1)
+
+# Counted in each page to tell whether it was the last: GeoServer starts
+# every feature with an element named after its type, or a GeoJSON
+# "type": "Feature" member
+FEATURE_MARKERS = {
+    "GML2": ("<" + TYPE_NAME + " ").encode("utf-8"),
+    "GML3": ("<" + TYPE_NAME + " ").encode("utf-8"),
+    "GML32": ("<" + TYPE_NAME + " ").encode("utf-8"),
+    "JSON": b'"Feature"',
+}
+
+# None unless OPEN_LOOP_RATE asks for a constant arrival rate
+ARRIVALS = open_loop.from_settings()
+
+
+def bbox_string(row):
+    """Format a corpus row as a WFS 1.1.0 EPSG:4326 (lat/lon) bbox.
+
+    Rows are either width,height,bottom,left,top,right, as in the original
+    roads corpus, or west,south,east,north, as mercantile_gen writes.
+    """
+    if len(row) == 6:
+        return "{2},{3},{4},{5}".format(*row)
+    return "{1},{0},{3},{2}".format(*row)
+
+
+def format_task(key):
+    """Make a locust task requesting one of FORMATS.
+    """
+    def task(self):
+        self.wfs_get_feature(key)
+    task.__name__ = "wfs_{0}_bbox".format(key.lower())
+    return task
+
+
+class WFSTester(WFSBehavior):
+    """Exercise Geoserver EC WFS
+    """
+
+    # Load data at import time
+    corpus = load_corpus(CORPUS)
+    # This process's shard of the corpus, shared by its users
+    rows = corpus_shard.from_settings(len(corpus))
+
+    tasks = weighted_tasks(
+        FORMAT_WEIGHTS, {key: format_task(key) for key in FORMATS},
+    )
+
+    def wfs_get_feature(self, key):
+        """Exercise WFS GetFeature in one of FORMATS, a page at a time
+        """
+        if ARRIVALS is not None:
+            intended = ARRIVALS.acquire()
+        output_format, expected = FORMATS[key]
+        index, temperature = self.rows.next()
+        name = "WFS_{0}_BBOX{1}".format(key, corpus_shard.suffix(temperature))
+        bbox = bbox_string(self.corpus[index])
+        try:
+            for page in range(0, max(1, PAGES)):
+                with self.get_feature(
+                    "/geoserver/wfs",
+                    TYPE_NAME,
+                    output_format,
+                    bbox=bbox,
+                    version=VERSION,
+                    max_features=MAX_FEATURES,
+                    start_index=page * MAX_FEATURES,
+                    name=name,
+                ) as response:
+                    body = validation.consume(
+                        response, count=FEATURE_MARKERS[key],
+                    )
+                    check_content(response, expected)
+                if not MAX_FEATURES or body.matches < MAX_FEATURES:
+                    # Everything came in this page
+                    break
+        finally:
+            if ARRIVALS is not None:
+                ARRIVALS.complete(name, intended)
+
+
+class WebsiteUser(GeoServerUser):
+    tasks = [WFSTester]
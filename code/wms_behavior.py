@@ -1,9 +1,29 @@
 """Implement WMS requests without specific test logic.
 """
+import math
+import time
 from urllib.parse import urlencode
 from locust import TaskSet
-import datetime
-import time
+import mercantile
+import image_validation
+import latency_recorder
+from latency_recorder import RECORDER
+import request_log
+import validation
+from utils import check_content
+
+# GeoWebCache says whether it served a tile from its cache (HIT) or had
+# to render it (MISS) in this header
+CACHE_RESULT_HEADER = "geowebcache-cache-result"
+
+# None unless REQUEST_LOG_PATH is set
+REQUEST_LOG = request_log.from_settings(request_log.GET_MAP_FIELDS)
+
+# Collect latency histograms if LATENCY_HISTOGRAM_PATH is set
+latency_recorder.install_from_settings()
+
+# None unless IMAGE_VALIDATION_SAMPLE is set
+IMAGE_VALIDATOR = image_validation.from_settings()
 
 
 class WMSBehavior(TaskSet):
@@ -14,6 +34,8 @@ class WMSBehavior(TaskSet):
 
     def get_capabilities(self, uri, namespace=None, fmt=None):
         """Make a GetCapabilities request to get data about a WMS service.
+
+        The response is reported when the caller's with-block ends.
         """
         parameters = {
             # "version": "1.3.0",
@@ -29,62 +51,99 @@ class WMSBehavior(TaskSet):
             params=parameters,
             name="GetCapabilities",
             catch_response=True,
+            stream=True,
         )
 
-    def describe_layer(self, path, service, version, request):
-        """Get the WFS or WCS to retrieve additional info about a WMS layer.
+    def describe_layer(self, uri, layers, version="1.1.1",
+                       name="DescribeLayer"):
+        """Get the WFS or WCS to retrieve additional info about WMS layers.
+
+        The response is reported when the caller's with-block ends.
+
+        :arg layers:
+            e.g. "osm:osm"
         """
-        # TODO
-        version = "1.1.1"
-        service = "WMS"
-        request = "DescribeLayer"
-        exception_format = self.exception_format
-        output_format = self.output_format
         parameters = {
-            "service": service,
+            "service": "WMS",
             "version": version,
-            "request": request,
-            "layers": "whee",
-            "exceptions": exception_format,
-            "output_format": output_format,
+            "request": "DescribeLayer",
+            "layers": layers,
         }
-        return self.client.get(path, params=parameters)
+        return self.client.get(
+            uri,
+            params=parameters,
+            name=name,
+            catch_response=True,
+            stream=True,
+        )
 
-    def get_legend(self, uri):
+    def get_legend(self, uri, layer, image_format="image/png", width=20,
+                   height=20, name="GetLegendGraphic"):
         """Get a generated legend for a WMS map.
+
+        The response is reported when the caller's with-block ends.
+
+        :arg layer:
+            e.g. "osm:osm"
+        :arg width:
+            Size of each legend symbol, not of the whole legend
         """
-        # TODO
-        request = "GetLegendGraphic"
-        version = "1.0.0"
-        fmt = "image/png"
-        width = 20
-        height = 20
-        layer = "topp:states"
         parameters = {
-            "VERSION": version,
-            "REQUEST": request,
-            "LAYER": layer,
-            "FORMAT": fmt,
-            "EXCEPTIONS": self.exception_format,
+            "service": "WMS",
+            "version": "1.1.1",
+            "request": "GetLegendGraphic",
+            "layer": layer,
+            "format": image_format,
+            "width": width,
+            "height": height,
         }
-        if width:
-            parameters["WIDTH"] = width
-        if height:
-            parameters["HEIGHT"] = height
-        return self.client.get(uri, params=parameters)
-
-    def get_feature_info(self, uri):
-        """Get data for a pixel location on a WMS map
+        return self.client.get(
+            uri,
+            params=parameters,
+            name=name,
+            catch_response=True,
+            stream=True,
+        )
+
+    def get_feature_info(self, uri, layers, bbox, crs, width, height, i, j,
+                         info_format="application/json", feature_count=1,
+                         name="GetFeatureInfo"):
+        """Get data for a pixel location on a WMS map.
+
+        The map is described just like for get_map(), and i, j are the
+        pixel to query, e.g. from pixel_for_point(). The response is
+        reported when the caller's with-block ends.
+
+        :arg info_format:
+            e.g. "application/json", "text/html" or "application/vnd.ogc.gml"
         """
-        # TODO
         parameters = {
-            "service": "wms",
+            "service": "WMS",
+            "version": "1.3.0",
             "request": "GetFeatureInfo",
+            "layers": layers,
+            "query_layers": layers,
+            "styles": "",
+            "crs": crs,
+            "width": width,
+            "height": height,
+            "i": i,
+            "j": j,
+            "info_format": info_format,
+            "feature_count": feature_count,
         }
-        return self.client.get(uri, params=parameters)
+        # Build URL ourselves since requests insists on encoding commas
+        # in querystrings, grumble grumble
+        url = "{}?{}&bbox={}".format(uri, urlencode(parameters), bbox)
+        return self.client.get(
+            url,
+            name=name,
+            catch_response=True,
+            stream=True,
+        )
 
     def get_map(self, uri, layers, image_format, width, height, bbox, crs,
-                name=None):
+                name=None, expected="image/png", styles=None):
         """Make a WMS GetMap request.
 
         :arg uri:
@@ -103,38 +162,188 @@ class WMSBehavior(TaskSet):
             e.g. "EPSG:4326"
         :arg name:
             e.g. "WMS_png_BBOX"
+        :arg expected:
+            Content-Type prefix the response must have, e.g. "image/jpeg"
+        :arg styles:
+            e.g. "polygon"; None leaves the parameter out
         """
-        parameters = {
-            # Things we don't have any reason to vary
-            "service": "wms",
-            "version": "1.3.0",
-            "request": "GetMap",
+        url = get_map_url(
+            uri, layers, image_format, width, height, bbox, crs, styles,
+        )
+        return self.get_map_path(
+            url, name=name, size=(width, height), expected=expected,
+        )
 
-            # Variables
-            "layers": layers,
-            "format": image_format,
-            "width": "{}".format(width),
-            "height": "{}".format(height),
-            "crs": crs,
-            # "bbox": bbox,
-        }
-        # Build URL ourselves since requests insists on encoding commas
-        # in querystrings, grumble grumble
-        url = "{}?{}&bbox={}".format(uri, urlencode(parameters), bbox)
-        map=self.client.get(
+    def get_map_path(self, url, name=None, size=None, expected="image/png"):
+        """Make a WMS GetMap request using a complete, prebuilt URL.
+
+        :arg url:
+            e.g. from get_map_url() or a url_cache.GetMapURLCache
+        :arg name:
+            e.g. "WMS_png_BBOX"
+        :arg size:
+            (width, height) requested, for checking images
+        :arg expected:
+            Content-Type prefix the response must have; the request is
+            checked and reported before this returns
+
+        Responses from GeoWebCache are named with its cache result, e.g.
+        "WMTS_png [HIT]", and counted as e.g. tile.hit in the latency
+        recorder.
+        """
+        start = time.time()
+        with self.client.get(
             url,
             name=name,
             # mark everything failed unless it's explicitly marked successful,
             # since 200 doesn't mean anything in this postmodern era
             catch_response=True,
-        )
+            # validation.consume() reads the body without keeping it
+            stream=True,
+        ) as map:
+            classify = IMAGE_VALIDATOR is not None and IMAGE_VALIDATOR.wanted()
+            body = validation.consume(map, keep_body=classify)
+            cache_result = map.headers.get(CACHE_RESULT_HEADER)
+            if cache_result:
+                name = "{0} [{1}]".format(name, cache_result.upper())
+                map.request_meta["name"] = name
+                RECORDER.count("tile." + cache_result.lower())
+            if classify:
+                IMAGE_VALIDATOR.submit(
+                    name, body.body, (time.time() - start) * 1000, size,
+                )
+            check_content(map, expected)
 
-        content_type="None"
-        if map.headers is not None:
-            content_type=map.headers.get("content-type")
-        if content_type != "image/png;charset=UTF-8":
-            map.failure("Got wrong content-type")
-            map.status_code=469
-        st = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
-        print(st+"\t"+url+"\t"+content_type+"\t"+str(map.status_code))
+        if REQUEST_LOG is not None:
+            REQUEST_LOG.push(
+                name, url, map.headers.get("content-type"), map.status_code,
+                body.length, body.digest,
+            )
         return map
+
+    def get_tile(self, uri, layer, tile, image_format="image/png",
+                 gridset="EPSG:900913", name=None, expected="image/png"):
+        """Make a WMTS GetTile request, e.g. to GeoWebCache.
+
+        :arg uri:
+            e.g. "/geoserver/gwc/service/wmts"
+        :arg tile:
+            mercantile.Tile giving z/x/y in the gridset, which must be
+            aligned with the XYZ grid like GeoWebCache's EPSG:900913
+        """
+        parameters = {
+            "service": "WMTS",
+            "version": "1.0.0",
+            "request": "GetTile",
+            "layer": layer,
+            "style": "",
+            "tilematrixset": gridset,
+            "tilematrix": "{0}:{1}".format(gridset, tile.z),
+            "tilerow": tile.y,
+            "tilecol": tile.x,
+            "format": image_format,
+        }
+        return self.get_map_path(
+            "{}?{}".format(uri, urlencode(parameters)),
+            name=name, size=(256, 256), expected=expected,
+        )
+
+    def get_map_tiled(self, uri, layers, tile, image_format="image/png",
+                      srs="EPSG:900913", name=None, expected="image/png"):
+        """Make a WMS-C (tiled=true) GetMap request for one XYZ tile.
+
+        GeoServer hands these to GeoWebCache when the bbox is exactly a
+        tile of a cached gridset, so this uses the tile's web mercator
+        bounds, in the WMS 1.1.1 axis order GeoWebCache expects.
+
+        :arg tile:
+            mercantile.Tile
+        """
+        parameters = {
+            "service": "WMS",
+            "version": "1.1.1",
+            "request": "GetMap",
+            "layers": layers,
+            "styles": "",
+            "format": image_format,
+            "width": 256,
+            "height": 256,
+            "srs": srs,
+            "tiled": "true",
+        }
+        bbox = "{0!r},{1!r},{2!r},{3!r}".format(*mercantile.xy_bounds(tile))
+        return self.get_map_path(
+            "{}?{}&bbox={}".format(uri, urlencode(parameters), bbox),
+            name=name, size=(256, 256), expected=expected,
+        )
+
+
+def get_map_url(uri, layers, image_format, width, height, bbox, crs,
+                styles=None):
+    """Build the URL for a WMS GetMap request.
+
+    Takes the same arguments as WMSBehavior.get_map.
+    """
+    parameters = {
+        # Things we don't have any reason to vary
+        "service": "wms",
+        "version": "1.3.0",
+        "request": "GetMap",
+
+        # Variables
+        "layers": layers,
+        "format": image_format,
+        "width": "{}".format(width),
+        "height": "{}".format(height),
+        "crs": crs,
+        # "bbox": bbox,
+    }
+    if styles is not None:
+        parameters["styles"] = styles
+    # Build URL ourselves since requests insists on encoding commas
+    # in querystrings, grumble grumble
+    return "{}?{}&bbox={}".format(uri, urlencode(parameters), bbox)
+
+
+def expected_content_type(image_format):
+    """Get the Content-Type prefix a response in an image format must have.
+
+    GeoServer answers every PNG variant, e.g. "image/png8" or
+    "image/png; mode=8bit", as plain image/png.
+    """
+    if image_format.startswith("image/png"):
+        return "image/png"
+    return image_format
+
+
+def pixel_for_point(west, south, east, north, x, y, width, height):
+    """Find the pixel of a map image which covers a point.
+
+    :arg west:
+        Bounds of the map, in the same units as x and y
+    :arg x:
+        e.g. longitude
+    :arg y:
+        e.g. latitude
+    :returns:
+        (i, j) pixel column and row, counted from the top left as
+        GetFeatureInfo wants
+    """
+    i = int((x - west) / (east - west) * width)
+    j = int((north - y) / (north - south) * height)
+    return min(max(i, 0), width - 1), min(max(j, 0), height - 1)
+
+
+def row_tile(row):
+    """Get the XYZ tile for a corpus row.
+
+    Rows are west,south,east,north, optionally followed by x,y,z as
+    mercantile_gen --tile-index writes them.
+    """
+    if len(row) >= 7:
+        return mercantile.Tile(int(row[4]), int(row[5]), int(row[6]))
+    west, south, east, north = (float(value) for value in row[:4])
+    zoom = round(math.log2(360.0 / (east - west)))
+    return mercantile.tile(
+        (west + east) / 2, (south + north) / 2, zoom,
+    )
@@ -1,9 +1,61 @@
 """Define a locust swarm for testing WMS on Geoserver EC.
 """
 
-from locust import HttpLocust, task
-from wms_behavior import WMSBehavior
-from utils import load_bbox_data, check_content
+import random
+import gevent
+import mercantile
+from locust import task
+from locust.exception import StopUser
+from wms_behavior import (
+    WMSBehavior, pixel_for_point, expected_content_type,
+)
+from url_cache import GetMapURLCache
+import capabilities
+import corpus_shard
+import open_loop
+from transport import GeoServerUser
+from utils import load_corpus, check_content, weighted_tasks
+from settings import env_str, env_int, env_bool, env_weights, env_choice
+
+LAYERS = "osm:osm"
+
+# Formats exercised by the tasks below, for building URLs up front
+IMAGE_FORMATS = ["image/png", "image/png8", "image/jpeg", "image/tiff"]
+
+# Rows are west,south,east,north; WMS 1.3.0 EPSG:4326 wants lat/lon
+BBOX_FORMAT = "{1},{0},{3},{2}"
+
+# "off" builds every URL in the task, "lazy" caches them in a bounded LRU,
+# "eager" renders every row for every format at startup
+URL_CACHE = env_choice("WMS_URL_CACHE", ["off", "lazy", "eager"], "off")
+URL_CACHE_SIZE = env_int("WMS_URL_CACHE_SIZE", 100000)
+
+# How often each operation is exercised, e.g. "GetMap=8,GetFeatureInfo=2"
+OPERATION_WEIGHTS = env_weights("WMS_OPERATION_WEIGHTS", {
+    "GetMap": 1,
+    "GetCapabilities": 0,
+    "GetFeatureInfo": 0,
+    "DescribeLayer": 0,
+    "GetLegendGraphic": 0,
+})
+# What GetFeatureInfo asks for, and the Content-Type it expects back
+INFO_FORMAT = env_str("WMS_INFO_FORMAT", "application/json")
+
+# Test whatever layers the server's capabilities list, instead of LAYERS
+DISCOVER = env_bool("WMS_DISCOVER")
+# Of the GetMap formats the server offers, those to use
+DISCOVER_FORMATS = env_str(
+    "WMS_DISCOVER_FORMATS", "image/png,image/jpeg",
+).split(",")
+# Zoom levels of the tiles requested within each layer's bounds
+DISCOVER_MIN_ZOOM = env_int("WMS_DISCOVER_MIN_ZOOM", 10)
+DISCOVER_MAX_ZOOM = env_int("WMS_DISCOVER_MAX_ZOOM", 16)
+
+# Web mercator can't represent the poles
+MAX_LAT = 85.051129
+
+# None unless OPEN_LOOP_RATE asks for a constant arrival rate
+ARRIVALS = open_loop.from_settings()
 
 
 class WMSTester(WMSBehavior):
@@ -11,65 +63,232 @@ class WMSTester(WMSBehavior):
     """
 
     # Load data at import time
-    # wms_256_tiles.csv can be generated by mercantile_gen
-    bbox_iterator = load_bbox_data("wms_256_tiles.csv")
+    # wms_256_tiles.bbox can be generated by mercantile_gen
+    corpus = load_corpus("wms_256_tiles.bbox")
+    # This process's shard of the corpus, shared by its users
+    rows = corpus_shard.from_settings(len(corpus))
+
+    # Shared by all users in the process, since the URLs are all the same
+    url_cache = None
+    if URL_CACHE != "off":
+        url_cache = GetMapURLCache(
+            corpus, "/geoserver/wms", LAYERS, 256, 256, "EPSG:4326",
+            bbox_format=BBOX_FORMAT, maxsize=URL_CACHE_SIZE,
+        )
+        if URL_CACHE == "eager":
+            url_cache.prepare(IMAGE_FORMATS)
 
     def on_start(self):
         """Startup method called by locust once for each new simulated user.
         """
 
-    @task(0)
     def wms_get_capabilities(self):
         """Exercise WMS GetCapabilities
         """
-        response = self.get_capabilities("/geoserver/ows")
-        check_content(response, "text/xml")
+        with self.get_capabilities("/geoserver/ows") as response:
+            check_content(response, "text/xml")
+
+    def wms_describe_layer(self):
+        """Exercise WMS DescribeLayer
+        """
+        with self.describe_layer("/geoserver/wms", LAYERS) as response:
+            check_content(response, "application/vnd.ogc.wms_xml")
+
+    def wms_get_legend(self):
+        """Exercise WMS GetLegendGraphic
+        """
+        with self.get_legend("/geoserver/wms", LAYERS) as response:
+            check_content(response, "image/png")
+
+    def wms_get_feature_info(self):
+        """Exercise WMS GetFeatureInfo at a random point of a corpus tile
+        """
+        if ARRIVALS is not None:
+            intended = ARRIVALS.acquire()
+        index, temperature = self.rows.next()
+        name = "GetFeatureInfo" + corpus_shard.suffix(temperature)
+        row = self.corpus[index]
+        west, south, east, north = (float(value) for value in row[:4])
+        i, j = pixel_for_point(
+            west, south, east, north,
+            random.uniform(west, east), random.uniform(south, north),
+            256, 256,
+        )
+        try:
+            with self.get_feature_info(
+                "/geoserver/wms", LAYERS, BBOX_FORMAT.format(*row),
+                "EPSG:4326", 256, 256, i, j, info_format=INFO_FORMAT,
+                name=name,
+            ) as response:
+                check_content(response, INFO_FORMAT)
+        finally:
+            if ARRIVALS is not None:
+                ARRIVALS.complete(name, intended)
 
-    @task(1)
     def wms_png_bbox(self):
-        response = self.wms_get_map("image/png")
-        check_content(response, "image/png")
+        self.wms_get_map("image/png", "image/png")
 
     # @task(1)
     def wms_png8_bbox(self):
-        response = self.wms_get_map("image/png8")
-        check_content(response, "image/png")
+        self.wms_get_map("image/png8", "image/png")
 
     # @task(1)
     def wms_jpeg_bbox(self):
-        response = self.wms_get_map("image/jpeg")
-        check_content(response, "image/jpeg")
+        self.wms_get_map("image/jpeg", "image/jpeg")
 
     # @task(0)
     def wms_tiff_bbox(self):
-        response = self.wms_get_map("image/tiff")
-        check_content(response, "image/tiff")
+        self.wms_get_map("image/tiff", "image/tiff")
 
-    def wms_get_map(self, image_format):
+    def wms_get_map(self, image_format, expected):
         """Exercise WMS GetMap with the specified format
+
+        :arg expected:
+            Content-Type prefix the response must have
+        """
+        if ARRIVALS is not None:
+            intended = ARRIVALS.acquire()
+        index, temperature = self.rows.next()
+        name = "WMS_{0}_BBOX{1}".format(
+            image_format.split("/")[-1], corpus_shard.suffix(temperature),
+        )
+        try:
+            if self.url_cache is not None:
+                url = self.url_cache.get(index, image_format)
+                return self.get_map_path(
+                    url, name=name, size=(256, 256), expected=expected,
+                )
+            bbox_string = BBOX_FORMAT.format(*self.corpus[index])
+            return self.get_map(
+                uri="/geoserver/wms",
+                layers=LAYERS,
+                image_format=image_format,
+                width=256,
+                height=256,
+                bbox=bbox_string,
+                crs="EPSG:4326",
+                name=name,
+                expected=expected,
+            )
+        finally:
+            if ARRIVALS is not None:
+                ARRIVALS.complete(name, intended)
+
+    tasks = weighted_tasks(OPERATION_WEIGHTS, {
+        "GetMap": wms_png_bbox,
+        "GetCapabilities": wms_get_capabilities,
+        "GetFeatureInfo": wms_get_feature_info,
+        "DescribeLayer": wms_describe_layer,
+        "GetLegendGraphic": wms_get_legend,
+    })
+
+
+def layer_task(layer, formats):
+    """Make a task requesting maps of one discovered layer.
+    """
+    def get_layer_map(self):
+        self.wms_get_layer_map(layer, random.choice(formats))
+    return get_layer_map
+
+
+class DiscoveredWMSTester(WMSBehavior):
+    """Exercise GetMap on every layer in the server's capabilities
+    """
+
+    # Shared by all users in the process, so capabilities are fetched once
+    discovery = capabilities.Discovery()
+    # Built from the first user's discovery, with each task repeated as
+    # many times as its weight, like locust's own task lists
+    discovered_tasks = None
+
+    def on_start(self):
+        if self.discovered_tasks is None:
+            tasks = self.discover(self.user.host)
+            if tasks is None:
+                # Testing anything else would measure the wrong thing
+                self.quit_once()
+                raise StopUser("WMS discovery failed")
+            type(self).discovered_tasks = tasks
+
+    def quit_once(self):
+        """Stop locust with a failing exit code, whichever user asks first.
         """
-        line = next(self.bbox_iterator)
-        bbox = [line[1], line[0], line[3], line[2]]
-        bbox_string = ",".join(bbox)
-        name = "WMS_{0}_BBOX".format(image_format.split("/")[-1])
-        return self.get_map(
-            uri="/geoserver/wms",
-            layers="osm:osm",
-            image_format=image_format,
-            width=256,
-            height=256,
-            bbox=bbox_string,
-            crs="EPSG:4326",
-            name=name,
+        environment = self.user.environment
+        if environment.process_exit_code is None:
+            environment.process_exit_code = 1
+            # Quitting stops every user, so not from within this one
+            gevent.spawn(environment.runner.quit)
+
+    @task(1)
+    def wms_discovered_map(self):
+        random.choice(self.discovered_tasks)(self)
+
+    def discover(self, host):
+        """Build weighted tasks for the layers and formats a host offers.
+
+        Each layer has weight 1, unless WMS_LAYER_WEIGHTS (e.g.
+        "osm:osm=4,topp:states=1") says otherwise.
+
+        :returns:
+            list of tasks, or None if the capabilities couldn't be fetched
+        """
+        found = self.discovery.get(host)
+        if found is None:
+            return None
+        formats = [
+            fmt for fmt in DISCOVER_FORMATS if fmt in found.formats
+        ]
+        if not formats:
+            raise ValueError("{0} offers none of WMS_DISCOVER_FORMATS, "
+                             "only {1}".format(host, found.formats))
+        layers = [layer for layer in found.layers if layer.bounds]
+        weights = env_weights(
+            "WMS_LAYER_WEIGHTS", dict.fromkeys(
+                (layer.name for layer in layers), 1,
+            ),
         )
+        tasks = weighted_tasks(weights, {
+            layer.name: layer_task(layer, formats) for layer in layers
+        })
+        if not tasks:
+            raise ValueError("no layers with bounds to test on " + host)
+        return [
+            layer_map for layer_map, weight in tasks.items()
+            for _ in range(weight)
+        ]
 
+    def wms_get_layer_map(self, layer, image_format):
+        """Exercise WMS GetMap on a random tile within a layer's bounds
+        """
+        if ARRIVALS is not None:
+            intended = ARRIVALS.acquire()
+        west, south, east, north = layer.bounds
+        tile = mercantile.tile(
+            random.uniform(west, east),
+            random.uniform(max(south, -MAX_LAT), min(north, MAX_LAT)),
+            random.randint(DISCOVER_MIN_ZOOM, DISCOVER_MAX_ZOOM),
+        )
+        name = "WMS_{0}_{1}".format(image_format.split("/")[-1], layer.name)
+        try:
+            return self.get_map(
+                uri="/geoserver/wms",
+                layers=layer.name,
+                image_format=image_format,
+                width=256,
+                height=256,
+                bbox=BBOX_FORMAT.format(*mercantile.bounds(tile)),
+                crs="EPSG:4326",
+                name=name,
+                expected=expected_content_type(image_format),
+                styles=random.choice(layer.styles) if layer.styles else "",
+            )
+        finally:
+            if ARRIVALS is not None:
+                ARRIVALS.complete(name, intended)
 
-class WMSUser(HttpLocust):
+
+class WMSUser(GeoServerUser):
     """Specify how each simulated user will behave.
     """
     # Define the behavior of the user.
-    task_set = WMSTester
-
-    # Parameters for generating the random wait between tasks.
-    min_wait = 0
-    max_wait = 0
+    tasks = [DiscoveredWMSTester if DISCOVER else WMSTester]
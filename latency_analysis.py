@@ -0,0 +1,347 @@
+"""Vectorized analysis of post_latency results.
+
+Every request attempt is loaded into a NumPy record array with the latency
+store's REQUEST_DTYPE layout, whether it comes from a store on disk or from
+TestResults in memory. From that, one (tests x nodes x resources x 3) array
+holds the end, start and connected times of each node's last GET, and one
+(tests x resources x 3) array those of the last POST, so all nine latency
+kinds for every test come out of a single broadcast subtraction.
+
+post_latency reports the tests it has just run this way, and
+latency_report.py --vectorized prints a store's report this way too;
+results match its streaming, constant-memory report, but memory grows with
+the store.
+"""
+import warnings
+from pathlib import Path
+from textwrap import indent
+
+import numpy
+
+import latency_store
+from latency_store import (
+    MISSING_TIME, REQUEST_DTYPE, TEST_DTYPE, RESOURCES, encode_time,
+)
+from latency_results import (
+    LATENCY_NAMES, VISIBILITY_NAMES, NS_PER_SECOND,
+)
+
+# Order of the last axis of the timestamp arrays; LATENCY_NAMES is every
+# (GET time, POST time) pair of these, in this order.
+TIMESTAMPS = ("end", "start", "connected")
+_SHORT = {"end": "end", "start": "start", "connected": "conn"}
+if LATENCY_NAMES != [
+    f"{_SHORT[get]}-{_SHORT[post]}"
+    for get in TIMESTAMPS for post in TIMESTAMPS
+]:
+    raise RuntimeError(
+        "latency_results.LATENCY_NAMES is out of step with TIMESTAMPS"
+    )
+
+NAMES = LATENCY_NAMES + VISIBILITY_NAMES
+
+PERCENTS = (50, 90, 95, 99)
+
+GET = latency_store.METHODS.index("GET")
+POST = latency_store.METHODS.index("POST")
+
+
+class LatencyAnalysis:
+    """Latencies for every (test, node, resource), computed all at once.
+
+    :ivar tests:
+        TEST_DTYPE record array, one per test
+    :ivar nodes:
+        Node names, in the order of the node axis
+    :ivar latencies:
+        Float seconds, shape (tests, nodes, resources, len(NAMES)); NaN
+        where the last GET or POST didn't succeed
+    :ivar get_success:
+        Whether each (test, node, resource)'s last GET succeeded
+    :ivar get_found:
+        Whether each (test, node, resource) had any GETs at all
+    """
+
+    def __init__(self, tests, requests, nodes):
+        """
+        :arg tests:
+            TEST_DTYPE record array
+        :arg requests:
+            REQUEST_DTYPE record array; attempts for tests not in `tests`
+            are ignored
+        :arg nodes:
+            Node names, indexed by the requests' node field
+        """
+        self.tests = tests
+        self.nodes = list(nodes)
+        shape = (len(tests), len(self.nodes), len(RESOURCES))
+
+        # Find each request's test by its combined (run, test) key
+        test_keys = _test_keys(tests)
+        request_keys = _test_keys(requests)
+        if len(tests):
+            order = numpy.argsort(test_keys)
+            found = numpy.searchsorted(test_keys, request_keys, sorter=order)
+            test_index = order[numpy.minimum(found, len(tests) - 1)]
+            known = test_keys[test_index] == request_keys
+        else:
+            test_index = numpy.zeros(len(requests), dtype=numpy.int64)
+            known = numpy.zeros(len(requests), dtype=bool)
+        requests = requests[known]
+        test_index = test_index[known]
+
+        times = numpy.stack(
+            [requests[name] for name in TIMESTAMPS], axis=-1,
+        )
+        present = times != MISSING_TIME
+        success = requests["success"] == 1
+
+        # Last POST per (test, resource)
+        posts = requests["method"] == POST
+        post_group = test_index[posts] * len(RESOURCES) \
+            + requests["resource"][posts]
+        post_times, post_present, post_success = _last_attempts(
+            post_group, requests["attempt"][posts], times[posts],
+            present[posts], success[posts], shape[0] * shape[2],
+        )
+        post_times = post_times.reshape(shape[0], shape[2], 3)
+        post_present = post_present.reshape(shape[0], shape[2], 3)
+        post_success = post_success.reshape(shape[0], shape[2])
+
+        # Last GET per (test, node, resource)
+        gets = requests["method"] == GET
+        get_group = (
+            test_index[gets] * shape[1] + requests["node"][gets]
+        ) * shape[2] + requests["resource"][gets]
+        get_times, get_present, get_success = _last_attempts(
+            get_group, requests["attempt"][gets], times[gets],
+            present[gets], success[gets], numpy.prod(shape),
+        )
+        get_times = get_times.reshape(shape + (3,))
+        get_present = get_present.reshape(shape + (3,))
+        self.get_success = get_success.reshape(shape)
+        self.get_found = numpy.zeros(numpy.prod(shape), dtype=bool)
+        self.get_found[get_group] = True
+        self.get_found = self.get_found.reshape(shape)
+
+        # All nine latency kinds: GET times against POST times, in exact
+        # integer nanoseconds until the final conversion
+        delta = get_times[..., :, None] \
+            - post_times[:, None, :, None, :]
+        valid = (
+            get_present[..., :, None]
+            & post_present[:, None, :, None, :]
+            & (self.get_success & post_success[:, None, :])[..., None, None]
+        )
+        latencies = numpy.full(shape + (len(NAMES),), numpy.nan)
+        latencies[..., :len(LATENCY_NAMES)] = numpy.where(
+            valid, delta / NS_PER_SECOND, numpy.nan,
+        ).reshape(shape + (len(LATENCY_NAMES),))
+
+        # Visibility brackets, as in latency_results.visibility_interval
+        post_start = post_times[..., TIMESTAMPS.index("start")]
+        post_ok = post_success & post_present[..., TIMESTAMPS.index("start")]
+        latencies[..., len(LATENCY_NAMES):] = _visibility(
+            get_group, requests[gets], success[gets],
+            post_start, post_ok, shape,
+        )
+        self.latencies = latencies
+
+    @classmethod
+    def from_store(cls, path, runs=None):
+        """Load everything (or only some runs) from a store directory.
+        """
+        path = Path(path)
+        latency_store.check_format(path)
+        tests = _read_array(path / "tests.bin", TEST_DTYPE)
+        if runs:
+            tests = tests[numpy.isin(tests["run"], runs)]
+        requests = _read_requests(path / "requests.bin", tests)
+        nodes = sorted(
+            latency_store.read_nodes(path).items(), key=lambda item: item[1],
+        )
+        return cls(tests, requests, [name for name, _ in nodes])
+
+    @classmethod
+    def from_results(cls, results):
+        """Analyze post_latency TestResults held in memory.
+
+        Tests are numbered by their position in `results`.
+        """
+        nodes = {}
+
+        def node_index(name):
+            return nodes.setdefault(name, len(nodes))
+
+        tests = numpy.zeros(len(results), dtype=TEST_DTYPE)
+        records = bytearray()
+        tests["test"] = numpy.arange(len(results))
+        tests["start"] = [encode_time(result.start) for result in results]
+        tests["end"] = [encode_time(result.end) for result in results]
+        for index, result in enumerate(results):
+            records += latency_store.pack_requests(
+                0, index, result, node_index,
+            )
+        requests = numpy.frombuffer(bytes(records), dtype=REQUEST_DTYPE)
+        return cls(tests, requests, nodes)
+
+    def node_stats(self, percents=PERCENTS):
+        """Summarize latencies across tests for every node and resource.
+
+        :returns:
+            dict of "count", "min", "mean", "max" and e.g. "p50" arrays,
+            each of shape (nodes, resources, len(NAMES))
+        """
+        values = self.latencies
+        if not len(values):
+            # Reductions need at least one test; NaN counts as no data
+            values = numpy.full((1,) + values.shape[1:], numpy.nan)
+        with warnings.catch_warnings():
+            # All-NaN slices, e.g. a node which never saw a resource
+            warnings.simplefilter("ignore", RuntimeWarning)
+            stats = {
+                "count": numpy.sum(~numpy.isnan(values), axis=0),
+                "min": numpy.nanmin(values, axis=0),
+                "mean": numpy.nanmean(values, axis=0),
+                "max": numpy.nanmax(values, axis=0),
+            }
+            quantiles = numpy.nanpercentile(values, percents, axis=0)
+        for percent, quantile in zip(percents, quantiles):
+            stats[f"p{percent:g}"] = quantile
+        return stats
+
+    def test_latencies(self, test, node, resource):
+        """Get {name: seconds} for one test, node and resource.
+
+        Latencies which couldn't be measured are left out, as with
+        latency_results.latency_dict.
+        """
+        values = self.latencies[test, self.nodes.index(node), resource]
+        return {
+            name: float(value)
+            for name, value in zip(NAMES, values)
+            if not numpy.isnan(value)
+        }
+
+    def report(self, percents=PERCENTS):
+        """Get the per-node combined latency report as text.
+        """
+        tab = " " * 4
+        stats = self.node_stats(percents)
+        rows = ["count", "min", "mean"] \
+            + [f"p{percent:g}" for percent in percents] + ["max"]
+        lines = []
+        for node, name in sorted(enumerate(self.nodes), key=lambda x: x[1]):
+            if not self.get_found[:, node].any():
+                continue
+            lines += ["=" * len(name), name, "=" * len(name)]
+            for resource, label in enumerate(RESOURCES):
+                successes = int(numpy.sum(
+                    self.get_success[:, node, resource]
+                ))
+                attempted = int(numpy.sum(self.get_found[:, node, resource]))
+                lines.append(indent(label, tab))
+                lines.append(indent("-" * len(label), tab))
+                lines.append(indent(
+                    f"GET: {successes} successful, "
+                    f"{attempted - successes} failed", tab * 2,
+                ))
+                for kind, latency_name in enumerate(NAMES):
+                    if not stats["count"][node, resource, kind]:
+                        continue
+                    lines.append(indent(latency_name, tab * 2))
+                    for row in rows:
+                        value = stats[row][node, resource, kind]
+                        text = f"{value}" if row == "count" \
+                            else f"{value:.6f}"
+                        lines.append(indent(f"{row:<6}: {text}", tab * 3))
+        return "\n".join(lines)
+
+
+def _read_requests(path, tests):
+    """Read the requests of some tests, going by their offsets.
+
+    Requests orphaned or torn by a crash are never read, so they can't
+    throw the records after them out of line.
+    """
+    if not path.exists():
+        return numpy.zeros(0, dtype=REQUEST_DTYPE)
+    data = path.read_bytes()
+    size = numpy.dtype(REQUEST_DTYPE).itemsize
+    chunks = [
+        data[offset:offset + count * size]
+        for offset, count in zip(
+            tests["offset"].tolist(), tests["requests"].tolist(),
+        )
+    ]
+    data = b"".join(chunk[:len(chunk) - len(chunk) % size] for chunk in chunks)
+    return numpy.frombuffer(data, dtype=REQUEST_DTYPE)
+
+
+def _read_array(path, dtype):
+    if not path.exists():
+        return numpy.zeros(0, dtype=dtype)
+    # Ignore a partial record from a crash mid-write
+    data = path.read_bytes()
+    size = numpy.dtype(dtype).itemsize
+    return numpy.frombuffer(data[:len(data) - len(data) % size], dtype=dtype)
+
+
+def _test_keys(records):
+    return (records["run"].astype(numpy.uint64) << numpy.uint64(32)) \
+        | records["test"].astype(numpy.uint64)
+
+
+def _last_attempts(group, attempt, times, present, success, groups):
+    """Scatter each group's highest-numbered attempt into dense arrays.
+
+    :returns:
+        (times, present, success) with one row per group; groups with no
+        attempts are not present and not successful
+    """
+    last = numpy.full(groups, -1, dtype=numpy.int64)
+    numpy.maximum.at(last, group, attempt)
+    is_last = attempt == last[group]
+    out_times = numpy.zeros((groups, 3), dtype=numpy.int64)
+    out_present = numpy.zeros((groups, 3), dtype=bool)
+    out_success = numpy.zeros(groups, dtype=bool)
+    out_times[group[is_last]] = times[is_last]
+    out_present[group[is_last]] = present[is_last]
+    out_success[group[is_last]] = success[is_last]
+    return out_times, out_present, out_success
+
+
+def _visibility(group, gets, success, post_start, post_ok, shape):
+    """Get (visible-after, visible-by) seconds for every GET group.
+
+    The resource wasn't visible when the last failed poll before the first
+    successful one was sent, and was visible when that successful poll
+    finished.
+    """
+    groups = numpy.prod(shape)
+    attempt = gets["attempt"].astype(numpy.int64)
+    no_success = numpy.iinfo(numpy.int64).max
+    first = numpy.full(groups, no_success, dtype=numpy.int64)
+    numpy.minimum.at(first, group[success], attempt[success])
+
+    upper = numpy.full(groups, MISSING_TIME, dtype=numpy.int64)
+    hit = attempt == first[group]
+    upper[group[hit]] = gets["end"][hit]
+    lower = numpy.full(groups, MISSING_TIME, dtype=numpy.int64)
+    miss = attempt == first[group] - 1
+    lower[group[miss]] = gets["start"][miss]
+
+    post_start = numpy.broadcast_to(
+        post_start[:, None, :], shape,
+    ).reshape(groups)
+    post_ok = numpy.broadcast_to(post_ok[:, None, :], shape).reshape(groups)
+    ok = post_ok & (first != no_success) & (upper != MISSING_TIME)
+
+    intervals = numpy.full((groups, 2), numpy.nan)
+    after = numpy.where(
+        first == 0, 0, numpy.maximum(0, lower - post_start),
+    )
+    ok_after = ok & ((first == 0) | (lower != MISSING_TIME))
+    intervals[ok_after, 0] = after[ok_after] / NS_PER_SECOND
+    intervals[ok, 1] = (upper[ok] - post_start[ok]) / NS_PER_SECOND
+    return intervals.reshape(shape + (2,))
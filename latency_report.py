@@ -0,0 +1,237 @@
+"""Summarize post_latency results saved in a latency store.
+
+Reads the store one test at a time and feeds every latency into streaming
+histograms, so memory use stays constant however long the soak run was.
+With --vectorized, the whole store is instead loaded into NumPy arrays and
+every node's latencies are computed at once (see latency_analysis.py),
+which is much faster for thousands of tests and gives exact percentiles.
+"""
+import argparse
+import sys
+from pathlib import Path
+from textwrap import indent
+
+# Reuse the locust tests' histogram rather than keeping a second copy
+sys.path.insert(0, str(Path(__file__).resolve().parent / "code"))
+from latency_histogram import LatencyHistogram  # noqa: E402
+
+import latency_store  # noqa: E402
+from latency_results import (  # noqa: E402
+    RequestResult, latency_dict, visibility_interval,
+    LATENCY_NAMES, VISIBILITY_NAMES,
+)
+
+PERCENTS = (50, 90, 95, 99)
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Summarize post_latency results from a latency store",
+    )
+    parser.add_argument(
+        dest="store",
+    )
+    parser.add_argument(
+        "--run",
+        dest="runs",
+        type=int,
+        action="append",
+        help="only include this run number (may be given more than once)",
+    )
+    parser.add_argument(
+        "--vectorized",
+        action="store_true",
+        help="load the whole store into NumPy arrays (needs numpy)",
+    )
+    return parser
+
+
+class SignedHistogram:
+    """Pair of histograms so that negative latencies can be summarized too.
+
+    e.g. start-end is negative whenever a poll started before the POST
+    finished.
+    """
+    def __init__(self):
+        self.positive = LatencyHistogram()
+        self.negative = LatencyHistogram()
+
+    @property
+    def count(self):
+        return self.positive.count + self.negative.count
+
+    def record(self, nanoseconds):
+        """Record one latency in (possibly negative) nanoseconds.
+        """
+        if nanoseconds < 0:
+            self.negative.record(-nanoseconds // 1000)
+        else:
+            self.positive.record(nanoseconds // 1000)
+
+    def value_at_rank(self, rank):
+        negatives = self.negative.count
+        if rank <= negatives:
+            # The smallest values are the negatives with biggest magnitudes
+            return -self.negative.value_at_rank(negatives - rank + 1)
+        return self.positive.value_at_rank(rank - negatives)
+
+    def summary(self, percents):
+        """Get count, min, mean, max and percentiles, in seconds.
+        """
+        count = self.count
+        total = self.positive.total - self.negative.total
+        summary = {
+            "count": count,
+            "min": self.value_at_rank(1) / 1e6,
+            "mean": total / count / 1e6,
+            "max": self.value_at_rank(count) / 1e6,
+        }
+        for percent in percents:
+            rank = max(1, -(-count * percent // 100))
+            summary[f"p{percent:g}"] = self.value_at_rank(rank) / 1e6
+        return summary
+
+
+class Summary:
+    """Streaming summaries keyed by arbitrary tuples.
+    """
+    def __init__(self):
+        self.histograms = {}
+
+    def add(self, key, nanoseconds):
+        if nanoseconds is None:
+            return
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = SignedHistogram()
+        histogram.record(nanoseconds)
+
+    def text(self, key):
+        histogram = self.histograms.get(key)
+        if histogram is None or not histogram.count:
+            return "no data to report"
+        summary = histogram.summary(PERCENTS)
+        lines = [f"count : {summary['count']}"]
+        for name in ["min", "mean"] + [f"p{p:g}" for p in PERCENTS] + ["max"]:
+            lines.append(f"{name:<6}: {summary[name]:.6f}")
+        return "\n".join(lines)
+
+
+def request_result(record):
+    result = RequestResult()
+    result.success = record.success
+    result.status = record.status
+    result.length = record.length
+    result.start = record.start
+    result.connected = record.connected
+    result.end = record.end
+    return result
+
+
+def summarize(path, runs=None):
+    """Aggregate a store's tests into (tests, outcomes, durations, latencies).
+    """
+    durations = Summary()
+    latencies = Summary()
+    # (node, resource) -> [successes, failures]
+    outcomes = {}
+    tests = 0
+    for test, records in latency_store.read_tests(path):
+        if runs and test.run not in runs:
+            continue
+        tests += 1
+        if test.start is not None and test.end is not None:
+            durations.add(("test",), test.end - test.start)
+
+        # Group attempts by (resource, method, node); they're in order
+        grouped = {}
+        for record in records:
+            key = (record.resource, record.method, record.node)
+            grouped.setdefault(key, []).append(request_result(record))
+            durations.add(key, grouped[key][-1].duration_ns)
+
+        last_posts = {
+            resource: results[-1]
+            for (resource, method, _), results in grouped.items()
+            if method == 0
+        }
+        for (resource, method, node), results in grouped.items():
+            if method != 1:
+                continue
+            last_post = last_posts.get(resource)
+            last_get = results[-1]
+            counts = outcomes.setdefault((node, resource), [0, 0])
+            counts[0 if last_get.success else 1] += 1
+            if not (last_get.success and last_post and last_post.success):
+                continue
+            values = latency_dict(last_get, last_post)
+            interval = visibility_interval(results, last_post.start)
+            if interval is not None:
+                values.update(zip(VISIBILITY_NAMES, interval))
+            for name, value in values.items():
+                latencies.add((node, resource, name), value)
+    return tests, outcomes, durations, latencies
+
+
+def report_store(path, runs=None):
+    tab = " " * 4
+    tests, outcomes, durations, latencies = summarize(path, runs)
+    if not tests:
+        print("No results to display.")
+        return
+    node_names = {
+        index: name
+        for name, index in latency_store.read_nodes(path).items()
+    }
+
+    print(f"{tests} tests")
+    print(indent("Test Durations:", tab))
+    print(indent(durations.text(("test",)), tab * 2))
+
+    print("Combined Latencies")
+    nodes = sorted(set(node for node, _ in outcomes))
+    for node in nodes:
+        name = node_names.get(node, f"node {node}")
+        print("=" * len(name))
+        print(f"{name}")
+        print("=" * len(name))
+        for resource, label in enumerate(latency_store.RESOURCES):
+            successes, failures = outcomes.get((node, resource), (0, 0))
+            print(indent(f"{label}", tab * 1))
+            print(indent("-" * len(label), tab * 1))
+            print(indent(
+                f"GET: {successes} successful, {failures} failed", tab * 2
+            ))
+            print(indent("Durations:", tab * 2))
+            print(indent(durations.text((resource, 1, node)), tab * 3))
+            for latency_name in LATENCY_NAMES + VISIBILITY_NAMES:
+                key = (node, resource, latency_name)
+                if key not in latencies.histograms:
+                    continue
+                print(indent(f"{latency_name}", tab * 2))
+                print(indent(latencies.text(key), tab * 3))
+
+
+def report_store_vectorized(path, runs=None):
+    # Only this report needs numpy
+    from latency_analysis import LatencyAnalysis
+    analysis = LatencyAnalysis.from_store(path, runs)
+    if not len(analysis.tests):
+        print("No results to display.")
+        return
+    print(f"{len(analysis.tests)} tests")
+    print("Combined Latencies")
+    print(analysis.report())
+
+
+def main():
+    parser = argument_parser()
+    options = parser.parse_args()
+    if options.vectorized:
+        report_store_vectorized(options.store, options.runs)
+    else:
+        report_store(options.store, options.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Results of post_latency tests, and the latencies worked out from them.
+
+Kept apart from post_latency, which needs aiohttp to run tests, so that
+reports over saved results only need the standard library.
+"""
+
+# Timestamps are integer time.monotonic_ns() values, so that differences
+# between them are exact; convert to seconds only for display.
+NS_PER_SECOND = 1_000_000_000
+
+
+def seconds(nanoseconds):
+    """Convert a nanosecond count (or None) to float seconds.
+    """
+    if nanoseconds is None:
+        return None
+    return nanoseconds / NS_PER_SECOND
+
+
+class RequestResult:
+    """Store data on one request.
+
+    There are a lot of these (nodes x polls x tests), so they're slotted.
+    """
+    __slots__ = (
+        # Response Content-Type header
+        "content_type",
+        # Whether the response was a 2xx; None if it never finished
+        "success",
+        # HTTP status code
+        "status",
+        # Length of the response body in bytes
+        "length",
+        # time.monotonic_ns() when the request was sent, the response
+        # headers arrived and the body had been read
+        "start",
+        "connected",
+        "end",
+    )
+
+    def __init__(self):
+        self.content_type = None
+        self.success = None
+        self.status = None
+        self.length = None
+        self.start = None
+        self.connected = None
+        self.end = None
+
+    @property
+    def duration_ns(self):
+        if self.end is None or self.start is None:
+            return None
+        return self.end - self.start
+
+    @property
+    def duration(self):
+        """Seconds from sending the request to reading the whole body.
+        """
+        return seconds(self.duration_ns)
+
+
+class TestResult:
+    """Store data on one node test.
+    """
+    __slots__ = (
+        "post_node_name",
+        "get_node_names",
+        "label",
+        "workspace",
+        "datastore",
+        "layer",
+        "workspace_post_results",
+        "workspace_get_results",
+        "datastore_post_results",
+        "datastore_get_results",
+        "featuretype_post_results",
+        "featuretype_get_results",
+        "failures",
+        "success",
+        "start",
+        "end",
+    )
+
+    def __init__(self, post_node_name, get_node_names, label=None,
+                 workspace=None, datastore=None, layer=None):
+        """
+        :arg post_node_name:
+            One string specifying the hostname or hostname:port of the host to
+            issue POST requests to, setting up the test.
+        :arg get_node_names:
+            List of strings specifying hostname or hostname:port for each host
+            to issue polling GET requests to.
+        :arg label:
+            Test number, used to attribute results when tests run
+            concurrently.
+        :arg workspace:
+            Name of the workspace created by the test, and likewise for
+            datastore and layer.
+        """
+        self.post_node_name = post_node_name
+        self.get_node_names = get_node_names
+        self.label = label
+        self.workspace = workspace
+        self.datastore = datastore
+        self.layer = layer
+
+        # A list of RequestResult instances representing retries of the POST
+        self.workspace_post_results = None
+        # A dict mapping hostname strings to retries of the GET
+        self.workspace_get_results = None
+
+        self.datastore_post_results = None
+        self.datastore_get_results = None
+
+        self.featuretype_post_results = None
+        self.featuretype_get_results = None
+
+        # How many times did we fail?
+        self.failures = 0
+
+        # Was the test successful overall?
+        self.success = None
+
+        # time.monotonic_ns() timestamps for timing the whole test.
+        self.start = None
+        self.end = None
+
+
+def visibility_interval(get_results, post_start):
+    """Bracket when a resource became visible to a polling node.
+
+    The resource wasn't visible when the last failed poll before the first
+    successful one was sent, and was visible by the time the first
+    successful poll finished.
+
+    :returns:
+        (lower, upper) nanoseconds after post_start, or None if no poll
+        succeeded. lower is 0 if the very first poll succeeded.
+    """
+    last_miss = None
+    for result in get_results:
+        if result.success:
+            lower = 0 if last_miss is None else last_miss.start - post_start
+            return max(0, lower), result.end - post_start
+        last_miss = result
+    return None
+
+
+LATENCY_NAMES = [
+    "end-end",
+    "end-start",
+    "end-conn",
+    "start-end",
+    "start-start",
+    "start-conn",
+    "conn-end",
+    "conn-start",
+    "conn-conn",
+]
+
+# Bounds on when the resource became visible, relative to the POST start
+VISIBILITY_NAMES = [
+    "visible-after",
+    "visible-by",
+]
+
+
+def latency_dict(last_get, last_post):
+    """Get exact latencies between the last GET and POST, in nanoseconds.
+    """
+    latencies = {}
+    if last_get.end is not None:
+        if last_post.end is not None:
+            latencies["end-end"] = last_get.end - last_post.end
+        if last_post.start is not None:
+            latencies["end-start"] = last_get.end - last_post.start
+        if last_post.connected is not None:
+            latencies["end-conn"] = last_get.end - last_post.connected
+    if last_get.start is not None:
+        if last_post.end is not None:
+            latencies["start-end"] = last_get.start - last_post.end
+        if last_post.start is not None:
+            latencies["start-start"] = last_get.start - last_post.start
+        if last_post.connected is not None:
+            latencies["start-conn"] = last_get.start - last_post.connected
+    if last_get.connected is not None:
+        if last_post.end is not None:
+            latencies["conn-end"] = last_get.connected - last_post.end
+        if last_post.start is not None:
+            latencies["conn-start"] = last_get.connected - last_post.start
+        if last_post.connected is not None:
+            latencies["conn-conn"] = last_get.connected - last_post.connected
+    return latencies
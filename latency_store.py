@@ -0,0 +1,287 @@
+"""Append-only on-disk store for post_latency results.
+
+A store is a directory holding:
+
+format.txt
+    The store's FORMAT_VERSION.
+runs.jsonl
+    One JSON line per run of post_latency, e.g. the options it used.
+    A run's number is its line number, counting from 0.
+nodes.txt
+    One node name per line; records refer to nodes by line number.
+tests.bin
+    One fixed-width TEST_RECORD per finished test, giving where its
+    requests are in requests.bin.
+requests.bin
+    One fixed-width REQUEST_RECORD per request attempt, written together
+    for each test as soon as it finishes. Requests left without a test by
+    a crash, or torn by one, are never read, since readers go by the test
+    records' offsets.
+
+The records are plain little-endian structs, so they can be read in
+constant memory with struct.iter_unpack, or all at once as NumPy record
+arrays with numpy.fromfile(path, dtype=REQUEST_DTYPE). Times are integer
+time.monotonic_ns() values, with MISSING_TIME standing in for None.
+"""
+import json
+import os
+import struct
+from collections import namedtuple
+from pathlib import Path
+
+# Bump whenever the record layouts change
+FORMAT_VERSION = 1
+
+# Resource and method codes used in records
+RESOURCES = ["Workspace", "Datastore", "Featuretype"]
+METHODS = ["POST", "GET"]
+
+# Stored for requests whose success is unknown, e.g. never completed
+UNKNOWN = 255
+
+# Stored for times which were never taken, e.g. requests which failed early
+MISSING_TIME = -(1 << 63)
+
+# run, test, start, end, byte offset of the test's requests in
+# requests.bin, number of them
+TEST_RECORD = struct.Struct("<IIqqQIxxxx")
+TEST_DTYPE = [
+    ("run", "<u4"), ("test", "<u4"), ("start", "<i8"), ("end", "<i8"),
+    ("offset", "<u8"), ("requests", "<u4"), ("pad0", "V4"),
+]
+
+# run, test, node, attempt, status, resource, method, success, length,
+# start, connected, end
+REQUEST_RECORD = struct.Struct("<IIHHHBBBxIxxqqq")
+REQUEST_DTYPE = [
+    ("run", "<u4"), ("test", "<u4"), ("node", "<u2"), ("attempt", "<u2"),
+    ("status", "<u2"), ("resource", "u1"), ("method", "u1"),
+    ("success", "u1"), ("pad0", "V1"), ("length", "<u4"), ("pad1", "V2"),
+    ("start", "<i8"), ("connected", "<i8"), ("end", "<i8"),
+]
+
+TestRecord = namedtuple("TestRecord", "run test start end offset requests")
+RequestRecord = namedtuple(
+    "RequestRecord",
+    "run test node attempt status resource method success length "
+    "start connected end",
+)
+
+
+class LatencyStoreError(Exception):
+    """Raised for store directories which can't be used.
+    """
+
+
+def encode_time(value):
+    """Get the stored form of a time which may be None.
+    """
+    return MISSING_TIME if value is None else value
+
+
+def decode_time(value):
+    return None if value == MISSING_TIME else value
+
+
+def check_format(path, create=False):
+    """Make sure a store directory has this module's FORMAT_VERSION.
+
+    :arg create:
+        Mark an empty or new directory as this version
+    """
+    format_path = Path(path) / "format.txt"
+    if format_path.exists():
+        version = int(format_path.read_text().strip() or 0)
+    elif create:
+        format_path.write_text(f"{FORMAT_VERSION}\n")
+        return
+    else:
+        return
+    if version != FORMAT_VERSION:
+        raise LatencyStoreError(
+            f"{path}: store has format {version}, "
+            f"expected {FORMAT_VERSION}; use a new store directory"
+        )
+
+
+class LatencyStore:
+    """Write side of a store directory.
+    """
+
+    def __init__(self, path, run_info=None):
+        """Open (creating if need be) a store and start a new run in it.
+
+        :arg run_info:
+            JSON-friendly dict describing this run, e.g. the options
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        check_format(self.path, create=True)
+        self.nodes = read_nodes(self.path)
+        runs_path = self.path / "runs.jsonl"
+        with open(runs_path, "a+") as stream:
+            stream.seek(0)
+            self.run = sum(1 for line in stream if line.strip())
+            stream.write(json.dumps(run_info or {}) + "\n")
+        self._nodes = open(self.path / "nodes.txt", "a")
+        self._tests = open(self.path / "tests.bin", "ab")
+        self._requests = open(self.path / "requests.bin", "ab")
+
+    def node_index(self, name):
+        index = self.nodes.get(name)
+        if index is None:
+            index = self.nodes[name] = len(self.nodes)
+            self._nodes.write(name + "\n")
+            self._nodes.flush()
+        return index
+
+    def append_test(self, test_result):
+        """Append all of one post_latency TestResult's request attempts.
+        """
+        records = pack_requests(
+            self.run, test_result.label, test_result, self.node_index,
+        )
+        # Requests first, so a test record means its requests are complete
+        offset = self._requests.tell()
+        self._requests.write(records)
+        self._requests.flush()
+        self._tests.write(TEST_RECORD.pack(
+            self.run, test_result.label,
+            encode_time(test_result.start), encode_time(test_result.end),
+            offset, len(records) // REQUEST_RECORD.size,
+        ))
+        self._tests.flush()
+
+    def close(self):
+        for stream in (self._nodes, self._tests, self._requests):
+            stream.flush()
+            os.fsync(stream.fileno())
+            stream.close()
+
+
+def test_result_groups(test_result):
+    """Get (resource code, post results, get results) for a TestResult.
+    """
+    return [
+        (0, test_result.workspace_post_results,
+         test_result.workspace_get_results),
+        (1, test_result.datastore_post_results,
+         test_result.datastore_get_results),
+        (2, test_result.featuretype_post_results,
+         test_result.featuretype_get_results),
+    ]
+
+
+def pack_requests(run, test, test_result, node_index):
+    """Pack a TestResult's request attempts as REQUEST_RECORDs.
+
+    :arg node_index:
+        Function mapping node names to their indexes
+    :returns:
+        bytearray of records
+    """
+    records = bytearray()
+    for resource, post_results, get_results in test_result_groups(
+            test_result):
+        post_node = node_index(test_result.post_node_name)
+        for attempt, result in enumerate(post_results or []):
+            records += _pack_request(
+                run, test, post_node, attempt, resource, 0, result,
+            )
+        for name, results in (get_results or {}).items():
+            node = node_index(name)
+            for attempt, result in enumerate(results):
+                records += _pack_request(
+                    run, test, node, attempt, resource, 1, result,
+                )
+    return records
+
+
+def _pack_request(run, test, node, attempt, resource, method, result):
+    if result.success is None:
+        success = UNKNOWN
+    else:
+        success = 1 if result.success else 0
+    return REQUEST_RECORD.pack(
+        run, test, node, attempt, result.status or 0, resource, method,
+        success, result.length or 0, encode_time(result.start),
+        encode_time(result.connected), encode_time(result.end),
+    )
+
+
+def read_nodes(path):
+    """Map node names to their indexes in a store directory.
+    """
+    nodes = {}
+    nodes_path = Path(path) / "nodes.txt"
+    if nodes_path.exists():
+        with open(nodes_path) as stream:
+            for line in stream:
+                nodes[line.rstrip("\n")] = len(nodes)
+    return nodes
+
+
+def read_records(path, record, factory, chunk_records=4096):
+    """Yield records from a .bin file, a chunk at a time.
+    """
+    if not Path(path).exists():
+        return
+    with open(path, "rb") as stream:
+        while True:
+            chunk = stream.read(record.size * chunk_records)
+            # Ignore a partial record from a crash mid-write
+            chunk = chunk[:len(chunk) - len(chunk) % record.size]
+            if not chunk:
+                return
+            for values in record.iter_unpack(chunk):
+                yield factory(*values)
+
+
+def read_tests(path):
+    """Yield (TestRecord, [RequestRecord, ...]) per finished test.
+
+    Only one test's requests are held in memory at a time.
+    """
+    path = Path(path)
+    check_format(path)
+    tests = read_records(path / "tests.bin", TEST_RECORD, _test_record)
+    requests_path = path / "requests.bin"
+    if not requests_path.exists():
+        for test in tests:
+            yield test, []
+        return
+    with open(requests_path, "rb") as stream:
+        for test in tests:
+            yield test, read_test_requests(stream, test)
+
+
+def read_test_requests(stream, test):
+    """Read one test's RequestRecords from an open requests.bin.
+    """
+    stream.seek(test.offset)
+    data = stream.read(REQUEST_RECORD.size * test.requests)
+    data = data[:len(data) - len(data) % REQUEST_RECORD.size]
+    records = [
+        _request_record(*values)
+        for values in REQUEST_RECORD.iter_unpack(data)
+    ]
+    # Anything else means the files don't belong together
+    return [
+        record for record in records
+        if (record.run, record.test) == (test.run, test.test)
+    ]
+
+
+def _test_record(run, test, start, end, offset, requests):
+    return TestRecord(
+        run, test, decode_time(start), decode_time(end), offset, requests,
+    )
+
+
+def _request_record(run, test, node, attempt, status, resource, method,
+                    success, length, start, connected, end):
+    return RequestRecord(
+        run, test, node, attempt, status, resource, method,
+        None if success == UNKNOWN else bool(success), length,
+        decode_time(start), decode_time(connected), decode_time(end),
+    )
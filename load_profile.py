@@ -0,0 +1,154 @@
+"""Drive a running locust master through a load profile of user counts.
+
+A profile is a list of steps, each giving a target user count, how long the
+step lasts and the shape of the transition from the previous step's count:
+
+step
+    jump straight to the new count and hold it
+linear
+    ramp evenly from the previous count over the whole step
+sine
+    ease in and out (half a cosine wave) from the previous count
+replay
+    like step; used for profiles replayed from a recorded stats file
+
+Deadlines are computed from one monotonic start time, so sleeping late never
+accumulates into drift, and user counts are changed in place on the running
+swarm rather than stopping and restarting it between steps.
+"""
+import csv
+import datetime
+import math
+import time
+from collections import namedtuple
+
+SHAPES = ("step", "linear", "sine", "replay")
+
+# users: target count at the end of the step, duration: seconds
+ProfileStep = namedtuple("ProfileStep", "users duration shape")
+
+
+def read_profile(csv_file, default_shape="step"):
+    """Read a profile CSV of `users,duration_minutes[,shape]` rows.
+    """
+    steps = []
+    with open(csv_file, newline="") as stream:
+        for row in csv.reader(stream):
+            if not row or row[0].startswith("#"):
+                continue
+            shape = row[2].strip() if len(row) > 2 else default_shape
+            if shape not in SHAPES:
+                raise ValueError(f"unknown shape {shape!r} in {csv_file}")
+            steps.append(ProfileStep(
+                int(row[0]), float(row[1]) * 60, shape,
+            ))
+    return steps
+
+
+def read_replay(stats_file):
+    """Build a profile replaying the user counts in a StatsLogger output file.
+
+    Each change of user count becomes a step lasting until the next change,
+    with the original timing.
+    """
+    samples = []
+    with open(stats_file, newline="") as stream:
+        for row in csv.DictReader(stream):
+            if not row.get("user_count"):
+                continue
+            timestamp = datetime.datetime.strptime(
+                row["timestamp"], "%Y-%m-%d %H:%M:%S.%f",
+            ).timestamp()
+            users = int(row["user_count"])
+            if samples and samples[-1][0] == timestamp:
+                continue
+            samples.append((timestamp, users))
+    steps = []
+    for (start, users), (end, _) in zip(samples, samples[1:]):
+        if steps and steps[-1].users == users:
+            last = steps.pop()
+            start -= last.duration
+        steps.append(ProfileStep(users, end - start, "replay"))
+    return steps
+
+
+def users_at(previous, step, elapsed):
+    """Get the target user count `elapsed` seconds into a step.
+
+    :arg previous:
+        User count at the end of the previous step
+    """
+    if step.shape in ("step", "replay") or step.duration <= 0:
+        return step.users
+    fraction = min(1.0, max(0.0, elapsed / step.duration))
+    if step.shape == "sine":
+        fraction = (1 - math.cos(math.pi * fraction)) / 2
+    return round(previous + (step.users - previous) * fraction)
+
+
+class LoadProfile:
+    """Run a list of ProfileSteps against a callable which sets user counts.
+    """
+
+    def __init__(self, steps, set_users, update_interval=1.0,
+                 transitions_file=None):
+        """
+        :arg set_users:
+            Called with a user count whenever the target changes
+        :arg update_interval:
+            Seconds between target updates during ramps
+        :arg transitions_file:
+            Optional CSV path to log every user count change to
+        """
+        self.steps = steps
+        self.set_users = set_users
+        self.update_interval = update_interval
+        self.transitions_file = transitions_file
+
+    def run(self, initial_users=0):
+        transitions = None
+        writer = None
+        if self.transitions_file:
+            transitions = open(self.transitions_file, "a", newline="")
+            writer = csv.writer(transitions)
+            if transitions.tell() == 0:
+                writer.writerow(
+                    ["timestamp", "offset", "step", "shape", "users"]
+                )
+        try:
+            self._run(initial_users, transitions, writer)
+        finally:
+            if transitions is not None:
+                transitions.close()
+
+    def _run(self, initial_users, transitions, writer):
+        start = time.monotonic()
+        step_start = start
+        previous = initial_users
+        current = None
+        for index, step in enumerate(self.steps):
+            step_end = step_start + step.duration
+            while True:
+                now = time.monotonic()
+                target = users_at(previous, step, now - step_start)
+                if target != current:
+                    # Log the wall clock time around the actual change, so
+                    # it can be lined up with server metrics
+                    wall = time.time()
+                    self.set_users(target)
+                    current = target
+                    if writer is not None:
+                        writer.writerow([
+                            datetime.datetime.fromtimestamp(wall).isoformat(),
+                            round(now - start, 6), index, step.shape, target,
+                        ])
+                        transitions.flush()
+                if now >= step_end:
+                    break
+                if step.shape in ("step", "replay"):
+                    wake = step_end
+                else:
+                    wake = min(step_end, now + self.update_interval)
+                time.sleep(max(0, wake - time.monotonic()))
+            previous = step.users
+            step_start = step_end
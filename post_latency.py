@@ -10,9 +10,18 @@ from datetime import datetime as Datetime
 import asyncio
 import aiohttp
 from async_timeout import timeout
+from latency_store import LatencyStore
+from latency_results import (
+    seconds, RequestResult, TestResult, visibility_interval,
+)
+from latency_analysis import LatencyAnalysis
 
 LOG = logging.getLogger("post_latency")
 
+# Bytes to read at a time from response bodies
+CHUNK_SIZE = 64 * 1024
+
+
 def argument_parser():
     parser = argparse.ArgumentParser(
         description="Test some latency thing",
@@ -64,6 +73,11 @@ def argument_parser():
         "--layer",
         default="water",
     )
+    parser.add_argument(
+        "--native-name",
+        default=None,
+        help="database table to publish; defaults to the --layer name",
+    )
     parser.add_argument(
         "--test-count",
         type=int,
@@ -79,67 +93,161 @@ def argument_parser():
         type=int,
         default=0.1,
     )
+    parser.add_argument(
+        "--poll-strategy",
+        choices=["fixed", "adaptive"],
+        default="fixed",
+        help=(
+            "fixed polls every --delay seconds; adaptive polls every "
+            "--coarse-delay seconds until the expected propagation window, "
+            "then every --delay seconds"
+        ),
+    )
+    parser.add_argument(
+        "--coarse-delay",
+        type=float,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--expected-latency",
+        type=float,
+        default=None,
+        help=(
+            "seconds after the POST when the resource may first be visible; "
+            "by default this is learned from earlier tests in the run"
+        ),
+    )
+    parser.add_argument(
+        "--window-margin",
+        type=float,
+        default=0.5,
+        help=(
+            "start dense polling at this fraction of the earliest "
+            "visibility seen so far"
+        ),
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help=(
+            "run up to this many tests at once; each of the concurrent "
+            "slots gets its own workspace, datastore and layer names"
+        ),
+    )
+    parser.add_argument(
+        "--connection-limit",
+        type=int,
+        default=100,
+        help="maximum open connections shared by all concurrent tests",
+    )
+    parser.add_argument(
+        "--store",
+        default=None,
+        help=(
+            "append results to this latency store directory as each test "
+            "finishes, instead of keeping them in memory; "
+            "summarize it later with latency_report.py"
+        ),
+    )
+    parser.add_argument(
+        "--cleanup-delay",
+        type=float,
+        default=10,
+        help="seconds to wait after deleting leftovers before each test",
+    )
     return parser
 
 
-class RequestResult:
-    """Store data on one request.
-    """
-    def __init__(self):
-        self.content_type = None
-        self.success = None
-        self.status = None
-        self.body = None
-        self.start = None
-        self.connected = None
-        self.end = None
-
-    @property
-    def duration(self):
-        if self.end is None or self.start is None:
-            return None
-        return self.end - self.start
-
+class PollSchedule:
+    """Decide how long to wait before each polling attempt.
 
-class TestResult:
-    """Store data on one node test.
+    Polls coarsely until the window where the resource is expected to become
+    visible, then densely, so we get fine resolution where it matters
+    without hammering the nodes for the rest of the time.
     """
-    def __init__(self, post_node_name, get_node_names):
+    def __init__(self, delay, coarse_delay, window_start=None):
         """
-        :arg post_node_name:
-            One string specifying the hostname or hostname:port of the host to
-            issue POST requests to, setting up the test.
-        :arg get_node_names:
-            List of strings specifying hostname or hostname:port for each host
-            to issue polling GET requests to.
+        :arg delay:
+            Seconds between dense polls
+        :arg coarse_delay:
+            Seconds between coarse polls
+        :arg window_start:
+            Seconds after the first attempt at which to switch to dense
+            polling; if None, poll densely throughout.
         """
-        self.post_node_name = post_node_name
-        self.get_node_names = get_node_names
+        self.delay = delay
+        self.coarse_delay = coarse_delay
+        self.window_start = window_start
+
+    def next_delay(self, elapsed):
+        """Get the delay before the next attempt, `elapsed` seconds in.
+        """
+        if self.window_start is None or elapsed >= self.window_start:
+            return self.delay
+        # Don't let a coarse step overshoot the start of the window
+        return max(self.delay, min(
+            self.coarse_delay, self.window_start - elapsed,
+        ))
+
 
-        # A list of RequestResult instances representing retries of the POST
-        self.workspace_post_results = None
-        # A dict mapping hostname strings to retries of the GET
-        self.workspace_get_results = None
+class PropagationEstimator:
+    """Learn when resources start becoming visible, from earlier tests.
+    """
+    def __init__(self):
+        # Map resource labels to earliest lower bound seen, in seconds
+        self.earliest = {}
+
+    def observe(self, resource, lower):
+        if lower is None:
+            return
+        earliest = self.earliest.get(resource)
+        if earliest is None or lower < earliest:
+            self.earliest[resource] = lower
+
+    def window_start(self, resource, margin):
+        earliest = self.earliest.get(resource)
+        if earliest is None:
+            return None
+        return earliest * margin
 
-        self.datastore_post_results = None
-        self.datastore_get_results = None
 
-        self.featuretype_post_results = None
-        self.featuretype_get_results = None
+# Shared by all tests in a run, so later tests poll more efficiently
+ESTIMATOR = PropagationEstimator()
 
-        # How many times did we fail?
-        self.failures = 0
 
-        # Was the test successful overall?
-        self.success = None
+def poll_schedule(options, resource):
+    """Get the PollSchedule for GETs polling a resource, or None for fixed.
+    """
+    if options.poll_strategy != "adaptive":
+        return None
+    window_start = options.expected_latency
+    if window_start is None:
+        window_start = ESTIMATOR.window_start(resource, options.window_margin)
+    return PollSchedule(options.delay, options.coarse_delay, window_start)
 
-        # time.monotonic() timestamps for timing the whole test.
-        self.start = None
-        self.end = None
+
+def observe_visibility(resource, post_results, get_results):
+    """Feed visibility brackets from one test into ESTIMATOR.
+    """
+    if not post_results or not post_results[-1].success:
+        return
+    post_start = post_results[-1].start
+    for results in get_results.values():
+        interval = visibility_interval(results, post_start)
+        if interval is not None:
+            ESTIMATOR.observe(resource, seconds(interval[0]))
 
 
 async def retry(label, async_function, args=None, kwargs=None, max_fails=1,
-                delay=0.1):
+                delay=0.1, schedule=None):
+    """Make a request until it succeeds or we run out of attempts.
+
+    :arg delay:
+        Seconds to wait between attempts
+    :arg schedule:
+        Optional PollSchedule which decides the waits instead of delay
+    """
     # default values for args/kwargs which will unpack successfully
     args = args or []
     kwargs = kwargs or {}
@@ -159,13 +267,13 @@ async def retry(label, async_function, args=None, kwargs=None, max_fails=1,
         result = RequestResult()
         results.append(result)
         now = Datetime.now()
-        result.start = time.monotonic()
+        result.start = time.monotonic_ns()
 
         log.debug(f"attempt #{fails + 1} at {now}")
 
         # e.g. "async with session.post(url) as response:"
         async with async_function(*args, **kwargs) as response:
-            result.connected = time.monotonic()
+            result.connected = time.monotonic_ns()
 
             log.debug(f"response {response}")
 
@@ -184,18 +292,21 @@ async def retry(label, async_function, args=None, kwargs=None, max_fails=1,
             # so we need to just retry until we're done retrying.
 
             # Read the body so we can report on its length and the total
-            # request handling time.
-            body = await response.read()
-            result.end = time.monotonic()
-            # GS won't give out Content-Length, so just do it all in RAM
-            result.length = len(body)
+            # request handling time. GS won't give out Content-Length, so
+            # count it as it streams past, only keeping the start for logs.
+            result.length = 0
+            partial_body = b""
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                result.length += len(chunk)
+                if len(partial_body) < 100:
+                    partial_body += chunk[:100 - len(partial_body)]
+            result.end = time.monotonic_ns()
 
             if result.length:
                 log.debug(f"length: {result.length}")
                 log.debug(f"content-type: {result.content_type}")
 
                 # Log some body in case something went wrong
-                partial_body = body[:100]
                 log.debug(f"body: {partial_body}")
 
             # Stop retrying once successful.
@@ -204,6 +315,9 @@ async def retry(label, async_function, args=None, kwargs=None, max_fails=1,
 
             log.error(f"failure: {result.status}")
 
+            if schedule is not None:
+                elapsed = seconds(time.monotonic_ns() - results[0].start)
+                delay = schedule.next_delay(elapsed)
             await asyncio.sleep(delay)
 
     now = Datetime.now()
@@ -282,6 +396,7 @@ async def get_workspace(options, session, node_name):
         },
         max_fails=options.max_fails,
         delay=options.delay,
+        schedule=poll_schedule(options, "Workspace"),
     )
     results = await future
     return results
@@ -326,7 +441,7 @@ async def post_datastore(options, session, node_name):
     }
     data = f"""
         <dataStore>
-        <name>openstreetmap</name>
+        <name>{options.datastore}</name>
         <connectionParameters>
             <host>{options.database_host}</host>
             <port>{options.database_port}</port>
@@ -338,9 +453,7 @@ async def post_datastore(options, session, node_name):
         </dataStore>
         """.strip()
 
-    print("DATASTORE: "+url)
-    print(headers)
-    print(data) 
+    LOG.debug(f"POST datastore {url}: {data}")
     future = retry(
         f"datastore.POST.{node_name}", session.post, args=[url], kwargs={
             "headers": headers,
@@ -376,6 +489,7 @@ async def get_datastore(options, session, node_name):
         },
         max_fails=options.max_fails,
         delay=options.delay,
+        schedule=poll_schedule(options, "Datastore"),
     )
     results = await future
     return results
@@ -424,6 +538,7 @@ async def post_featuretype(options, session, node_name):
     data = f"""
         <featureType>
             <name>{options.layer}</name>
+            <nativeName>{options.native_name or options.layer}</nativeName>
         </featureType>
         """.strip()
 
@@ -463,132 +578,197 @@ async def get_featuretype(options, session, node_name):
         },
         max_fails=options.max_fails,
         delay=options.delay,
+        schedule=poll_schedule(options, "Featuretype"),
     )
     results = await future
     return results
 
 
-async def test(options, label):
+async def test(options, label, session):
+    """Run one propagation test.
 
-    # Create object used for HTTP basic authentication using command line args
-    auth = aiohttp.BasicAuth(options.username, options.password)
+    :arg session:
+        aiohttp.ClientSession, which may be shared by concurrent tests
+    """
 
     # Create object to store all results for test
-    test_result = TestResult(options.post_node_name, options.get_node_names)
+    test_result = TestResult(
+        options.post_node_name, options.get_node_names, label=label,
+        workspace=options.workspace, datastore=options.datastore,
+        layer=options.layer,
+    )
 
     # Timing for the whole test
     # For most reporting we'll prefer to use actual request timings, so ew
     # don't include client setup time
-    test_result.start = time.monotonic()
+    test_result.start = time.monotonic_ns()
 
-    # TODO: fix conn_timeout
-    async with aiohttp.ClientSession(
-        auth=auth, conn_timeout=5, read_timeout=5,
-    ) as session:
+    # Preparatory cleanup
 
-        # Preparatory cleanup
+    results = await delete_featuretype(session, options)
+    LOG.debug(f"DELETE featuretype results {results}")
 
-        results = await delete_featuretype(session, options)
-        LOG.debug(f"DELETE featuretype results {results}")
+    results = await delete_datastore(session, options)
+    LOG.debug(f"DELETE datastore results {results}")
 
-        results = await delete_datastore(session, options)
-        LOG.debug(f"DELETE datastore results {results}")
+    results = await delete_workspace(session, options)
+    LOG.debug(f"DELETE workspace results {results}")
 
-        results = await delete_workspace(session, options)
-        LOG.debug(f"DELETE workspace results {results}")
+    await asyncio.sleep(options.cleanup_delay)
 
-        await asyncio.sleep(10)
+    # Create a bunch of futures. Coroutine execution doesn't start yet.
 
-        # Create a bunch of futures. Coroutine execution doesn't start yet.
+    node_names = [options.post_node_name] + options.get_node_names
 
-        node_names = [options.post_node_name] + options.get_node_names
+    workspace_get_futures = [
+        get_workspace(options, session, node_name)
+        for node_name in node_names
+    ]
+    workspace_post_future = post_workspace(
+        session, options, options.post_node_name
+    )
+    futures = [workspace_post_future] + workspace_get_futures
 
-        workspace_get_futures = [
-            get_workspace(options, session, node_name)
-            for node_name in node_names
-        ]
-        workspace_post_future = post_workspace(
-            session, options, options.post_node_name
-        )
-        futures = [workspace_post_future] + workspace_get_futures
-
-        # Start all the futures at the same time.
-        #
-        # await actually schedules the futures, then we go to sleep,
-        # and once they've all ripened, the scheduler wakes us up again.
-        #
-        # Since we used gather, results will be in the same order.
-
-        results = await asyncio.gather(*futures)
-
-        post_results, *all_get_results = results
-        get_results = {
-            node_names[index]: all_get_results[index]
-            for index in range(0, len(all_get_results))
-        }
-
-        test_result.workspace_post_results = post_results
-        test_result.workspace_get_results = get_results
-
-        # Log how many tries we had
-        LOG.debug(f"{len(post_results)} POST workspace results")
-        LOG.debug(f"{len(get_results)} GET workspace results:")
-        for get_node_name, results in sorted(get_results.items()):
-            LOG.debug(f"    {get_node_name}: {len(results)} results")
-
-        # Rinse, repeat for datastore
-        datastore_get_futures = [
-            get_datastore(options, session, node_name)
-            for node_name in node_names
-        ]
-        datastore_post_future = post_datastore(
-            options, session, options.post_node_name
-        )
-        futures = [datastore_post_future] + datastore_get_futures
-        results = await asyncio.gather(*futures)
-        post_results, *all_get_results = results
-        get_results = {
-            node_names[index]: all_get_results[index]
-            for index in range(0, len(all_get_results))
-        }
-        test_result.datastore_post_results = post_results
-        test_result.datastore_get_results = get_results
-        LOG.debug(f"{len(post_results)} POST datastore results")
-        LOG.debug(f"{len(get_results)} GET datastore results:")
-        for get_node_name, results in sorted(get_results.items()):
-            LOG.debug(f"    {get_node_name}: {len(results)} results")
-
-        # Rinse, repeat for featuretype
-        featuretype_get_futures = [
-            get_featuretype(options, session, node_name)
-            for node_name in node_names
-        ]
-        featuretype_post_future = post_featuretype(
-            options, session, options.post_node_name
-        )
-        futures = [featuretype_post_future] + featuretype_get_futures
-        results = await asyncio.gather(*futures)
-        post_results, *all_get_results = results
-        get_results = {
-            node_names[index]: all_get_results[index]
-            for index in range(0, len(all_get_results))
-        }
-        test_result.featuretype_post_results = post_results
-        test_result.featuretype_get_results = get_results
-        LOG.debug(f"{len(post_results)} POST featuretype results")
-        LOG.debug(f"{len(get_results)} GET featuretype results:")
-        for get_node_name, results in sorted(get_results.items()):
-            LOG.debug(f"    {get_node_name}: {len(results)} results")
-
-    test_result.end = time.monotonic()
+    # Start all the futures at the same time.
+    #
+    # await actually schedules the futures, then we go to sleep,
+    # and once they've all ripened, the scheduler wakes us up again.
+    #
+    # Since we used gather, results will be in the same order.
+
+    results = await asyncio.gather(*futures)
+
+    post_results, *all_get_results = results
+    get_results = {
+        node_names[index]: all_get_results[index]
+        for index in range(0, len(all_get_results))
+    }
+
+    test_result.workspace_post_results = post_results
+    test_result.workspace_get_results = get_results
+    observe_visibility("Workspace", post_results, get_results)
+
+    # Log how many tries we had
+    LOG.debug(f"{len(post_results)} POST workspace results")
+    LOG.debug(f"{len(get_results)} GET workspace results:")
+    for get_node_name, results in sorted(get_results.items()):
+        LOG.debug(f"    {get_node_name}: {len(results)} results")
+
+    # Rinse, repeat for datastore
+    datastore_get_futures = [
+        get_datastore(options, session, node_name)
+        for node_name in node_names
+    ]
+    datastore_post_future = post_datastore(
+        options, session, options.post_node_name
+    )
+    futures = [datastore_post_future] + datastore_get_futures
+    results = await asyncio.gather(*futures)
+    post_results, *all_get_results = results
+    get_results = {
+        node_names[index]: all_get_results[index]
+        for index in range(0, len(all_get_results))
+    }
+    test_result.datastore_post_results = post_results
+    test_result.datastore_get_results = get_results
+    observe_visibility("Datastore", post_results, get_results)
+    LOG.debug(f"{len(post_results)} POST datastore results")
+    LOG.debug(f"{len(get_results)} GET datastore results:")
+    for get_node_name, results in sorted(get_results.items()):
+        LOG.debug(f"    {get_node_name}: {len(results)} results")
+
+    # Rinse, repeat for featuretype
+    featuretype_get_futures = [
+        get_featuretype(options, session, node_name)
+        for node_name in node_names
+    ]
+    featuretype_post_future = post_featuretype(
+        options, session, options.post_node_name
+    )
+    futures = [featuretype_post_future] + featuretype_get_futures
+    results = await asyncio.gather(*futures)
+    post_results, *all_get_results = results
+    get_results = {
+        node_names[index]: all_get_results[index]
+        for index in range(0, len(all_get_results))
+    }
+    test_result.featuretype_post_results = post_results
+    test_result.featuretype_get_results = get_results
+    observe_visibility("Featuretype", post_results, get_results)
+    LOG.debug(f"{len(post_results)} POST featuretype results")
+    LOG.debug(f"{len(get_results)} GET featuretype results:")
+    for get_node_name, results in sorted(get_results.items()):
+        LOG.debug(f"    {get_node_name}: {len(results)} results")
+
+    test_result.end = time.monotonic_ns()
 
     # Debug report on the completion and timing of the whole process
-    duration = round(test_result.end - test_result.start, 4)
-    LOG.debug(f"Test for {options.post_node_name} finished in {duration}s.")
+    duration = round(seconds(test_result.end - test_result.start), 4)
+    LOG.debug(
+        f"Test #{label} for {options.post_node_name} finished in {duration}s."
+    )
 
     return test_result
 
 
+def test_options(options, slot):
+    """Get options for a test running in one of --concurrency slots.
+
+    Concurrent tests would trample each other's resources, so when running
+    more than one at once each slot gets its own workspace, datastore and
+    layer names, all publishing the same database table. Names are reused
+    by the slot's later tests, whose preparatory cleanup deletes them, so
+    a run leaves no more resources behind than it has slots.
+    """
+    if options.concurrency <= 1:
+        return options
+    values = vars(options).copy()
+    values["workspace"] = f"{options.workspace}_{slot}"
+    values["datastore"] = f"{options.datastore}_{slot}"
+    values["layer"] = f"{options.layer}_{slot}"
+    values["native_name"] = options.native_name or options.layer
+    return argparse.Namespace(**values)
+
+
+async def run_tests(options, test_results, store=None):
+    """Run --test-count tests, up to --concurrency at a time.
+
+    All tests share one session and connection pool. Each result (or
+    exception) is appended to test_results as soon as its test finishes,
+    so partial results survive an interruption. If a LatencyStore is given,
+    successful results are written there instead of kept in memory.
+    """
+    # Create object used for HTTP basic authentication using command line args
+    auth = aiohttp.BasicAuth(options.username, options.password)
+    connector = aiohttp.TCPConnector(limit=options.connection_limit)
+    # Free slots; a test takes one and runs under its resource names
+    slots = asyncio.Queue()
+    for slot in range(1, max(1, options.concurrency) + 1):
+        slots.put_nowait(slot)
+
+    async def limited_test(label):
+        slot = await slots.get()
+        try:
+            result = await test(test_options(options, slot), label, session)
+        except Exception as error:
+            LOG.error(f"Test #{label} failed: {error!r}")
+            result = error
+        finally:
+            slots.put_nowait(slot)
+        if store is not None and not isinstance(result, Exception):
+            store.append_test(result)
+            return
+        test_results.append(result)
+
+    # TODO: fix conn_timeout
+    async with aiohttp.ClientSession(
+        auth=auth, connector=connector, conn_timeout=5, read_timeout=5,
+    ) as session:
+        await asyncio.gather(*[
+            limited_test(index + 1) for index in range(0, options.test_count)
+        ])
+
+
 def summary_text(values):
     # drop None values to avoid mucking up the statistics
     values = [value for value in values if value is not None]
@@ -605,51 +785,18 @@ def summary_text(values):
     return text
 
 
-LATENCY_NAMES = [
-    "end-end",
-    "end-start",
-    "end-conn",
-    "start-end",
-    "start-start",
-    "start-conn",
-    "conn-end",
-    "conn-start",
-    "conn-conn",
-]
-
-
-def latency_dict(last_get, last_post):
-    latencies = {}
-    if last_get.end is not None:
-        if last_post.end is not None:
-            latencies["end-end"] = last_get.end - last_post.end
-        if last_post.start is not None:
-            latencies["end-start"] = last_get.end - last_post.start
-        if last_post.connected is not None:
-            latencies["end-conn"] = last_get.end - last_post.connected
-    if last_get.start is not None:
-        if last_post.end is not None:
-            latencies["start-end"] = last_get.start - last_post.end
-        if last_post.start is not None:
-            latencies["start-start"] = last_get.start - last_post.start
-        if last_post.connected is not None:
-            latencies["start-conn"] = last_get.start - last_post.connected
-    if last_get.connected is not None:
-        if last_post.end is not None:
-            latencies["conn-end"] = last_get.connected - last_post.end
-        if last_post.start is not None:
-            latencies["conn-start"] = last_get.connected - last_post.start
-        if last_post.connected is not None:
-            latencies["conn-conn"] = last_get.connected - last_post.connected
-    return latencies
+def log_failures(results):
+    """Log the exceptions among test results, i.e. the failed tests.
+    """
+    for result in results:
+        if isinstance(result, Exception):
+            logging.exception(result)
 
 
 def report(results):
     tab = " " * 4
 
-    for result in results:
-        if isinstance(result, Exception):
-            logging.exception(result)
+    log_failures(results)
 
     results = [
         result for result in results
@@ -660,15 +807,20 @@ def report(results):
         print("No results to display.")
         return
 
-    all_latencies = {}
+    # Concurrent tests finish in any order
+    results = sorted(results, key=lambda result: result.label or 0)
+
+    # Work out every test's latencies in one go
+    analysis = LatencyAnalysis.from_results(results)
 
     for index, result in enumerate(results, 1):
-        test_duration = round(result.end - result.start, 3)
+        test_duration = round(seconds(result.end - result.start), 3)
 
         paragraph = dedent(f"""
 
-            Test #{index}
+            Test #{result.label or index}
             Test Host: {result.post_node_name}
+            Test Resources: {result.workspace}/{result.datastore}/{result.layer}
             Test Duration: {test_duration}s
             Test Results:
             """.rstrip())
@@ -691,7 +843,7 @@ def report(results):
                 result.featuretype_get_results,
             ),
         ]
-        for label, post_results, get_results in tups:
+        for resource, (label, post_results, get_results) in enumerate(tups):
 
             # e.g. "Datastore:"
             line = indent(f"{label}:", tab)
@@ -781,33 +933,14 @@ def report(results):
                     if last_get and last_get.success and last_post and last_post.success:
 
                         print(indent("Latencies:", tab * 4))
-                        latencies = latency_dict(last_get, last_post)
+                        latencies = analysis.test_latencies(
+                            index - 1, name, resource,
+                        )
                         for latency_name, value in sorted(latencies.items()):
                             print(indent(f"{latency_name} = {value}", tab * 5))
 
-                        existing = all_latencies.setdefault((name, label), {})
-                        for key, value in latencies.items():
-                            values = existing.setdefault(key, [])
-                            values.append(value)
-
     print("Combined Latencies")
-    tuples = list(all_latencies.keys())
-    names = sorted(set([tup[0] for tup in tuples]))
-    labels = sorted(set([tup[1] for tup in tuples]))
-    for name in names:
-        print("=" * len(name))
-        print(f"{name}")
-        print("=" * len(name))
-        for label in labels:
-            print(indent(f"{label}", tab * 1))
-            print(indent("-" * len(label), tab * 1))
-            key = (name, label)
-            latencies = all_latencies.get(key)
-            for latency_name in LATENCY_NAMES:
-                print(indent(f"{latency_name}", tab * 2))
-                values = latencies.get(latency_name) or []
-                if values:
-                    print(indent(summary_text(values), tab * 3))
+    print(analysis.report())
 
 
 def main():
@@ -824,16 +957,26 @@ def main():
     # Run coroutines
     loop = asyncio.get_event_loop()
 
+    store = None
+    if options.store:
+        store = LatencyStore(options.store, run_info=vars(options))
+
     test_results = []
     try:
-        for index in range(0, options.test_count):
-            test_result = loop.run_until_complete(test(options, index + 1))
-            test_results.append(test_result)
+        loop.run_until_complete(run_tests(options, test_results, store))
     except KeyboardInterrupt:
         print(f"collected {len(test_results)} test results before interruption")
 
     # Output formatted summarized results
-    report(test_results)
+    if store is None:
+        report(test_results)
+        return
+    store.close()
+    # Only failed tests were kept in memory; summarize this run from the store
+    log_failures(test_results)
+    from latency_report import report_store
+    report_store(options.store, runs=[store.run])
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -22,8 +22,9 @@ else
 fi
 
 # build data file if it is not present
-if [ ! -f "./data/wms_256_tiles.csv" ]; then
-    ./code/mercantile_gen.py
+if [ ! -f "./data/wms_256_tiles.bbox" ]; then
+    mkdir -p data
+    ./code/mercantile_gen.py --output ./data/wms_256_tiles.bbox
 fi
 
 $LOCUST --version
@@ -8,31 +8,89 @@ import csv
 import requests
 import logging
 import threading
-import urllib.request
-import json
+import os
+import load_profile
+import capacity_search
 
 # input: csv file showing how many users, how many minutes, one per line
 # e.g., `10,120` = 10 users for 120 minutes
+# An optional third column gives the transition shape from the previous row,
+# e.g. `50,10,linear` ramps to 50 users over 10 minutes (see load_profile)
 
 LOG = logging.getLogger("simulate_variable_usage")
 csv_file=None
 
+# Columns written by StatsLogger, one row per locust stats entry per sample
+STATS_FIELDS = [
+    "method",
+    "name",
+    "num_requests",
+    "num_failures",
+    "median_response_time",
+    "avg_response_time",
+    "min_response_time",
+    "max_response_time",
+    "avg_content_length",
+    "current_rps",
+]
+
+
 class StatsLogger(threading.Thread):
+    """Sample locust's live stats at a fixed interval and append them to a CSV.
+
+    Uses one keep-alive HTTP session to the master, one request per sample,
+    and one buffered output file which is only fsynced periodically, so it
+    can sample at sub-second intervals without loading the master.
 
-    def __init__(self,host,output_stats_file):
-        super(StatsLogger, self).__init__()
+    Locust caches /stats/requests for a couple of seconds, and workers only
+    report every few seconds, so sampling more often than that mostly gets
+    the same stats again; samples identical to the last one written are
+    skipped, so every row is a real update.
+    """
+
+    def __init__(self,host,output_stats_file,interval=1.0,fsync_interval=10.0):
+        super(StatsLogger, self).__init__(daemon=True)
         self.host=host
         self.output_stats_file=output_stats_file
-
+        self.interval=interval
+        self.fsync_interval=fsync_interval
+        self.session=requests.Session()
+        self.stopped=threading.Event()
 
     def run(self):
         print("Starting stats logger")
-        while (True):
-            stats=get_stats(self.host)
-            print(stats)
-            with open(self.output_stats_file,"a") as myfile:
-                myfile.write(stats)
-            time.sleep(1)
+        with open(self.output_stats_file,"a",newline="",buffering=1024 * 1024) as myfile:
+            writer=csv.writer(myfile)
+            if myfile.tell() == 0:
+                writer.writerow(["timestamp","user_count"]+STATS_FIELDS)
+            next_sample=time.monotonic()
+            next_fsync=next_sample+self.fsync_interval
+            last_values=None
+            # Sample on a fixed monotonic schedule, so slow responses
+            # don't make the interval drift
+            while not self.stopped.wait(max(0,next_sample-time.monotonic())):
+                next_sample+=self.interval
+                try:
+                    rows=get_stats(self.host,self.session)
+                except (requests.RequestException, ValueError) as error:
+                    LOG.warning("could not get stats: %s", error)
+                    continue
+                values=[row[1:] for row in rows]
+                if values==last_values:
+                    continue
+                last_values=values
+                writer.writerows(rows)
+                now=time.monotonic()
+                if now>=next_fsync:
+                    myfile.flush()
+                    os.fsync(myfile.fileno())
+                    next_fsync=now+self.fsync_interval
+            myfile.flush()
+            os.fsync(myfile.fileno())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
 
 def argument_parser():
     parser = argparse.ArgumentParser(
@@ -50,53 +108,215 @@ def argument_parser():
         "--csv-file",
         default="usage_load.csv",
     )
+    parser.add_argument(
+        "--replay",
+        help="replay user counts from a previous output_stats_file instead",
+    )
+    parser.add_argument(
+        "--shape",
+        choices=load_profile.SHAPES,
+        default="step",
+        help="transition shape for rows which don't give one",
+    )
+    parser.add_argument(
+        "--update-interval",
+        type=float,
+        default=1.0,
+        help="seconds between user count updates during ramps",
+    )
+    parser.add_argument(
+        "--spawn-rate",
+        type=float,
+        default=100,
+        help="users per second locust spawns to reach each new count",
+    )
+    parser.add_argument(
+        "--transitions-file",
+        default="transitions.csv",
+        help="CSV logging the time of every user count change",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=1.0,
+        help="seconds between stats samples; unchanged samples are skipped",
+    )
+    parser.add_argument(
+        "--fsync-interval",
+        type=float,
+        default=10.0,
+        help="seconds between fsyncs of the stats file",
+    )
+    capacity = parser.add_argument_group(
+        "capacity search",
+        "search for the most users sustainable within an SLO instead of running a profile",
+    )
+    capacity.add_argument(
+        "--capacity",
+        action="store_true",
+        help="run a capacity search",
+    )
+    capacity.add_argument("--min-users", type=int, default=10)
+    capacity.add_argument("--max-users", type=int, default=1000)
+    capacity.add_argument(
+        "--growth",
+        type=float,
+        default=2.0,
+        help="factor to grow user counts by until a probe fails",
+    )
+    capacity.add_argument(
+        "--resolution",
+        type=int,
+        default=10,
+        help="stop bisecting when passing and failing counts are this close",
+    )
+    capacity.add_argument(
+        "--settle",
+        type=float,
+        default=30.0,
+        help="seconds to wait after spawning before measuring a probe",
+    )
+    capacity.add_argument(
+        "--hold",
+        type=float,
+        default=60.0,
+        help="seconds to measure each probe for",
+    )
+    capacity.add_argument(
+        "--cooldown",
+        type=float,
+        default=60.0,
+        help="seconds with no users after an aborted probe",
+    )
+    capacity.add_argument(
+        "--slo-p95",
+        type=float,
+        default=1000.0,
+        help="highest acceptable p95 response time in milliseconds",
+    )
+    capacity.add_argument(
+        "--slo-error-rate",
+        type=float,
+        default=0.01,
+        help="highest acceptable ratio of failed requests",
+    )
+    capacity.add_argument(
+        "--abort-p95",
+        type=float,
+        default=10000.0,
+        help="p95 in milliseconds at which to abort a probe straight away",
+    )
+    capacity.add_argument(
+        "--abort-error-rate",
+        type=float,
+        default=0.5,
+        help="ratio of failed requests at which to abort a probe straight away",
+    )
+    capacity.add_argument(
+        "--probes-file",
+        default="capacity_probes.csv",
+        help="CSV logging the result of every probe",
+    )
     return parser
 
-# "Method","Name","# requests","# failures","Median response time","Average response time","Min response time","Max response time","Average Content Size","Requests/s"
-def get_stats(host):
-    req=urllib.request.urlopen("http://"+host+"/stats/requests/csv")
-    stats=req.read()
-    lines=stats.splitlines()
-    req=urllib.request.urlopen("http://"+host+"/stats/requests")
-    stats=req.read()
-    threads=json.loads(stats)["user_count"]
-    st = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
-    line=st+","+str(lines[1])+","+str(threads)
-    return line
+def get_report(host,session):
+    response=session.get("http://"+host+"/stats/requests")
+    response.raise_for_status()
+    return response.json()
+
+def get_stats(host,session):
+    """Get one sample of every locust stats entry, as rows for StatsLogger.
+    """
+    report=get_report(host,session)
+    st = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S.%f')
+    users=report.get("user_count")
+    return [
+        [st,users]+[entry.get(field) for field in STATS_FIELDS]
+        for entry in report.get("stats",[])
+    ]
 
 def read_load_csv(csv_file): 
     return list(csv.reader(open(csv_file)))
 
-def start_test(host,users):
-    r=requests.post('http://'+host+'/swarm',data={'hatch_rate': 1, 'locust_count': users})
+def start_test(host,users,spawn_rate=1,session=requests):
+    r=session.post('http://'+host+'/swarm',data={'spawn_rate': spawn_rate, 'user_count': users})
     print("Started test with ",users,":",r.status_code, r.reason)
 
-def stop_test(host):
-    r=requests.get('http://'+host+'/stop')
+def stop_test(host,session=requests):
+    r=session.get('http://'+host+'/stop')
     print("Stopped test:",r.status_code, r.reason)
 
-def run_test_static_users(host,users,duration_min):
-    start_test(host,users)
-    t_end=time.time()+60*float(duration_min)
-    while True:
-        if (time.time()>t_end):
-            break
-        time.sleep(1)
-    stop_test(host)
-
-def run_test_dynamic(host,output_stats_file,usage_load_table):
-    stats_logger = StatsLogger(host,output_stats_file)
+def run_test_dynamic(host,output_stats_file,steps,options):
+    stats_logger = StatsLogger(host,output_stats_file,options.stats_interval,options.fsync_interval)
+    stats_logger.start()
+    session = requests.Session()
+    # Posting to /swarm while running changes the user count in place
+    def set_users(users):
+        start_test(host,users,options.spawn_rate,session)
+    for step in steps:
+        print("Profile step:",step.users,"users for",round(step.duration/60,2),"minutes,",step.shape)
+    profile = load_profile.LoadProfile(steps,set_users,options.update_interval,options.transitions_file)
+    try:
+        profile.run()
+    finally:
+        stop_test(host,session)
+        stats_logger.stop()
+
+def run_capacity_search(host,output_stats_file,options):
+    stats_logger = StatsLogger(host,output_stats_file,options.stats_interval,options.fsync_interval)
     stats_logger.start()
-    for r in range(len(usage_load_table[0])):
-        users=usage_load_table[r][0]
-        duration_min=usage_load_table[r][1]
-        print("Running test with",users,"threads for",duration_min,"minutes")
-        run_test_static_users(host,users,duration_min)
+    session = requests.Session()
+    def set_users(users):
+        start_test(host,users,options.spawn_rate,session)
+    def sample():
+        try:
+            return capacity_search.sample_from_report(get_report(host,session))
+        except (requests.RequestException, ValueError) as error:
+            LOG.warning("could not get stats: %s", error)
+            return None
+    search = capacity_search.CapacitySearch(
+        set_users,
+        sample,
+        slo=[
+            capacity_search.p95_within(options.slo_p95),
+            capacity_search.error_rate_within(options.slo_error_rate),
+        ],
+        abort=[
+            capacity_search.p95_within(options.abort_p95),
+            capacity_search.error_rate_within(options.abort_error_rate),
+        ],
+        min_users=options.min_users,
+        max_users=options.max_users,
+        growth=options.growth,
+        resolution=options.resolution,
+        spawn_rate=options.spawn_rate,
+        settle=options.settle,
+        hold=options.hold,
+        cooldown=options.cooldown,
+        interval=options.stats_interval,
+        probes_file=options.probes_file,
+    )
+    try:
+        good,bad = search.run()
+    finally:
+        stop_test(host,session)
+        stats_logger.stop()
+    if bad is None:
+        print("Sustained the maximum of",good,"users")
+    else:
+        print("Capacity:",good,"users sustained,",bad,"not")
+    return good
 
 def main():
     parser = argument_parser()
     options = parser.parse_args()
-    usage_load_table=read_load_csv(options.csv_file)
-    run_test_dynamic(options.host,options.output_stats_file,usage_load_table)
+    if options.capacity:
+        run_capacity_search(options.host,options.output_stats_file,options)
+        return
+    if options.replay:
+        steps=load_profile.read_replay(options.replay)
+    else:
+        steps=load_profile.read_profile(options.csv_file,options.shape)
+    run_test_dynamic(options.host,options.output_stats_file,steps,options)
 
-main()
\ No newline at end of file
+main()